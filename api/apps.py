@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connects the signal handlers that keep the token cache in sync and
+        # start the periodic purge (if PURGE_INTERVAL is set), job recovery and
+        # the chat titler with the first request.
+        from . import authentication, jobs, purge, titles  # noqa: F401
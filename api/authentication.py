@@ -0,0 +1,108 @@
+import copy
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+SHARED_KEY_PREFIX = 'rgpt:authtoken:'
+
+
+class TokenUserCache:
+    """
+    token key -> (user, token), in a bounded in-process LRU with TTL and
+    optionally a shared Django cache behind it. Entries are dropped when
+    the token is deleted (logout) or its user is saved; other workers'
+    local entries expire after AUTH_TOKEN_CACHE_TTL at the latest.
+    """
+
+    def __init__(self, max_entries, ttl, alias=None):
+        self.local = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.shared = caches[alias] if alias else None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(SHARED_KEY_PREFIX + key)
+            if entry is not None:
+                with self._lock:
+                    self.local[key] = entry
+        return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self.local[key] = entry
+        if self.shared is not None:
+            self.shared.set(SHARED_KEY_PREFIX + key, entry, self.ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.local.pop(key, None)
+        if self.shared is not None and keys:
+            self.shared.delete_many([SHARED_KEY_PREFIX + key for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self.local.clear()
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenUserCache(
+            settings.AUTH_TOKEN_CACHE_MAX_ENTRIES, settings.AUTH_TOKEN_CACHE_TTL, settings.AUTH_TOKEN_CACHE_ALIAS
+        )
+    return _token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication without the Token + User query on every request
+    once a token has been seen. Each request gets its own copy of the
+    cached user, so views can't leak changes to each other.
+    """
+
+    def authenticate_credentials(self, key):
+        token_cache = get_token_cache()
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = super().authenticate_credentials(key)
+            token_cache.set(key, entry)
+
+        user, token = entry
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return copy.copy(user), copy.copy(token)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    get_token_cache().delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    get_token_cache().delete(*keys)
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting.startswith('AUTH_TOKEN_CACHE_'):
+        _token_cache = None
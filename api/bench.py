@@ -0,0 +1,120 @@
+"""Shared helpers for the `bench_*` management commands (and the tests that reuse them)."""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from google.auth import crypt, jwt
+from rest_framework.authtoken.models import Token
+
+from .models import User, ChatSession
+
+
+@contextmanager
+def bench_database():
+    """
+    Throwaway test database for a benchmark run. SQLite gets a temp file
+    instead of the usual in-memory DB so worker threads can share it.
+    """
+    path = None
+    if connection.vendor == 'sqlite':
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def create_bench_user(username='bench', sessions=1):
+    """A user with an auth token and `sessions` empty chats."""
+    user = User.objects.create(username=username, email=f'{username}@bench.local')
+    token = Token.objects.create(user=user)
+    chats = ChatSession.objects.bulk_create(ChatSession(user=user) for _ in range(sessions))
+    return user, token, chats
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def rss_kb(field='VmRSS'):
+    """A memory figure of this process from /proc (VmRSS, VmHWM = peak RSS), in kB; 0 where unavailable."""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def reset_peak_rss():
+    """Restarts VmHWM from the current RSS (Linux), so the next phase's peak can be measured in-process."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def serve_google_certs(certs, max_age=3600, latency=0.0):
+    """
+    Local stand-in for Google's certificate endpoint serving `certs` (key id
+    -> public PEM). Swap `server.certs` to rotate keys; `server.hits`
+    counts fetches. Call `server.shutdown()` when done.
+    """
+
+    class CertHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            server.hits += 1
+            body = json.dumps(server.certs).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', f'public, max-age={max_age}, must-revalidate')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CertHandler)
+    server.certs, server.hits = certs, 0
+    server.url = f'http://127.0.0.1:{server.server_port}/certs'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_google_id_token(private_pem, key_id, audience, email='bench@bench.local',
+                         picture='https://example.com/bench.png', expires_in=3600):
+    """A Google-style ID token signed with `private_pem`; a negative `expires_in` gives an expired one."""
+    now = int(time.time())
+    signer = crypt.RSASigner.from_string(private_pem, key_id=key_id)
+    payload = {
+        'iss': 'https://accounts.google.com', 'aud': audience, 'sub': '1234567890',
+        'email': email, 'given_name': 'Bench', 'family_name': 'User', 'picture': picture,
+        'iat': min(now, now + expires_in - 60), 'exp': now + expires_in,
+    }
+    return jwt.encode(signer, payload).decode()
@@ -0,0 +1,83 @@
+"""
+Incremental persistence of streamed bot replies. The reply row is created
+with the first chunk and marked `in_progress`; later chunks are appended in
+batches (every STREAM_CHECKPOINT_TOKENS chunks or STREAM_CHECKPOINT_INTERVAL
+seconds) with a database-side concat, so each checkpoint sends only the new
+text and nothing is rebuilt from scratch. A client that lost the stream
+can pick it up again from a character offset (see `read_from`).
+"""
+import time
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Length, Substr
+from django.utils import timezone
+
+from .models import ChatSession, Message, message_preview
+
+
+class ReplyCheckpointer:
+    def __init__(self, session, every_tokens=None, every_seconds=None, **fields):
+        self.session = session
+        self.fields = fields  # Extra Message fields, e.g. metadata
+        self.every_tokens = every_tokens or settings.STREAM_CHECKPOINT_TOKENS
+        self.every_seconds = every_seconds if every_seconds is not None else settings.STREAM_CHECKPOINT_INTERVAL
+        self.message = None
+        self.parts = []
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    async def add(self, text):
+        """Buffers one chunk; returns True when it triggered a checkpoint."""
+        self.parts.append(text)
+        self.pending += 1
+        if (self.message is None or self.pending >= self.every_tokens
+                or time.monotonic() - self.last_flush >= self.every_seconds):
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self, **fields):
+        delta = ''.join(self.parts[len(self.parts) - self.pending:]) if self.pending else ''
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        if self.message is None:
+            # The first checkpoint creates the row, so a reconnecting client has an id to resume.
+            self.message = await Message.objects.acreate(
+                session=self.session, text=delta, is_from_user=False, in_progress=True, **self.fields
+            )
+        elif delta or fields:
+            if delta:
+                fields['text'] = Concat(F('text'), Value(delta))
+            await Message.objects.filter(pk=self.message.pk).aupdate(**fields)
+
+    async def finish(self, interrupted=False):
+        """Writes what is left and clears `in_progress`. Returns the message, or None if nothing was generated."""
+        if self.message is None and not self.parts:
+            return None
+        fields = {'in_progress': False}
+        if interrupted:
+            fields['metadata'] = {**(self.fields.get('metadata') or {}), 'interrupted': True}
+        await self.flush(**fields)
+        self.message.text = self.text
+        self.message.in_progress = False
+        if 'metadata' in fields:
+            self.message.metadata = fields['metadata']
+        # The row was created with only the first chunk; give the sidebar the whole reply. Moving
+        # updated_at also tells cached copies of the chat (api.conditional) that the reply changed.
+        await ChatSession.objects.filter(pk=self.session.pk, last_message_at=self.message.timestamp).aupdate(
+            last_message_preview=message_preview(self.message.text), updated_at=timezone.now()
+        )
+        return self.message
+
+
+async def read_from(message_id, offset):
+    """(text after `offset`, total length, still in progress) for a message, fetching only the new part."""
+    row = await Message.objects.filter(pk=message_id).values(
+        'in_progress', length=Length('text'), tail=Substr('text', offset + 1)
+    ).afirst()
+    return row['tail'] or '', row['length'], row['in_progress']
@@ -0,0 +1,98 @@
+"""
+Conditional GET for the chat list, a chat's detail and its message list.
+
+Each view first reads a few validator columns in one indexed query, without
+touching the rows it would serialize, and hashes them into a strong ETag
+together with the user, the full path (so every page and `?messages=` mode
+has its own tag) and the Accept header. A request whose If-None-Match
+matches gets a 304 straight away; otherwise the view runs as usual and the
+response carries the ETag, Last-Modified and `Cache-Control: private,
+no-cache` so the browser revalidates before reusing it.
+
+The validators rely on ChatSession.updated_at moving with everything these
+responses show: Message.save() bumps it, as do edits through the API, the
+end of a streamed reply (api.checkpoints) and automatic titles
+(api.titles). Views that nest the user also include User.updated_at. While
+the newest message of a chat is still being streamed its text changes
+without any of that, so no validators are sent for the chat until it is
+done.
+
+Last-Modified has one-second resolution and doesn't see a chat being
+deleted, so If-Modified-Since is only honoured where it can be trusted
+and the ETag is what decides otherwise.
+"""
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import ChatSession, Message, User
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+class Validators:
+    def __init__(self, parts, last_modified, trust_last_modified=True):
+        self.parts = parts
+        self.last_modified = last_modified
+        self.trust_last_modified = trust_last_modified
+
+    def etag(self, request):
+        raw = '\x1f'.join([str(request.user.pk), request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+                           *(str(part) for part in self.parts)])
+        return '"%s"' % hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def chat_list_validators(user):
+    """The user's live chat count and newest updated_at, plus the user's own updated_at (rows nest the user)."""
+    live = Q(chat_sessions__is_deleted=False)
+    row = User.objects.filter(pk=user.pk).values('updated_at').annotate(
+        chats=Count('chat_sessions', filter=live), latest=Max('chat_sessions__updated_at', filter=live),
+    ).order_by('pk').first()
+    if row is None:
+        return None
+    last_modified = max(filter(None, (row['updated_at'], row['latest'])))
+    # A deleted chat only shows in the count, so If-Modified-Since alone can't be trusted here.
+    return Validators((row['chats'], row['latest'], row['updated_at']), last_modified, trust_last_modified=False)
+
+
+def chat_validators(user, session_id, nests_user=False):
+    """
+    One chat's updated_at and newest message (id and whether it is still
+    streaming), read with index seeks. None when the chat isn't the user's,
+    or while its newest message is in progress.
+    """
+    newest = Message.objects.filter(session=OuterRef('pk')).order_by('-timestamp', '-id')
+    fields = ['updated_at', 'user__updated_at'] if nests_user else ['updated_at']
+    row = ChatSession.objects.filter(pk=session_id, user=user, is_deleted=False).values(
+        *fields,
+        newest_id=Subquery(newest.values('id')[:1]),
+        newest_in_progress=Subquery(newest.values('in_progress')[:1]),
+    ).first()
+    if row is None or row['newest_in_progress']:
+        return None
+    last_modified = max(row[field] for field in fields)
+    return Validators((row['newest_id'], *(row[field] for field in fields)), last_modified)
+
+
+def not_modified(request, validators):
+    """A 304 for `request` if the client's copy is current, else None."""
+    if validators is None:
+        return None
+    response = get_conditional_response(
+        request._request, etag=validators.etag(request),
+        last_modified=int(validators.last_modified.timestamp()) if validators.trust_last_modified else None,
+    )
+    if response is not None:
+        set_validators(request, response, validators)
+    return response
+
+
+def set_validators(request, response, validators):
+    if validators is None or response.status_code not in (200, 304):
+        return response
+    response['ETag'] = validators.etag(request)
+    response['Last-Modified'] = http_date(validators.last_modified.timestamp())
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
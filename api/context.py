@@ -0,0 +1,156 @@
+"""
+Conversation context for a chat turn: the most recent exchanges verbatim plus
+the older messages in condensed form, kept under a token budget.
+
+Older messages are folded into a rolling summary stored on the ChatSession by
+api.summaries, off the chat path: each turn offers the chat once messages
+have left its recent window, and the turn is sent the summary plus transcript
+lines of the few messages not folded in yet. Until a chat has a summary (the
+summarizer is off, its model fails, or it hasn't caught up), the turn gets a
+truncated transcript instead: one line per older message, each cut to
+TRANSCRIPT_LINE_CHARS characters, with the oldest lines dropped once it
+outgrows CONTEXT_TRANSCRIPT_TOKENS. The transcript is stored too and only
+ever extended with the messages that have just fallen out of the recent
+window, so a turn reads a bounded number of rows no matter how long the
+conversation is.
+"""
+from django.conf import settings
+
+from . import summaries
+from .models import ChatSession
+
+HISTORY_FIELDS = ('id', 'session_id', 'text', 'is_from_user')
+TRANSCRIPT_LINE_CHARS = 240
+TRANSCRIPT_HEADER = (
+    f"Earlier in our conversation (each message cut to {TRANSCRIPT_LINE_CHARS} characters; "
+    "the oldest may be left out):"
+)
+SUMMARY_HEADER = "Summary of our conversation so far:"
+UNSUMMARIZED_HEADER = f"And after that (each message cut to {TRANSCRIPT_LINE_CHARS} characters):"
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token); good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def history_entry(is_from_user, text):
+    return {"role": "user" if is_from_user else "model", "parts": [{"text": text}]}
+
+
+def transcript_line(message):
+    text = ' '.join(message.text.split())
+    if len(text) > TRANSCRIPT_LINE_CHARS:
+        text = text[:TRANSCRIPT_LINE_CHARS - 1] + '…'
+    speaker = 'User' if message.is_from_user else 'RGPT'
+    return f'{speaker}: {text}'
+
+
+def keep_newest_lines(lines, budget):
+    """Keeps the newest lines that fit in `budget` tokens; older ones are dropped, not condensed."""
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += estimate_tokens(line)
+        if used > budget:
+            break
+        kept.append(line)
+    return kept[::-1]
+
+
+def update_transcript(session, window_start_id):
+    """
+    Appends messages older than `window_start_id` that are not in the
+    session's stored transcript yet, drops its oldest lines past the budget
+    and returns the transcript text.
+    """
+    older = session.messages.filter(id__lt=window_start_id)
+    if session.transcript_until_id is not None:
+        older = older.filter(id__gt=session.transcript_until_id)
+
+    new_lines, last_id = [], None
+    for message in older.order_by('id').only(*HISTORY_FIELDS).iterator():
+        new_lines.append(transcript_line(message))
+        last_id = message.id
+    if last_id is None:
+        return session.context_transcript
+
+    lines = session.context_transcript.splitlines() + new_lines
+    transcript = '\n'.join(keep_newest_lines(lines, settings.CONTEXT_TRANSCRIPT_TOKENS))
+    # Only write if a concurrent turn hasn't already moved the transcript forward.
+    ChatSession.objects.filter(pk=session.pk, transcript_until_id=session.transcript_until_id).update(
+        context_transcript=transcript, transcript_until_id=last_id
+    )
+    session.context_transcript, session.transcript_until_id = transcript, last_id
+    return transcript
+
+
+def unsummarized_lines(session, window_start_id):
+    """
+    Transcript lines of the older messages that are not in the summary yet,
+    the newest that fit CONTEXT_TRANSCRIPT_TOKENS. The summarizer normally
+    keeps up, so these are a turn or two; the row cap bounds them when it doesn't.
+    """
+    older = session.messages.filter(id__gt=session.summarized_until_id, id__lt=window_start_id)
+    newest = list(older.only(*HISTORY_FIELDS).order_by('-id')[:settings.SUMMARY_MAX_MESSAGES])[::-1]
+    return keep_newest_lines([transcript_line(message) for message in newest], settings.CONTEXT_TRANSCRIPT_TOKENS)
+
+
+def older_context(session, window_start_id):
+    """
+    The older messages as one text for the model: the summary and the lines
+    not folded into it yet, or else the transcript. Offers the chat to the
+    summarizer while messages that left the window are not in the summary.
+    """
+    if session.summarized_until_id is None:
+        transcript = update_transcript(session, window_start_id)
+        if transcript:
+            summaries.offer(session.pk, window_start_id)
+            return f"{TRANSCRIPT_HEADER}\n{transcript}"
+        return ''
+
+    lines = unsummarized_lines(session, window_start_id)
+    if not lines:
+        return f"{SUMMARY_HEADER}\n{session.context_summary}"
+    summaries.offer(session.pk, window_start_id)
+    return f"{SUMMARY_HEADER}\n{session.context_summary}\n\n{UNSUMMARIZED_HEADER}\n" + '\n'.join(lines)
+
+
+def build_history(session, before_id=None):
+    """
+    History for the model, oldest first, for a turn whose user message has id
+    `before_id`: the summary or transcript of older messages (as a user/model
+    exchange) followed by up to CONTEXT_RECENT_TURNS recent exchanges that fit
+    the token budget.
+    """
+    recent = session.messages.exclude(text='').only(*HISTORY_FIELDS).order_by('-id')
+    if before_id is not None:
+        recent = recent.filter(id__lt=before_id)
+    # Messages that are already in the summary or the transcript stay there.
+    covered = [until_id for until_id in (session.summarized_until_id, session.transcript_until_id)
+               if until_id is not None]
+    if covered:
+        recent = recent.filter(id__gt=max(covered))
+    recent = list(recent[:settings.CONTEXT_RECENT_TURNS * 2])[::-1]
+
+    # Drop the oldest messages until the window fits and opens with a user turn.
+    budget = settings.CONTEXT_TOKEN_BUDGET - settings.CONTEXT_TRANSCRIPT_TOKENS
+    if session.summarized_until_id is not None:
+        budget -= settings.CONTEXT_SUMMARY_TOKENS
+    used = sum(estimate_tokens(m.text) for m in recent)
+    while recent and (used > budget or not recent[0].is_from_user):
+        used -= estimate_tokens(recent.pop(0).text)
+
+    window_start_id = recent[0].id if recent else before_id
+    if window_start_id is not None:
+        older = older_context(session, window_start_id)
+    elif session.summarized_until_id is not None:
+        older = f"{SUMMARY_HEADER}\n{session.context_summary}"
+    else:
+        older = f"{TRANSCRIPT_HEADER}\n{session.context_transcript}" if session.context_transcript else ''
+
+    history = []
+    if older:
+        history.append(history_entry(True, older))
+        history.append(history_entry(False, "Got it, I'll keep that in mind."))
+    history.extend(history_entry(m.is_from_user, m.text) for m in recent)
+    return history
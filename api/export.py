@@ -0,0 +1,198 @@
+"""
+Conversations as NDJSON, one JSON object per line: a header, then each
+session followed by its messages, oldest first.
+
+    {"type": "export", "version": 1}
+    {"type": "session", "id": 7, "user": "alice", "title": ..., "created_at": ...}
+    {"type": "message", "id": 90, "session": 7, "text": ..., "timestamp": ..., "feedback": 1}
+
+Export reads sessions and messages with two server-side cursors walked side
+by side (messages in session index order), so memory stays flat however many
+rows there are. Import creates rows with bulk_create in batches and then
+writes the original timestamps over the auto_now ones with bulk_update; ids
+are new.
+"""
+import json
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatSession, Message, MessageFeedback, UploadBlob, User
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+FORMAT_VERSION = 1
+
+SESSION_FIELDS = ['id', 'user__username', 'title', 'created_at', 'updated_at', 'pinned', 'is_deleted', 'deleted_at',
+                  'message_count', 'last_message_at', 'last_message_preview']
+MESSAGE_FIELDS = ['id', 'session_id', 'text', 'is_from_user', 'timestamp', 'file_upload', 'metadata', 'in_progress',
+                  'feedback__rating']
+
+
+class ExportFormatError(ValueError):
+    pass
+
+
+def encode_value(value):
+    # Full isoformat: DjangoJSONEncoder would cut timestamps to milliseconds.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(record):
+    return json.dumps(record, default=encode_value, ensure_ascii=False) + '\n'
+
+
+def export_lines(sessions, chunk_size=2000):
+    """NDJSON lines (str) for the sessions in the `sessions` queryset and all their messages."""
+    yield dumps({'type': 'export', 'version': FORMAT_VERSION})
+    session_rows = sessions.order_by('id').values(*SESSION_FIELDS).iterator(chunk_size=chunk_size)
+    # Same order as message_session_ts_id_idx, so this is an index walk, not a sort.
+    message_rows = (Message.objects.filter(session__in=sessions.order_by().values('id'))
+                    .order_by('session_id', 'timestamp', 'id').values(*MESSAGE_FIELDS).iterator(chunk_size=chunk_size))
+    message = next(message_rows, None)
+    for row in session_rows:
+        row['user'] = row.pop('user__username')
+        yield dumps({'type': 'session', **row})
+        while message is not None and message['session_id'] <= row['id']:
+            if message['session_id'] == row['id']:
+                message['session'] = message.pop('session_id')
+                message['feedback'] = message.pop('feedback__rating')
+                message['file_upload'] = message['file_upload'] or None
+                yield dumps({'type': 'message', **message})
+            message = next(message_rows, None)
+
+
+def parse_datetime_fields(record, *names):
+    for name in names:
+        if record.get(name):
+            record[name] = datetime.fromisoformat(record[name])
+    return record
+
+
+class Importer:
+    """
+    Feeds parsed NDJSON records into the database in batches. Sessions belong
+    to `user` if given, else to the user named in each record (who must
+    exist). Call `close()` at the end to write what is still buffered.
+    """
+
+    def __init__(self, user=None, batch_size=2000):
+        self.user = user
+        self.batch_size = batch_size
+        self.users = {}
+        self.session_ids = {}  # exported session id -> new id
+        self.owners = {}  # new session id -> user id, for feedback rows
+        self.sessions = []
+        self.messages = []
+        self.ratings = []
+        self.counts = {'sessions': 0, 'messages': 0, 'feedback': 0}
+
+    def owner(self, username):
+        if self.user is not None:
+            return self.user
+        if username not in self.users:
+            self.users[username] = User.objects.filter(username=username).first()
+            if self.users[username] is None:
+                raise ExportFormatError(f"No user named {username!r}; pass a user to import into.")
+        return self.users[username]
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind == 'session':
+            self.add_session(record)
+        elif kind == 'message':
+            self.add_message(record)
+        elif kind == 'export':
+            if record.get('version') != FORMAT_VERSION:
+                raise ExportFormatError(f"Unsupported export version {record.get('version')!r}.")
+        else:
+            raise ExportFormatError(f"Unknown record type {kind!r}.")
+
+    def add_session(self, record):
+        parse_datetime_fields(record, 'created_at', 'updated_at', 'deleted_at', 'last_message_at')
+        for name in ('created_at', 'updated_at'):
+            record[name] = record.get(name) or timezone.now()
+        session = ChatSession(
+            user=self.owner(record.get('user')),
+            **{field: record[field] for field in SESSION_FIELDS[2:] if field in record},
+        )
+        self.sessions.append((record['id'], session))
+        if len(self.sessions) >= self.batch_size:
+            self.flush_sessions()
+
+    def add_message(self, record):
+        if record['session'] not in self.session_ids:
+            self.flush_sessions()  # Its session is still in the buffer (or was never exported)
+        session_id = self.session_ids.get(record['session'])
+        if session_id is None:
+            raise ExportFormatError(
+                f"Message {record.get('id')} refers to session {record['session']} before it appears."
+            )
+        parse_datetime_fields(record, 'timestamp')
+        message = Message(
+            session_id=session_id, text=record['text'], is_from_user=record['is_from_user'],
+            timestamp=record.get('timestamp') or timezone.now(), file_upload=record.get('file_upload') or None,
+            metadata=record.get('metadata'), in_progress=record.get('in_progress', False),
+        )
+        self.messages.append(message)
+        self.ratings.append(record.get('feedback'))
+        if len(self.messages) >= self.batch_size:
+            self.flush_messages()
+
+    def flush_sessions(self):
+        if not self.sessions:
+            return
+        stamps = [(session.created_at, session.updated_at) for _, session in self.sessions]
+        with transaction.atomic():
+            created = ChatSession.objects.bulk_create([session for _, session in self.sessions])
+            # bulk_create stamps auto_now fields with the current time; put the exported ones back.
+            for session, (created_at, updated_at) in zip(created, stamps):
+                session.created_at, session.updated_at = created_at, updated_at
+            ChatSession.objects.bulk_update(created, ['created_at', 'updated_at'])
+        for (exported_id, _), session in zip(self.sessions, created):
+            self.session_ids[exported_id] = session.pk
+            self.owners[session.pk] = session.user_id
+        self.counts['sessions'] += len(created)
+        self.sessions = []
+
+    def flush_messages(self):
+        if not self.messages:
+            return
+        stamps = [message.timestamp for message in self.messages]
+        with transaction.atomic():
+            created = Message.objects.bulk_create(self.messages)
+            for message, timestamp in zip(created, stamps):
+                message.timestamp = timestamp
+            Message.objects.bulk_update(created, ['timestamp'])
+            # bulk_create skips Message.save(), which counts references to uploaded files.
+            UploadBlob.add_references([message.file_upload.name for message in created if message.file_upload])
+            feedback = [
+                MessageFeedback(message_id=message.pk, user_id=self.owners[message.session_id], rating=rating)
+                for message, rating in zip(created, self.ratings) if rating is not None
+            ]
+            MessageFeedback.objects.bulk_create(feedback)
+        self.counts['messages'] += len(created)
+        self.counts['feedback'] += len(feedback)
+        self.messages, self.ratings = [], []
+
+    def close(self):
+        self.flush_sessions()
+        self.flush_messages()
+        return self.counts
+
+
+def import_lines(lines, user=None, batch_size=2000):
+    """Imports NDJSON lines in one transaction. Returns row counts by kind."""
+    importer = Importer(user=user, batch_size=batch_size)
+    with transaction.atomic():
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                raise ExportFormatError(f"Line {number}: {exc}") from exc
+            importer.add(record)
+        return importer.close()
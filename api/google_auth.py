@@ -0,0 +1,175 @@
+"""
+Google ID-token verification without a certificate fetch per login. Google's
+signing certificates are kept in memory and on disk for as long as their
+Cache-Control max-age allows, refreshed in the background shortly before they
+expire, and fetched over one pooled HTTP session.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from google.auth import exceptions as google_exceptions
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+DEFAULT_MAX_AGE = 3600
+MAX_AGE_RE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_max_age(cache_control):
+    match = MAX_AGE_RE.search(cache_control or '')
+    return int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class GoogleCertCache:
+    """
+    key id -> PEM certificate for the token issuer. `get()` only blocks on the
+    network when there are no unexpired certificates at all; concurrent
+    callers then share a single fetch. Within `refresh_ahead` seconds of
+    expiry one background thread refreshes while callers keep the current set.
+    Forced refetches (unknown key id) happen at most once per `min_refetch`
+    seconds so forged tokens can't turn every login into a fetch.
+    """
+
+    def __init__(self, url, cache_file=None, session=None, timeout=5, refresh_ahead=300, min_refetch=60):
+        self.url = url
+        self.cache_file = cache_file
+        self.session = session or make_session(pool_size=4)
+        self.timeout = timeout
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch = min_refetch
+        self.certs = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self.forced_at = 0.0
+        self.fetches = 0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._load_file()
+
+    def _load_file(self):
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, encoding='utf-8') as fh:
+                data = json.load(fh)
+            certs, expires_at = data['certs'], float(data['expires_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if expires_at > time.time():
+            self.certs, self.expires_at = certs, expires_at
+
+    def _save_file(self):
+        if not self.cache_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, encoding='utf-8') as fh:
+                json.dump({'certs': self.certs, 'expires_at': self.expires_at}, fh)
+            os.replace(fh.name, self.cache_file)
+        except OSError:
+            logger.warning("Could not write Google certificate cache to %s", self.cache_file, exc_info=True)
+
+    def fetch(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        certs = response.json()
+        max_age = parse_max_age(response.headers.get('Cache-Control'))
+        with self._lock:
+            self.certs = certs
+            self.fetched_at = time.time()
+            self.expires_at = self.fetched_at + max_age
+            self.fetches += 1
+        self._save_file()
+        return certs
+
+    def _refresh_in_background(self):
+        try:
+            self.fetch()
+        except Exception:
+            logger.warning("Background refresh of Google certificates failed", exc_info=True)
+        finally:
+            self._refreshing = False
+
+    def get(self, force=False):
+        now = time.time()
+        if not force and now < self.expires_at:
+            if now >= self.expires_at - self.refresh_ahead and not self._refreshing:
+                with self._lock:
+                    start = not self._refreshing
+                    self._refreshing = True
+                if start:
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+            return self.certs
+
+        with self._fetch_lock:
+            # Another request may have fetched while this one waited.
+            now = time.time()
+            if now < self.expires_at and (not force or now - self.forced_at < self.min_refetch):
+                return self.certs
+            if force:
+                self.forced_at = now
+            return self.fetch()
+
+
+_cert_cache = None
+_cert_cache_lock = threading.Lock()
+
+
+def get_cert_cache():
+    global _cert_cache
+    if _cert_cache is None:
+        with _cert_cache_lock:
+            if _cert_cache is None:
+                _cert_cache = GoogleCertCache(
+                    settings.GOOGLE_CERTS_URL,
+                    cache_file=settings.GOOGLE_CERTS_CACHE_FILE,
+                    session=make_session(settings.GOOGLE_HTTP_POOL_SIZE),
+                )
+    return _cert_cache
+
+
+@receiver(setting_changed)
+def reset_cert_cache(setting, **kwargs):
+    global _cert_cache
+    if setting.startswith('GOOGLE_'):
+        _cert_cache = None
+
+
+def verify_google_id_token(token, audience=None):
+    """
+    Same checks as google.oauth2.id_token.verify_oauth2_token (signature,
+    expiry, audience, issuer) against the cached certificates. An unknown key
+    id forces one refetch, which covers Google rotating keys early.
+    """
+    audience = audience or settings.GOOGLE_CLIENT_ID
+    cert_cache = get_cert_cache()
+    try:
+        idinfo = jwt.decode(token, certs=cert_cache.get(), audience=audience)
+    except google_exceptions.MalformedError as exc:
+        if 'Certificate for key id' not in str(exc):
+            raise
+        idinfo = jwt.decode(token, certs=cert_cache.get(force=True), audience=audience)
+    if idinfo.get('iss') not in GOOGLE_ISSUERS:
+        raise google_exceptions.GoogleAuthError(f"Wrong issuer. 'iss' should be one of {GOOGLE_ISSUERS}")
+    return idinfo
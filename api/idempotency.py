@@ -0,0 +1,92 @@
+"""
+`Idempotency-Key` support for message creation, so a double click or a client
+retry doesn't save the user's message twice or pay for a second reply.
+
+The first request with a key claims it (a unique row per user and key) and
+runs as usual, noting the messages it creates and finally its response body.
+A repeat of a finished request gets that body back. A repeat that arrives
+while the first is still running attaches to it: it waits for the stored
+response, or, when streaming, follows the same reply as it is checkpointed
+(api.checkpoints), so it works across workers. A request that fails releases
+its key so it can be retried. Keys expire after IDEMPOTENCY_KEY_TTL seconds.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_key(request):
+    """The request's Idempotency-Key, or None. Raises ValueError for an empty or overlong key."""
+    key = request.META.get(HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.")
+    return key
+
+
+def request_fingerprint(request, session_id):
+    """What a repeat must match: the chat, the text and the upload (by name and size)."""
+    upload = request.FILES.get('file_upload')
+    parts = [str(session_id), request.data.get('text') or '']
+    if upload is not None:
+        parts += [upload.name, str(upload.size)]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def expired_before():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def claim(user, key, fingerprint):
+    """(record, created): a new record if the key is free (or expired), else the existing one."""
+    IdempotencyKey.objects.filter(user=user, key=key, created_at__lt=expired_before()).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            return claim(user, key, fingerprint)  # Released between our insert and this read
+        return record, False
+
+
+def note_messages(record, user_message=None, bot_message=None):
+    fields = {}
+    if user_message is not None:
+        fields['user_message'] = user_message
+    if bot_message is not None:
+        fields['bot_message'] = bot_message
+    IdempotencyKey.objects.filter(pk=record.pk).update(**fields)
+
+
+def complete(record, data, bot_message=None):
+    fields = {'response': data}
+    if bot_message is not None:
+        fields['bot_message'] = bot_message
+    IdempotencyKey.objects.filter(pk=record.pk).update(**fields)
+
+
+def release(record):
+    """Forgets a key whose request failed, so the client can retry it."""
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+def progress(record_pk):
+    """{'user_message_id', 'bot_message_id', 'response'} of a record, or None once it was released."""
+    return IdempotencyKey.objects.filter(pk=record_pk).values('user_message_id', 'bot_message_id', 'response').first()
+
+
+def delete_expired():
+    """Deletes expired keys. Returns how many."""
+    return IdempotencyKey.objects.filter(created_at__lt=expired_before()).delete()[0]
@@ -0,0 +1,239 @@
+"""
+Preprocessing for uploaded images before they go to the model. Uploads are
+checked against a byte and pixel budget from their header alone, decoded at
+reduced scale where the format allows it (JPEG draft mode), downscaled to
+IMAGE_MAX_SIDE, re-encoded as JPEG without EXIF and handed to the model as
+bytes, so a phone photo never sits in memory at full resolution. The result
+is cached per content digest, so resending the same picture skips decoding.
+
+The original is stored too (it is what the chat shows), so strip_metadata()
+drops its EXIF, XMP and IPTC blocks first: they can carry the GPS position
+and the camera's serial number.
+"""
+import io
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from .storage import ContentAddressedStorage, file_digest, get_upload_storage
+
+# EXIF orientation -> the transpose that makes the pixels upright (as in ImageOps.exif_transpose).
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# JPEG segments holding EXIF or XMP (APP1), IPTC (APP13) and comments (COM).
+JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+JPEG_SOS = 0xDA
+# Image.info keys Pillow fills with metadata blocks when it reads other formats.
+METADATA_INFO_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'iptc', 'photoshop')
+
+# `original_size` is None when the image came from the derived-artifact cache.
+ProcessedImage = namedtuple('ProcessedImage', ['data', 'mime_type', 'width', 'height', 'original_size'])
+
+
+class ImageRejected(ValueError):
+    """The upload is not an image we accept; the message is safe to show the user."""
+
+
+def flatten(img):
+    """RGB copy of `img`, with any transparency composited onto white."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def check_upload_size(upload, max_bytes=None):
+    max_bytes = max_bytes or settings.IMAGE_MAX_UPLOAD_BYTES
+    size = getattr(upload, 'size', None)
+    if size is not None and size > max_bytes:
+        raise ImageRejected(f"Image is too large ({size // 1024 // 1024} MB); the limit is {max_bytes // 1024 // 1024} MB.")
+
+
+def check_pixels(img, max_pixels=None):
+    max_pixels = max_pixels or settings.IMAGE_MAX_PIXELS
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageRejected(
+            f"Image is too large ({width}x{height}); the limit is {max_pixels // 1_000_000} megapixels."
+        )
+
+
+def preprocess_image(upload, max_side=None, max_pixels=None, max_bytes=None, quality=None):
+    """
+    Returns a ProcessedImage for the uploaded file, or raises ImageRejected.
+    Leaves the upload rewound so it can still be saved as the message file.
+    """
+    max_side = max_side or settings.IMAGE_MAX_SIDE
+    max_pixels = max_pixels or settings.IMAGE_MAX_PIXELS
+    max_bytes = max_bytes or settings.IMAGE_MAX_UPLOAD_BYTES
+    quality = quality or settings.IMAGE_JPEG_QUALITY
+
+    check_upload_size(upload, max_bytes)
+    try:
+        upload.seek(0)
+        img = Image.open(upload)  # Reads the header only; the upload stays open for saving
+        width, height = img.size
+        check_pixels(img, max_pixels)
+        orientation = img.getexif().get(ExifTags.Base.Orientation)
+        scale = min(max_side / width, max_side / height, 1)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # JPEG decodes straight at 1/2, 1/4 or 1/8 scale as long as that still covers `target`.
+        img.draft('RGB', target)
+        img.thumbnail(target, reducing_gap=2.0)
+        img = flatten(img)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImageRejected(f"Could not read the uploaded image: {e}")
+    finally:
+        upload.seek(0)
+
+    if orientation in ORIENTATION_TRANSPOSE:
+        # EXIF is dropped on re-encode, so bake the rotation into the pixels.
+        img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=quality, optimize=True)
+    return ProcessedImage(out.getvalue(), 'image/jpeg', img.width, img.height, (width, height))
+
+
+def jpeg_segments(upload):
+    """
+    [(offset, length, marker)] of the segments before a JPEG's image data,
+    and the offset where the data starts; None when the header can't be walked.
+    """
+    upload.seek(0)
+    if upload.read(2) != b'\xff\xd8':
+        return None
+    segments = []
+    while True:
+        offset = upload.tell()
+        header = upload.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        if header[1] == JPEG_SOS:
+            return segments, offset
+        length = int.from_bytes(header[2:], 'big')
+        if length < 2:
+            return None
+        segments.append((offset, length + 2, header[1]))
+        upload.seek(offset + length + 2)
+
+
+def exif_segment(orientation):
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = orientation
+    payload = exif.tobytes()
+    return b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+
+def strip_metadata(upload):
+    """
+    The upload without EXIF, XMP or IPTC metadata, for storing. A JPEG loses
+    only those segments, so the image data is copied as-is, and keeps a
+    minimal EXIF block with just its orientation so it still shows upright.
+    Any other image that carries metadata is re-saved as PNG, which is
+    lossless. An image with nothing to strip is returned unchanged.
+    """
+    try:
+        upload.seek(0)
+        with Image.open(upload) as img:
+            orientation = img.getexif().get(ExifTags.Base.Orientation)
+            if img.format == 'JPEG':
+                walked = jpeg_segments(upload)
+                if walked is not None:
+                    return strip_jpeg(upload, *walked, orientation)
+            elif not img.getexif() and not any(key in img.info for key in METADATA_INFO_KEYS):
+                return upload
+            check_pixels(img)  # Re-saving decodes the whole image
+            img = ImageOps.exif_transpose(img)
+            for key in METADATA_INFO_KEYS:
+                img.info.pop(key, None)
+            out = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            img.save(out, format='PNG', optimize=False)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImageRejected(f"Could not read the uploaded image: {e}")
+    finally:
+        upload.seek(0)
+    out.seek(0)
+    name = upload.name.rsplit('.', 1)[0] + '.png'
+    return File(out, name=name)
+
+
+def strip_jpeg(upload, segments, data_offset, orientation):
+    if not any(marker in JPEG_METADATA_MARKERS for _, _, marker in segments):
+        return upload
+    out = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    out.write(b'\xff\xd8')
+    kept = [(offset, length) for offset, length, marker in segments if marker not in JPEG_METADATA_MARKERS]
+    # The EXIF block goes right after SOI, or after the JFIF APP0 segment when there is one.
+    leading = 1 if segments and segments[0][2] == 0xE0 else 0
+    for index, (offset, length) in enumerate(kept):
+        if index == leading and orientation and orientation != 1:
+            out.write(exif_segment(orientation))
+        upload.seek(offset)
+        out.write(upload.read(length))
+    if len(kept) <= leading and orientation and orientation != 1:
+        out.write(exif_segment(orientation))
+    upload.seek(data_offset)
+    shutil.copyfileobj(upload, out, 64 * 1024)
+    upload.seek(0)
+    out.seek(0)
+    return File(out, name=upload.name)
+
+
+def preprocess_upload(upload):
+    """
+    preprocess_image() through the upload storage's per-digest artifact
+    cache. The digest is kept on the upload, so saving it afterwards doesn't
+    hash it again.
+    """
+    storage = get_upload_storage()
+    if not isinstance(storage, ContentAddressedStorage):
+        return preprocess_image(upload)
+
+    check_upload_size(upload)
+    digest = file_digest(upload)
+    key = f'model-{settings.IMAGE_MAX_SIDE}-q{settings.IMAGE_JPEG_QUALITY}.jpg'
+    data = storage.get_derived(digest, key)
+    if data is not None:
+        with Image.open(io.BytesIO(data)) as img:
+            return ProcessedImage(data, 'image/jpeg', img.width, img.height, None)
+
+    processed = preprocess_image(upload)
+    storage.save_derived(digest, key, processed.data)
+    return processed
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Bounded pool for image work, so decoding never runs on the event loop or the shared sync thread."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='rgpt-image')
+    return _executor
+
+
+@receiver(setting_changed)
+def reset_executor(setting, **kwargs):
+    global _executor
+    if setting == 'IMAGE_WORKERS' and _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,101 @@
+"""
+Rule-based matcher for the fixed replies the RGPT persona is told to give
+word for word (greetings, "who made you", questions about Ravi). A match is
+answered locally and never reaches the model.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+
+GREETING_REPLY = "Hi there! Welcome to RGPT. Yaha aap kisi bhi samasya ka samadhan khoj sakte hain."
+CREATOR_REPLY = "I was created by Ravi Kumar Gupta (EDWARD7780)."
+ABOUT_RAVI_REPLY = (
+    "Ravi Kumar Gupta is a passionate developer from Techno Main Salt Lake, currently studying CSE B. "
+    "He’s skilled in Django, C++, and loves Competitive Programming. Online handle: EDWARD7780 💻."
+)
+RAVI_CONTACT_REPLY = (
+    "Ravi's birthday is on October 8th, 2005. You can contact him at ravi5258p@gmail.com "
+    "for professional queries. 🙂"
+)
+
+Intent = namedtuple('Intent', ['name', 'reply', 'first_message_only'])
+
+# Spelling variants folded to one form before matching (Hinglish is rarely spelled the same way twice).
+SYNONYMS = {
+    'hiya': 'hi', 'hallo': 'hello', 'namaskar': 'namaste', 'namastey': 'namaste',
+    'नमस्ते': 'namaste', 'नमस्कार': 'namaste',
+    'kon': 'kaun', 'koun': 'kaun', 'kaon': 'kaun', 'कौन': 'kaun',
+    'tumhe': 'tumko', 'tumhein': 'tumko', 'tujhe': 'tumko', 'aapko': 'tumko', 'apko': 'tumko',
+    'bnaya': 'banaya', 'banya': 'banaya', 'बनाया': 'banaya', 'kisnay': 'kisne', 'किसने': 'kisne',
+    'h': 'hai', 'hain': 'hai', 'है': 'hai', 'u': 'you', 'ur': 'your', 'रवि': 'ravi',
+    'bday': 'birthday', 'b-day': 'birthday', 'janamdin': 'birthday', 'janmdin': 'birthday',
+    'mail': 'email', 'e-mail': 'email', 'phone': 'number', 'whats': 'what s', 'whos': 'who s',
+}
+FILLER = r'(?: (?:please|pls|plz|bhai|bro|yaar|ji|rgpt|there|dear|buddy|sir|everyone|all))*'
+RAVI = r'ravi(?: kumar)?(?: gupta)?'
+CONTACT = r'(?:birthday|contact(?: details| info| number)?|email(?: id| address)?|number)'
+
+PATTERNS = [
+    (Intent('greeting', GREETING_REPLY, True), re.compile(
+        r'(?:hi+|he+y+|he+l+o+|hola|namaste|salaam|salam|yo|go+d (?:morning|afternoon|evening))' + FILLER
+    )),
+    (Intent('creator', CREATOR_REPLY, False), re.compile(
+        r'(?:who (?:made|created|built|developed|owns|trained) you'
+        r'|who (?:is|s) your (?:creator|maker|owner|developer|founder)'
+        r'|(?:tumko )?kisne (?:tumko )?banaya(?: hai)?(?: tumko)?'
+        r'|rgpt ka (?:owner|creator|malik|developer) kaun hai|rgpt kisne banaya(?: hai)?)' + FILLER
+    )),
+    (Intent('ravi_contact', RAVI_CONTACT_REPLY, False), re.compile(
+        r'(?:(?:what (?:is|s) |tell me |give me |share )?' + RAVI + r'(?: s| ka| ki| ke)? ' + CONTACT
+        + r'(?: kya| kab)?(?: hai)?(?: batao)?'
+        r'|when (?:is|s) ' + RAVI + r'(?: s)? birthday'
+        r'|how (?:can|do) i contact ' + RAVI + r')' + FILLER
+    )),
+    (Intent('about_ravi', ABOUT_RAVI_REPLY, False), re.compile(
+        r'(?:who (?:is|s) ' + RAVI + r'|(?:tell me|batao) about ' + RAVI + r'|' + RAVI + r' kaun hai'
+        r'|' + RAVI + r' ke (?:baare|bare) (?:mein|me) batao|who (?:is|s) edward7780|edward7780 kaun hai)' + FILLER
+    )),
+]
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def normalize(text):
+    """Casefolds, strips accents, punctuation and emoji, squeezes stretched letters and folds synonyms."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch) or '\u0900' <= ch <= '\u097f')
+    text = re.sub(r'[^\w\s\u0900-\u097f-]|_', ' ', text)
+    text = re.sub(r'([a-z])\1{2,}', r'\1\1', text)  # "hiiiii" -> "hii"; patterns allow repeats
+    words = [SYNONYMS.get(word, word) for word in text.split()]
+    return ' '.join(words)
+
+
+def match_intent(text, is_first_message=lambda: True):
+    """
+    Returns the canned Intent for `text`, or None when the model should answer.
+    `is_first_message` is a callable so the DB is only asked when a
+    first-message-only intent (the greeting) actually matched.
+    """
+    normalized = normalize(text or '')
+    for intent, pattern in PATTERNS:
+        if pattern.fullmatch(normalized):
+            if intent.first_message_only and not is_first_message():
+                break
+            with _stats_lock:
+                _stats[intent.name] += 1
+            return intent
+    with _stats_lock:
+        _stats['miss'] += 1
+    return None
+
+
+def intent_stats():
+    """Hit counts per intent plus misses, for this worker."""
+    with _stats_lock:
+        stats = dict(_stats)
+    hits = sum(count for name, count in stats.items() if name != 'miss')
+    total = hits + stats.get('miss', 0)
+    return {'hits': hits, 'misses': stats.get('miss', 0),
+            'hit_rate': hits / total if total else 0.0, 'by_intent': stats}
@@ -0,0 +1,262 @@
+"""
+Job mode for chat turns: the view saves the user's message, records a
+GenerationJob and answers 202 straight away; the reply is generated on a
+bounded pool of worker threads in this process and saved exactly as the
+synchronous path saves it. Clients poll (or long-poll) /api/jobs/<id>/.
+
+The job table is the queue, so there is no broker: a worker claims a pending
+job with a conditional UPDATE and holds it under a lease (JOB_LEASE seconds)
+that it renews while the model runs. Jobs whose lease ran out belonged to a
+worker that died; a recovery thread in every process puts them back to
+pending (failing them after JOB_MAX_ATTEMPTS) and feeds pending jobs to its
+pool, so a restart or another worker picks them up. The bot message and the
+`done` status are written in one transaction, and only by the current lease
+holder, so each job produces one reply.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.signals import request_started, setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import llm, metrics
+from .context import build_history
+from .images import preprocess_upload
+from .models import GenerationJob, Message
+from .persona import get_persona
+from .ratelimit import get_rate_limiter, turn_tokens
+from .response_cache import get_response_cache
+from .storage import digest_of
+
+logger = logging.getLogger(__name__)
+
+Status = GenerationJob.Status
+FINISHED = (Status.DONE, Status.FAILED)
+
+
+def wants_job(request):
+    """True when the client asked for job mode via `?job=1` or `Prefer: respond-async`."""
+    if request.query_params.get('job', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in request.META.get('HTTP_PREFER', '')
+
+
+def lease_end():
+    return timezone.now() + timedelta(seconds=settings.JOB_LEASE)
+
+
+def claim(job_id):
+    """Moves a pending job to running under a fresh lease. Returns the job, or None if someone else has it."""
+    claimed = GenerationJob.objects.filter(pk=job_id, status=Status.PENDING).update(
+        status=Status.RUNNING, attempts=F('attempts') + 1, lease_until=lease_end(), updated_at=timezone.now()
+    )
+    if not claimed:
+        return None
+    return GenerationJob.objects.select_related('session', 'user_message').get(pk=job_id)
+
+
+def model_input(job):
+    """(content, history) for the job's user message, rebuilt from the database."""
+    user_message = job.user_message
+    image = None
+    if user_message.file_upload:
+        upload = user_message.file_upload
+        upload.sha256 = digest_of(upload.name)  # Known from the name; don't read the file to hash it
+        image = preprocess_upload(upload)
+    return llm.model_content(user_message.text, image), build_history(job.session, before_id=user_message.id)
+
+
+async def keep_lease(job):
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE / 3)
+        await GenerationJob.objects.filter(pk=job.pk, attempts=job.attempts).aupdate(lease_until=lease_end())
+
+
+def finish(job, text, used):
+    """Saves the reply and marks the job done, unless the lease was lost to another worker meanwhile."""
+    with transaction.atomic():
+        bot_message = Message.objects.create(session=job.session, text=text, is_from_user=False)
+        done = GenerationJob.objects.filter(pk=job.pk, status=Status.RUNNING, attempts=job.attempts).update(
+            status=Status.DONE, bot_message=bot_message, lease_until=None, updated_at=timezone.now()
+        )
+        if not done:
+            transaction.set_rollback(True)
+            return False
+    if job.cache_key and get_response_cache() is not None:
+        get_response_cache().set(job.cache_key, text)
+    settle(job, used)
+    return True
+
+
+def fail(job, error):
+    failed = GenerationJob.objects.filter(pk=job.pk, status=Status.RUNNING, attempts=job.attempts).update(
+        status=Status.FAILED, error=error, lease_until=None, updated_at=timezone.now()
+    )
+    if failed:
+        settle(job, 0)
+
+
+def settle(job, used):
+    limiter = get_rate_limiter()
+    if job.reserved_tokens and limiter is not None:
+        limiter.settle(job.user_id, job.reserved_tokens, used)
+
+
+async def execute(job):
+    persona = get_persona()
+    try:
+        content, history = await sync_to_async(model_input)(job)
+        heartbeat = asyncio.ensure_future(keep_lease(job))
+        try:
+            text = await llm.generate_reply(persona, content, history, key=job.user_id)
+        finally:
+            heartbeat.cancel()
+    except Exception as e:
+        await sync_to_async(fail)(job, f"API Error: {str(e)}")
+        return Status.FAILED
+    finished = await sync_to_async(finish)(job, text, turn_tokens(persona, content, history, text))
+    return Status.DONE if finished else 'lost'
+
+
+def run_job(job_id):
+    """Runs one job to the end in the calling (pool) thread, if it is still pending."""
+    job = claim(job_id)
+    if job is None:
+        return
+    started = time.perf_counter()
+    if metrics.enabled():
+        metrics.registry.observe(metrics.JOB_WAIT_SECONDS, (timezone.now() - job.created_at).total_seconds())
+    outcome = async_to_sync(execute)(job)
+    if metrics.enabled():
+        metrics.registry.observe(metrics.JOB_SECONDS, time.perf_counter() - started, outcome=outcome)
+
+
+class JobRunner:
+    """JOB_WORKERS threads running jobs; each job id is queued at most once per process."""
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rgpt-job')
+        self.queued = set()
+        self._lock = threading.Lock()
+
+    def submit(self, job_id):
+        with self._lock:
+            if job_id in self.queued:
+                return False
+            self.queued.add(job_id)
+        self.executor.submit(self.run, job_id)
+        return True
+
+    def run(self, job_id):
+        try:
+            run_job(job_id)
+        except Exception:
+            logger.exception("Generation job %s failed", job_id)
+        finally:
+            with self._lock:
+                self.queued.discard(job_id)
+            close_old_connections()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner(settings.JOB_WORKERS)
+    return _runner
+
+
+def submit(job):
+    start_recovery()
+    get_runner().submit(job.pk)
+
+
+def recover():
+    """
+    Returns jobs with an expired lease to pending (or fails them after
+    JOB_MAX_ATTEMPTS) and queues pending jobs on this process's pool, a few
+    per worker thread. Returns how many were queued.
+    """
+    now = timezone.now()
+    stale = GenerationJob.objects.filter(status=Status.RUNNING, lease_until__lt=now)
+    exhausted = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).only('user_id', 'attempts', 'reserved_tokens')
+    for job in exhausted:
+        # Per job, so only the process that fails it refunds its reservation
+        failed = stale.filter(pk=job.pk, attempts=job.attempts).update(
+            status=Status.FAILED, error="The worker running this job stopped.", lease_until=None, updated_at=now
+        )
+        if failed:
+            settle(job, 0)
+    stale.update(status=Status.PENDING, lease_until=None, updated_at=now)
+    runner = get_runner()
+    pending = (GenerationJob.objects.filter(status=Status.PENDING).order_by('id')
+               .values_list('id', flat=True)[:settings.JOB_WORKERS * 4])
+    return sum(runner.submit(job_id) for job_id in pending)
+
+
+class JobRecovery(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='rgpt-job-recovery', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                queued = recover()
+                if queued:
+                    logger.info("Queued %d pending generation jobs", queued)
+            except Exception:
+                logger.exception("Generation job recovery failed")
+            finally:
+                close_old_connections()
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self.stopped.set()
+
+
+_recovery = None
+_recovery_lock = threading.Lock()
+
+
+def start_recovery(**kwargs):
+    global _recovery
+    if _recovery is not None or not settings.JOB_RECOVERY_INTERVAL:
+        return
+    with _recovery_lock:
+        if _recovery is None:
+            _recovery = JobRecovery(settings.JOB_RECOVERY_INTERVAL)
+            _recovery.start()
+
+
+request_started.connect(start_recovery, dispatch_uid='rgpt-job-recovery')
+
+
+@receiver(setting_changed)
+def reset_jobs(setting, **kwargs):
+    global _runner, _recovery
+    if setting == 'JOB_WORKERS' and _runner is not None:
+        _runner.shutdown()
+        _runner = None
+    elif setting == 'JOB_RECOVERY_INTERVAL' and _recovery is not None:
+        _recovery.stop()
+        _recovery = None
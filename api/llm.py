@@ -0,0 +1,278 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .persona import get_persona
+
+
+# --- CONCURRENCY LIMITER ---
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight model calls for the whole process. Unlike asyncio.Semaphore
+    it is not bound to one event loop, so it also holds when async views are
+    run through async_to_sync (one loop per request) under a WSGI server.
+
+    Callers waiting for a slot are queued per `key` (the user) and served
+    round-robin across keys, so someone with twenty calls queued doesn't make
+    everyone who arrives after them wait for all twenty. With `fair=False`
+    it is a single FIFO queue.
+    """
+
+    def __init__(self, limit, fair=True):
+        self.limit = limit
+        self.fair = fair
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()  # key -> deque of (loop, future), in round-robin order
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, key=None):
+        loop = asyncio.get_running_loop()
+        key = key if self.fair else None
+        with self._lock:
+            if self.in_flight < self.limit and not self._queues:
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._queues.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queue = self._queues.get(key)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[key]
+                    raise
+            # The slot was already handed over: give it back if we got it,
+            # otherwise _grant will see the cancelled future and pass it on.
+            if not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def _next_waiter(self):
+        # Take from the key at the front of the rotation, then send that key to the back.
+        key, queue = next(iter(self._queues.items()))
+        waiter = queue.popleft()
+        del self._queues[key]
+        if queue:
+            self._queues[key] = queue
+        return waiter
+
+    def release(self):
+        with self._lock:
+            if self._queues:
+                # Hand the slot straight to the next waiter; in_flight stays the same.
+                loop, future = self._next_waiter()
+                loop.call_soon_threadsafe(self._grant, future)
+                return
+            self.in_flight -= 1
+
+    def _grant(self, future):
+        if future.done():
+            # The waiter was cancelled after being picked; pass the slot on.
+            self.release()
+        else:
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, key=None):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+model_limiter = ConcurrencyLimiter(settings.LLM_MAX_CONCURRENCY, fair=settings.LLM_FAIR_QUEUE)
+
+
+# --- BACKENDS ---
+
+class LLMBackend:
+    """
+    Interface for model backends. `persona` is an api.persona.Persona,
+    `content` a list of parts (text and PIL images) and `history` a list of
+    {"role", "parts"} dicts, oldest first.
+    """
+    model_name = None
+
+    def warm(self, persona):
+        """Builds whatever per-persona state the backend reuses across requests."""
+
+    async def generate(self, persona, content, history=None):
+        """Returns the whole reply text."""
+        raise NotImplementedError
+
+    async def stream(self, persona, content, history=None):
+        """Async generator of reply text chunks."""
+        raise NotImplementedError
+        yield
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini through the async google-generativeai client. GenerativeModel
+    objects are built once per persona version and reused by every request.
+    """
+
+    def __init__(self, model_name='gemini-2.5-pro', api_key=None):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.model_name = model_name
+        self._models = {}
+        genai.configure(api_key=api_key or settings.GEMINI_API_KEY)
+
+    def get_model(self, persona):
+        key = (self.model_name, persona.version)
+        model = self._models.get(key)
+        if model is None:
+            model = self.genai.GenerativeModel(self.model_name, system_instruction=persona.text)
+            # Only the current persona is kept; older versions are dropped on reload.
+            self._models = {key: model}
+        return model
+
+    def warm(self, persona):
+        self.get_model(persona)
+
+    async def generate(self, persona, content, history=None):
+        model = self.get_model(persona)
+        if history:
+            chat = model.start_chat(history=history)
+            response = await chat.send_message_async(content)
+        else:
+            response = await model.generate_content_async(content)
+        return response.text
+
+    async def stream(self, persona, content, history=None):
+        model = self.get_model(persona)
+        chat = model.start_chat(history=history or [])
+        response_stream = await chat.send_message_async(content, stream=True)
+        async for chunk in response_stream:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic offline backend for load tests and profiling. The reply is
+    `reply` formatted with the prompt, repeated `repeat` times and emitted one
+    word at a time after `time_to_first_token` seconds, then every `token_delay`.
+    """
+
+    def __init__(self, model_name='fake', reply='RGPT fake reply to: {prompt}',
+                 repeat=1, time_to_first_token=0.0, token_delay=0.0):
+        self.model_name = model_name
+        self.reply = reply
+        self.repeat = repeat
+        self.time_to_first_token = time_to_first_token
+        self.token_delay = token_delay
+
+    def tokens(self, content):
+        prompt = ' '.join(part if isinstance(part, str) else '[image]' for part in content)
+        text = ' '.join([self.reply.format(prompt=prompt)] * self.repeat)
+        return re.findall(r'\S+\s*', text)
+
+    async def stream(self, persona, content, history=None):
+        await asyncio.sleep(self.time_to_first_token)
+        for index, token in enumerate(self.tokens(content)):
+            if index and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+    async def generate(self, persona, content, history=None):
+        return ''.join([token async for token in self.stream(persona, content, history)])
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Backend instance for `name` (default: settings.LLM_BACKEND), built once per process."""
+    name = name or settings.LLM_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                config = settings.LLM_BACKENDS[name]
+                backend = import_string(config['CLASS'])(**config.get('OPTIONS', {}))
+                _backends[name] = backend
+    return backend
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    if setting in ('LLM_BACKEND', 'LLM_BACKENDS'):
+        _backends.clear()
+    elif setting == 'LLM_MAX_CONCURRENCY':
+        model_limiter.limit = kwargs['value']
+    elif setting == 'LLM_FAIR_QUEUE':
+        model_limiter.fair = kwargs['value']
+
+
+def warm_up():
+    """Builds the configured backend and its model client for the current persona."""
+    get_backend().warm(get_persona())
+
+
+# --- CALL PATH USED BY THE VIEWS ---
+
+def model_content(text, image=None):
+    """Model input parts for a user message: its text and its preprocessed image (api.images), if any."""
+    content = []
+    if text:
+        content.append(text)
+    if image is not None:
+        # Sent as encoded bytes; a PIL image would be re-encoded as lossless WebP by the SDK.
+        content.append({'mime_type': image.mime_type, 'data': image.data})
+    return content
+
+
+async def generate_reply(persona, content, history=None, key=None):
+    """Returns the full reply text without blocking the event loop. `key` (the user) is the fair-queue lane."""
+    backend = get_backend()
+    queued = time.perf_counter()
+    async with model_limiter.slot(key):
+        started = time.perf_counter()
+        metrics.note('model_queue', started - queued)
+        text = ''
+        try:
+            text = await backend.generate(persona, content, history)
+            return text
+        finally:
+            metrics.observe_generation(backend.model_name, started, None, len(text))
+
+
+async def stream_reply(persona, content, history=None, key=None):
+    """Async generator yielding reply chunks; holds a limiter slot for the whole stream."""
+    backend = get_backend()
+    queued = time.perf_counter()
+    async with model_limiter.slot(key):
+        started = time.perf_counter()
+        metrics.note('model_queue', started - queued)
+        first_token_at, chars = None, 0
+        try:
+            async for text in backend.stream(persona, content, history):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chars += len(text)
+                yield text
+        finally:
+            metrics.observe_generation(backend.model_name, started, first_token_at, chars)
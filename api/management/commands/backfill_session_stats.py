@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+
+from api.models import ChatSession, Message, message_preview
+
+FIELDS = ['message_count', 'last_message_at', 'last_message_preview', 'updated_at']
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills ChatSession.message_count, last_message_at and last_message_preview "
+        "from existing messages, one batch of sessions per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        latest_text = Subquery(
+            Message.objects.filter(session=OuterRef('pk')).order_by('-timestamp', '-id').values('text')[:1]
+        )
+        started = time.perf_counter()
+        last_id, done = 0, 0
+
+        while True:
+            ids = list(
+                ChatSession.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            stats = {
+                row['session_id']: row
+                for row in Message.objects.filter(session_id__in=ids).order_by()
+                .values('session_id').annotate(count=Count('id'), last_at=Max('timestamp'))
+            }
+            sessions = list(
+                ChatSession.objects.filter(id__in=ids).only('id', 'updated_at').annotate(last_text=latest_text)
+            )
+            for session in sessions:
+                row = stats.get(session.id)
+                session.message_count = row['count'] if row else 0
+                session.last_message_at = row['last_at'] if row else None
+                session.last_message_preview = message_preview(session.last_text or '')
+                if session.last_message_at and session.last_message_at > session.updated_at:
+                    session.updated_at = session.last_message_at
+
+            with transaction.atomic():
+                ChatSession.objects.bulk_update(sessions, FIELDS)
+
+            done += len(sessions)
+            last_id = ids[-1]
+            self.stdout.write(f"{done} sessions backfilled (up to id {last_id})")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {done} sessions in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f}/s)"
+        ))
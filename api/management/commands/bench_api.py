@@ -0,0 +1,215 @@
+import json
+import os
+import random
+import statistics
+import time
+import warnings
+
+import rsa
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.bench import bench_database, make_google_id_token, percentile, reset_peak_rss, rss_kb, serve_google_certs
+from api.management.commands.bench_google_login import CLIENT_ID, KEY_ID
+from api.models import ChatSession, Message, User, message_preview
+
+PICTURE = 'https://example.com/bench.png'  # Same as in the ID tokens, so logins don't write
+WORDS = "the a model reply chat python cache query index stream token session image user error retry".split()
+# Metric -> (share of --threshold it may grow by, absolute slack) before it counts as a regression.
+# Tail latency is noisier, so p95 gets twice the threshold; the slack keeps sub-millisecond timings and
+# small RSS figures from failing on noise. p99 is reported but not gated.
+GATES = {'p50_ms': (1, 0.5), 'p95_ms': (2, 1.0), 'queries': (1, 0.05), 'peak_rss_mb': (1, 2.0)}
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end latency (p50/p95/p99), queries per request and peak RSS of the main API "
+        "endpoints against a seeded database, with the fake model backend and a local Google cert "
+        "stub. With --baseline, results are compared to (or saved as) a JSON baseline and the "
+        "command fails on regressions beyond --threshold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--sessions', type=int, default=100, help="Sessions per user.")
+        parser.add_argument('--messages', type=int, default=50, help="Messages per session.")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint and round.")
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--baseline', help="JSON baseline file; written if missing, else compared against.")
+        parser.add_argument('--update-baseline', action='store_true', help="Overwrite the baseline with this run.")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed relative increase in p50 latency, queries and peak RSS (p95: twice this).")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        public_key, private_key = rsa.newkeys(2048)
+        private_pem = private_key.save_pkcs1().decode()
+        server = serve_google_certs({KEY_ID: public_key.save_pkcs1().decode()}, max_age=3600)
+        try:
+            with override_settings(
+                GOOGLE_CERTS_URL=server.url, GOOGLE_CERTS_CACHE_FILE=None,
+                GOOGLE_CLIENT_ID=CLIENT_ID, LLM_BACKEND='fake', RESPONSE_CACHE_ENABLED=False,
+            ), bench_database():
+                results = self.measure(options, private_pem)
+        finally:
+            server.shutdown()
+
+        report = {
+            'dataset': {key: options[key] for key in ('users', 'sessions', 'messages', 'requests', 'rounds')},
+            'vendor': connection.vendor,
+            'results': results,
+        }
+        if options['baseline']:
+            self.check_baseline(options['baseline'], report, options['threshold'], options['update_baseline'])
+
+    def measure(self, options, private_pem):
+        """Seeds the current database and runs every scenario; ID tokens are signed with `private_pem`."""
+        self.rng = random.Random(options['seed'])
+        with warnings.catch_warnings():
+            # The sync test client drains async streaming responses in one go; that is expected here.
+            warnings.filterwarnings('ignore', message='StreamingHttpResponse must consume')
+            started = time.perf_counter()
+            self.seed(options['users'], options['sessions'], options['messages'])
+            self.stdout.write(
+                f"Seeded {options['users']} users x {options['sessions']} sessions x {options['messages']} "
+                f"messages in {time.perf_counter() - started:.0f}s"
+            )
+            self.tokens = {user_id: key for key, user_id in Token.objects.values_list('key', 'user_id')}
+            self.users = list(User.objects.values_list('id', 'email'))
+            self.id_tokens = {
+                email: make_google_id_token(private_pem, KEY_ID, CLIENT_ID, email=email, picture=PICTURE)
+                for _, email in self.users[:50]
+            }
+            self.sessions = {}
+            for session_id, user_id in ChatSession.objects.values_list('id', 'user_id'):
+                self.sessions.setdefault(user_id, []).append(session_id)
+            return self.run_scenarios(Client(), options['requests'], options['rounds'])
+
+    def seed(self, users, sessions, messages):
+        now = timezone.now()
+        for start in range(0, users, 100):
+            with transaction.atomic():
+                created = User.objects.bulk_create(
+                    User(username=f'bench{index}', email=f'bench{index}@bench.local', profile_picture_url=PICTURE)
+                    for index in range(start, min(start + 100, users))
+                )
+                Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in created)
+                chats = ChatSession.objects.bulk_create(
+                    (ChatSession(user=user, title=f'Chat {n}', message_count=messages, last_message_at=now,
+                                 last_message_preview=message_preview('the last reply'))
+                     for user in created for n in range(sessions)),
+                    batch_size=1000,
+                )
+                Message.objects.bulk_create(
+                    (Message(session=chat, is_from_user=not n % 2,
+                             text=' '.join(self.rng.choices(WORDS, k=self.rng.randint(5, 60))))
+                     for chat in chats for n in range(messages)),
+                    batch_size=5000,
+                )
+
+    def pick(self):
+        user_id, email = self.rng.choice(self.users)
+        return user_id, email, self.rng.choice(self.sessions[user_id])
+
+    def scenarios(self):
+        """name -> callable(client) making one request and returning the response."""
+        def auth(user_id):
+            return {'HTTP_AUTHORIZATION': f'Token {self.tokens[user_id]}'}
+
+        def google_login(client):
+            email = self.rng.choice(list(self.id_tokens))
+            return client.post('/api/auth/google/', {'token': self.id_tokens[email]}, content_type='application/json')
+
+        def chat_list(client):
+            user_id, _, _ = self.pick()
+            return client.get('/api/chats/', **auth(user_id))
+
+        def session_detail(client):
+            user_id, _, session_id = self.pick()
+            return client.get(f'/api/chats/{session_id}/', **auth(user_id))
+
+        def message_list(client):
+            user_id, _, session_id = self.pick()
+            return client.get(f'/api/chats/{session_id}/messages/', **auth(user_id))
+
+        def message_create(client, stream=False):
+            user_id, _, session_id = self.pick()
+            text = ' '.join(self.rng.choices(WORDS, k=12))
+            path = f'/api/chats/{session_id}/messages/' + ('?stream=1' if stream else '')
+            response = client.post(path, {'text': text}, **auth(user_id))
+            if stream:
+                body = b''.join(response)
+                assert b'event: bot_message' in body, body[-300:]
+            return response
+
+        return {
+            'google_login': google_login,
+            'chat_list': chat_list,
+            'session_detail': session_detail,
+            'message_list': message_list,
+            'message_create': message_create,
+            'message_create_stream': lambda client: message_create(client, stream=True),
+        }
+
+    def run_scenarios(self, client, requests, rounds):
+        self.stdout.write(
+            f"{'endpoint':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak MB':>8}"
+        )
+        results = {}
+        for name, request in self.scenarios().items():
+            for _ in range(5):  # Warm caches, connections and lazy imports
+                request(client)
+            baseline_kb = rss_kb('VmRSS')
+            reset_peak_rss()
+            # Percentiles are the median over `rounds` runs, which keeps one noisy stretch from
+            # moving p95/p99 (and failing the baseline check) on its own.
+            per_round, queries = [], 0
+            for _ in range(rounds):
+                timings = []
+                for _ in range(requests):
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = request(client)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code in (200, 201), (name, response.status_code)
+                    queries += len(captured)
+                per_round.append({pct: percentile(timings, pct) for pct in (50, 95, 99)})
+            results[name] = {
+                **{f'p{pct}_ms': round(statistics.median(row[pct] for row in per_round), 3) for pct in (50, 95, 99)},
+                'queries': round(queries / (requests * rounds), 2),
+                'peak_rss_mb': round(max(0, rss_kb('VmHWM') - baseline_kb) / 1024, 1),
+            }
+            row = results[name]
+            self.stdout.write(
+                f"{name:<22} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                f"{row['queries']:>8.2f} {row['peak_rss_mb']:>8.1f}"
+            )
+        return results
+
+    def check_baseline(self, path, report, threshold, update):
+        if update or not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {path}"))
+            return
+
+        with open(path, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        if baseline.get('dataset') != report['dataset'] or baseline.get('vendor') != report['vendor']:
+            raise CommandError(f"{path} was recorded with a different dataset or database; rerun with --update-baseline.")
+
+        regressions = []
+        for name, row in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            for metric, (share, slack) in GATES.items():
+                if row[metric] > before[metric] * (1 + threshold * share) + slack:
+                    regressions.append(f"{name} {metric}: {before[metric]} -> {row[metric]}")
+        if regressions:
+            raise CommandError("Regressions beyond {:.0%}:\n  ".format(threshold) + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions beyond {threshold:.0%} against {path}"))
@@ -0,0 +1,43 @@
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+
+from api.authentication import CachedTokenAuthentication, get_token_cache
+from api.bench import bench_database, create_bench_user, percentile
+from api.views import ChatSessionListCreateView
+
+
+class Command(BaseCommand):
+    help = "Queries and p50 latency of GET /api/chats/ with plain vs cached token authentication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--sessions', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            _, token, _ = create_bench_user(sessions=options['sessions'])
+            client = Client(headers={'Authorization': f'Token {token.key}'})
+
+            self.stdout.write(f"{options['requests']} requests to /api/chats/ ({options['sessions']} sessions)")
+            self.stdout.write(f"{'authentication':<16} {'queries/req':>12} {'p50 ms':>8} {'p95 ms':>8}")
+            for name, auth_class in (('token', TokenAuthentication), ('cached token', CachedTokenAuthentication)):
+                get_token_cache().clear()
+                classes = [SessionAuthentication, auth_class]
+                with mock.patch.object(ChatSessionListCreateView, 'authentication_classes', classes):
+                    client.get('/api/chats/')  # Warm up (fills the cache for the cached run)
+                    timings = []
+                    with CaptureQueriesContext(connection) as queries:
+                        for _ in range(options['requests']):
+                            started = time.perf_counter()
+                            client.get('/api/chats/')
+                            timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"{name:<16} {len(queries) / options['requests']:>12.2f} "
+                    f"{percentile(timings, 50):>8.3f} {percentile(timings, 95):>8.3f}"
+                )
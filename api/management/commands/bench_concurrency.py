@@ -0,0 +1,108 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api import llm
+from api.bench import bench_database, create_bench_user
+from api.context import build_history
+from api.models import ChatSession, Message
+
+
+class BlockingTurnView(APIView):
+    """
+    A chat turn the way a sync view serves it: the model call blocks the
+    worker thread for its whole latency, as the SDK's sync client does. Only
+    for this benchmark (served through the ROOT_URLCONF below).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, session_pk):
+        session = ChatSession.objects.get(pk=session_pk, user=request.user)
+        user_message = Message.objects.create(session=session, text=request.data['text'], is_from_user=True)
+        build_history(session, before_id=user_message.id)
+        backend = llm.get_backend()
+        time.sleep(backend.time_to_first_token)
+        text = ''.join(backend.tokens([user_message.text]))
+        bot_message = Message.objects.create(session=session, text=text, is_from_user=False)
+        return Response({'bot_message': bot_message.id}, status=status.HTTP_201_CREATED)
+
+
+urlpatterns = [
+    path('bench/chats/<int:session_pk>/messages/', BlockingTurnView.as_view()),
+    path('', include('rgpt_backend.urls')),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Chat-turn throughput against the fake model backend: a fixed pool of sync workers "
+        "(like gunicorn sync workers) running a sync view that blocks on the model, the same pool "
+        "running the async view (one event loop per request), and the async view on one event loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2, help='Fake model latency in seconds.')
+        parser.add_argument('--workers', type=int, default=4, help='Sync worker count to compare against.')
+        parser.add_argument('--levels', default='1,10,100', help='Comma-separated concurrent chat counts.')
+        parser.add_argument('--max-concurrency', type=int, default=None,
+                            help='Override LLM_MAX_CONCURRENCY for the run.')
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+        levels = [int(level) for level in options['levels'].split(',')]
+        if options['max_concurrency']:
+            llm.model_limiter.limit = options['max_concurrency']
+
+        slow_model = {'CLASS': 'api.llm.FakeBackend', 'OPTIONS': {'time_to_first_token': latency}}
+
+        with bench_database(), override_settings(
+            LLM_BACKEND='bench', LLM_BACKENDS={'bench': slow_model}, ROOT_URLCONF=__name__,
+            RATE_LIMIT_ENABLED=False, TITLE_ENABLED=False, SUMMARY_ENABLED=False,
+        ):
+            _, token, chats = create_bench_user(sessions=max(levels))
+            self.auth = {'Authorization': f'Token {token.key}'}
+            self.chat_ids = [chat.id for chat in chats]
+
+            self.stdout.write(f"model latency {latency * 1000:.0f} ms, "
+                              f"{options['workers']} sync workers, limiter {llm.model_limiter.limit}")
+            self.stdout.write(f"{'chats':>6} {'requests':>9} {'sync view':>10} {'async/sync':>11} {'async rps':>10}")
+            for level in levels:
+                total = max(level * 2, 20)
+                sync_rps = self.run_sync(level, total, options['workers'], '/bench/chats/{}/messages/')
+                bridged_rps = self.run_sync(level, total, options['workers'], '/api/chats/{}/messages/')
+                async_rps = asyncio.run(self.run_async(level, total))
+                self.stdout.write(f"{level:>6} {total:>9} {sync_rps:>10.1f} {bridged_rps:>11.1f} {async_rps:>10.1f}")
+
+    def run_sync(self, level, total, workers, url):
+        def send(i):
+            response = Client().post(url.format(self.chat_ids[i % level]), {'text': 'explain binary search'},
+                                     headers=self.auth)
+            assert response.status_code == 201, response.status_code
+            connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(workers, level)) as pool:
+            list(pool.map(send, range(total)))
+        return total / (time.perf_counter() - started)
+
+    async def run_async(self, level, total):
+        client = AsyncClient()
+        in_flight = asyncio.Semaphore(level)
+
+        async def send(i):
+            async with in_flight:
+                response = await client.post(f'/api/chats/{self.chat_ids[i % level]}/messages/',
+                                             {'text': 'explain binary search'}, headers=self.auth)
+                assert response.status_code == 201, response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(total)))
+        return total / (time.perf_counter() - started)
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.bench import bench_database, create_bench_user, percentile
+from api.models import ChatSession, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Latency and query count of the chat list, chat detail and message list: a full 200 "
+        "vs a 304 revalidation with If-None-Match."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=1000, help='Chats of the bench user.')
+        parser.add_argument('--messages', type=int, default=200, help='Messages in the chat being read.')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            _, token, chats = create_bench_user(sessions=options['sessions'])
+            chat = chats[0]
+            Message.objects.bulk_create(
+                (Message(session=chat, text=f'message {n} ' + 'lorem ipsum ' * 40, is_from_user=n % 2 == 0)
+                 for n in range(options['messages'])),
+                batch_size=1000,
+            )
+            ChatSession.objects.filter(pk=chat.pk).update(title='Bench chat')
+
+            client = Client(headers={'Authorization': f'Token {token.key}'})
+            cases = [
+                ('chat list', '/api/chats/'),
+                ('chat detail', f'/api/chats/{chat.id}/'),
+                ('latest page', f'/api/chats/{chat.id}/?messages=latest'),
+                ('messages', f'/api/chats/{chat.id}/messages/'),
+            ]
+            self.stdout.write(f"{options['sessions']} chats, {options['messages']} messages in the chat read, "
+                              f"{options['repeat']} runs each")
+            self.stdout.write(f"{'request':<12} {'status':>6} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>9}")
+            for name, path in cases:
+                etag = client.get(path)['ETag']
+                for headers in ({}, {'If-None-Match': etag}):
+                    self.measure(client, name, path, headers, options['repeat'])
+
+    def measure(self, client, name, path, headers, repeat):
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == (304 if headers else 200), response.status_code
+        self.stdout.write(
+            f"{name:<12} {response.status_code:>6} {len(queries):>8} {percentile(timings, 50):>9.2f} "
+            f"{percentile(timings, 95):>9.2f} {len(response.content):>9}"
+        )
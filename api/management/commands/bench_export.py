@@ -0,0 +1,65 @@
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.bench import bench_database, create_bench_user, reset_peak_rss, rss_kb
+from api.export import export_lines, import_lines
+from api.models import ChatSession, Message, User
+
+WORDS = "the a model reply chat python cache query index stream token session image user error retry".split()
+
+
+class Command(BaseCommand):
+    help = "Rows/s and peak memory of NDJSON export and import (1M messages by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--sessions', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=10)
+
+    def handle(self, *args, **options):
+        rng = random.Random(3)
+        with bench_database(), tempfile.TemporaryDirectory() as tmp:
+            for index in range(options['users']):
+                create_bench_user(f'bench{index}', sessions=options['sessions'] // options['users'])
+            session_ids = list(ChatSession.objects.values_list('id', flat=True))
+            for start in range(0, options['messages'], 20000):
+                with transaction.atomic():
+                    Message.objects.bulk_create(
+                        Message(session_id=session_ids[index % len(session_ids)], is_from_user=bool(index % 2),
+                                text=' '.join(rng.choices(WORDS, k=rng.randint(5, 40))))
+                        for index in range(start, min(start + 20000, options['messages']))
+                    )
+            rows = options['messages'] + len(session_ids)
+            self.stdout.write(f"{options['messages']} messages in {len(session_ids)} sessions")
+            self.stdout.write(f"{'phase':<8} {'rows':>9} {'seconds':>8} {'rows/s':>9} {'peak MB':>8} {'file MB':>8}")
+
+            path = os.path.join(tmp, 'export.ndjson')
+            baseline = self.start_phase()
+            started = time.perf_counter()
+            with open(path, 'w', encoding='utf-8') as out:
+                out.writelines(export_lines(ChatSession.objects.all()))
+            self.report('export', rows, started, baseline, os.path.getsize(path))
+
+            target = User.objects.create(username='imported')
+            baseline = self.start_phase()
+            started = time.perf_counter()
+            with open(path, encoding='utf-8') as source:
+                counts = import_lines(source, user=target)
+            self.report('import', counts['sessions'] + counts['messages'], started, baseline, os.path.getsize(path))
+            assert Message.objects.filter(session__user=target).count() == options['messages']
+
+    def start_phase(self):
+        reset_peak_rss()
+        return rss_kb('VmRSS')
+
+    def report(self, phase, rows, started, baseline, size):
+        elapsed = time.perf_counter() - started
+        peak = (rss_kb('VmHWM') - baseline) / 1024
+        self.stdout.write(
+            f"{phase:<8} {rows:>9} {elapsed:>8.1f} {rows / elapsed:>9.0f} {peak:>8.1f} {size / 1024 / 1024:>8.1f}"
+        )
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+
+from api import llm
+from api.bench import bench_database, create_bench_user, percentile
+
+MODES = {
+    'fifo': {'LLM_FAIR_QUEUE': False, 'RATE_LIMIT_ENABLED': False},
+    'fair queue': {'LLM_FAIR_QUEUE': True, 'RATE_LIMIT_ENABLED': False},
+    'fair + buckets': {'LLM_FAIR_QUEUE': True, 'RATE_LIMIT_ENABLED': True},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Noisy-neighbour load test: one user keeps many chat turns in flight while a few light "
+        "users send one turn at a time. Reports the light users' latency with a FIFO model queue, "
+        "with the fair (round-robin) queue, and with per-user token buckets on top."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2, help='Fake model latency in seconds.')
+        parser.add_argument('--max-concurrency', type=int, default=4, help='Model calls in flight for the run.')
+        parser.add_argument('--noisy', type=int, default=40, help="The noisy user's concurrent requests.")
+        parser.add_argument('--light', type=int, default=5, help='Light users, one request at a time each.')
+        parser.add_argument('--think', type=float, default=1.0, help='Pause between a light user\'s requests.')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds per mode.')
+        parser.add_argument('--user-tokens-per-minute', type=int, default=60000,
+                            help='Per-user bucket for the run (the setting defaults higher).')
+
+    def handle(self, *args, **options):
+        slow_model = {'CLASS': 'api.llm.FakeBackend', 'OPTIONS': {'time_to_first_token': options['latency']}}
+        limit = llm.model_limiter.limit
+        llm.model_limiter.limit = options['max_concurrency']
+        try:
+            with bench_database(), override_settings(
+                LLM_BACKEND='bench', LLM_BACKENDS={'bench': slow_model}, RESPONSE_CACHE_ENABLED=False,
+                RATE_LIMIT_STORE='local', RATE_LIMIT_USER_TOKENS_PER_MINUTE=options['user_tokens_per_minute'],
+            ):
+                noisy = create_bench_user('noisy', sessions=options['noisy'])
+                light = [create_bench_user(f'light{index}', sessions=1) for index in range(options['light'])]
+                self.stdout.write(
+                    f"model latency {options['latency'] * 1000:.0f} ms, limiter {options['max_concurrency']}, "
+                    f"{options['noisy']} noisy requests in flight, {options['light']} light users"
+                )
+                self.stdout.write(
+                    f"{'mode':<15} {'light p50':>10} {'p95':>8} {'p99':>8} {'light n':>8} "
+                    f"{'light 429':>10} {'noisy ok':>9} {'noisy 429':>10}"
+                )
+                for mode, overrides in MODES.items():
+                    with override_settings(**overrides):
+                        result = asyncio.run(self.run_mode(noisy, light, options))
+                    timings = result['light']
+                    self.stdout.write(
+                        f"{mode:<15} {percentile(timings, 50):>10.0f} {percentile(timings, 95):>8.0f} "
+                        f"{percentile(timings, 99):>8.0f} {len(timings):>8} {result['light_limited']:>10} {result['noisy_ok']:>9} "
+                        f"{result['noisy_limited']:>10}"
+                    )
+        finally:
+            llm.model_limiter.limit = limit
+
+    async def run_mode(self, noisy, light, options):
+        client = AsyncClient()
+        deadline = time.perf_counter() + options['duration']
+        result = {'light': [], 'light_limited': 0, 'noisy_ok': 0, 'noisy_limited': 0}
+
+        async def post(token, chat):
+            return await client.post(f'/api/chats/{chat.id}/messages/', {'text': 'explain binary search'},
+                                     headers={'Authorization': f'Token {token.key}'})
+
+        async def noisy_loop(chat):
+            _, token, _ = noisy
+            while time.perf_counter() < deadline:
+                response = await post(token, chat)
+                if response.status_code == 429:
+                    result['noisy_limited'] += 1
+                    await asyncio.sleep(int(response.headers.get('Retry-After', 1)))
+                else:
+                    result['noisy_ok'] += 1
+
+        async def light_loop(user):
+            _, token, (chat,) = user
+            await asyncio.sleep(options['think'])  # Let the noisy user fill the queue first
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await post(token, chat)
+                if response.status_code == 429:
+                    result['light_limited'] += 1
+                else:
+                    assert response.status_code == 201, response.status_code
+                    result['light'].append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(options['think'])
+
+        _, _, chats = noisy
+        await asyncio.gather(*(noisy_loop(chat) for chat in chats), *(light_loop(user) for user in light))
+        return result
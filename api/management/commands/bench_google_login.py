@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+
+import rsa
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+
+from api.bench import bench_database, make_google_id_token, percentile, serve_google_certs
+from api.google_auth import GOOGLE_ISSUERS, GoogleCertCache, verify_google_id_token
+
+CLIENT_ID = 'bench-client.apps.googleusercontent.com'
+KEY_ID = 'bench-key'
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline benchmark of Google ID-token verification (fresh transport + cert fetch per "
+        "login vs the cached verifier) and of POST /api/auth/google/, using a local keypair "
+        "and a stub certificate endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=50.0,
+                            help="Simulated cert endpoint latency in ms.")
+
+    def handle(self, *args, **options):
+        public_key, private_key = rsa.newkeys(2048)
+        public_pem = public_key.save_pkcs1().decode()
+        private_pem = private_key.save_pkcs1().decode()
+        server = serve_google_certs({KEY_ID: public_pem}, max_age=3600, latency=options['latency'] / 1000)
+        certs_url = server.url
+        cache_file = os.path.join(tempfile.mkdtemp(), 'certs.json')
+        token = make_google_id_token(private_pem, KEY_ID, CLIENT_ID)
+        logins = options['logins']
+
+        def per_login_fetch():
+            idinfo = id_token.verify_token(token, google_requests.Request(), audience=CLIENT_ID, certs_url=certs_url)
+            assert idinfo['iss'] in GOOGLE_ISSUERS
+
+        try:
+            with override_settings(GOOGLE_CERTS_URL=certs_url, GOOGLE_CERTS_CACHE_FILE=cache_file,
+                                   GOOGLE_CLIENT_ID=CLIENT_ID):
+                self.stdout.write(f"{logins} verifications, cert endpoint latency {options['latency']:.0f} ms")
+                self.stdout.write(f"{'verifier':<24} {'cert fetches':>12} {'p50 ms':>8} {'p95 ms':>8}")
+                for name, verify in (('fetch per login', per_login_fetch),
+                                     ('cached certs', lambda: verify_google_id_token(token))):
+                    server.hits = 0
+                    timings = []
+                    for _ in range(logins):
+                        started = time.perf_counter()
+                        verify()
+                        timings.append((time.perf_counter() - started) * 1000)
+                    self.stdout.write(
+                        f"{name:<24} {server.hits:>12} {percentile(timings, 50):>8.3f} {percentile(timings, 95):>8.3f}"
+                    )
+
+                # A new process picks the certificates up from disk instead of the network.
+                server.hits = 0
+                GoogleCertCache(certs_url, cache_file=cache_file).get()
+                self.stdout.write(f"after restart, fetches: {server.hits} (loaded from {cache_file})")
+
+                with bench_database():
+                    client = Client()
+                    client.post('/api/auth/google/', {'token': token}, content_type='application/json')
+                    with CaptureQueriesContext(connection) as queries:
+                        for _ in range(logins):
+                            response = client.post('/api/auth/google/', {'token': token},
+                                                   content_type='application/json')
+                            assert response.status_code == 200, response.content
+                    writes = sum(1 for query in queries if query['sql'].startswith('UPDATE'))
+                    self.stdout.write(
+                        f"POST /api/auth/google/ (returning user): {len(queries) / logins:.2f} queries/login, "
+                        f"{writes / logins:.2f} UPDATEs/login"
+                    )
+        finally:
+            server.shutdown()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
@@ -0,0 +1,85 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from google.generativeai.types.content_types import to_blob
+from PIL import Image
+
+from api.bench import percentile, rss_kb
+from api.images import preprocess_image
+
+SIZES = {'12MP': (4000, 3000), '48MP': (8000, 6000)}
+
+
+def make_photo(path, size):
+    """A camera-like JPEG: smooth gradient plus sensor noise, with an EXIF orientation tag."""
+    width, height = size
+    small = Image.linear_gradient('L').resize((width // 8, height // 8)).convert('RGB')
+    img = Image.blend(small.resize(size), Image.effect_noise(size, 24).convert('RGB'), 0.25)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90° CW, as phones commonly write it
+    exif[0x010F] = 'BenchCam'
+    img.save(path, format='JPEG', quality=92, exif=exif)
+
+
+def legacy_decode(fh):
+    """
+    What happened before: a full-resolution decode in the view, then the SDK
+    turning the PIL image into a lossless WebP blob for the request.
+    """
+    img = Image.open(fh)
+    img.load()
+    return to_blob(img)
+
+
+def run_case(path, pipeline, repeat, queue):
+    """Runs in a fresh process so the peak RSS belongs to this case alone."""
+    timings = []
+    before = rss_kb('VmRSS')
+    for _ in range(repeat):
+        with open(path, 'rb') as fh:
+            upload = io.BytesIO(fh.read())
+        started = time.perf_counter()
+        result = legacy_decode(upload) if pipeline == 'legacy' else preprocess_image(upload)
+        timings.append((time.perf_counter() - started) * 1000)
+        del result
+    queue.put((timings, (rss_kb('VmHWM') - before) / 1024))
+
+
+class Command(BaseCommand):
+    help = "Latency and peak memory of image preprocessing vs the old full decode + SDK encode, for 12MP and 48MP JPEGs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        workdir = tempfile.mkdtemp()
+        self.stdout.write(f"{'image':<6} {'file MB':>8} {'pipeline':<12} {'p50 ms':>8} {'max ms':>8} "
+                          f"{'peak MB':>8} {'output':>14}")
+        try:
+            for label, size in SIZES.items():
+                path = os.path.join(workdir, f'{label}.jpg')
+                make_photo(path, size)
+                with open(path, 'rb') as fh:
+                    processed = preprocess_image(io.BytesIO(fh.read()))
+                outputs = {
+                    'legacy': f"{size[0]}x{size[1]} WebP",
+                    'preprocess': f"{processed.width}x{processed.height} {len(processed.data) // 1024}KB",
+                }
+                for pipeline in ('legacy', 'preprocess'):
+                    queue = context.Queue()
+                    process = context.Process(target=run_case, args=(path, pipeline, options['repeat'], queue))
+                    process.start()
+                    timings, peak_mb = queue.get()
+                    process.join()
+                    self.stdout.write(
+                        f"{label:<6} {os.path.getsize(path) / 1024 / 1024:>8.1f} {pipeline:<12} "
+                        f"{percentile(timings, 50):>8.1f} {max(timings):>8.1f} {peak_mb:>8.1f} {outputs[pipeline]:>14}"
+                    )
+                os.remove(path)
+        finally:
+            os.rmdir(workdir)
@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+
+from api.bench import bench_database, create_bench_user, percentile
+from api.models import GenerationJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync workers (like gunicorn sync workers) serving slow chat turns mixed with cheap chat-list "
+        "requests: how long the cheap requests wait when turns hold a worker for the whole model call, "
+        "and when they are posted in job mode (202 + background generation)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=2.0, help='Fake model latency in seconds.')
+        parser.add_argument('--workers', type=int, default=4, help='HTTP worker threads.')
+        parser.add_argument('--turns', type=int, default=16)
+        parser.add_argument('--cheap', type=int, default=200, help='Chat-list requests sent alongside the turns.')
+
+    def handle(self, *args, **options):
+        slow_model = {'CLASS': 'api.llm.FakeBackend', 'OPTIONS': {'time_to_first_token': options['latency']}}
+        with bench_database(), override_settings(
+            LLM_BACKEND='bench', LLM_BACKENDS={'bench': slow_model}, RESPONSE_CACHE_ENABLED=False,
+            RATE_LIMIT_ENABLED=False,
+        ):
+            _, token, chats = create_bench_user(sessions=options['turns'])
+            self.auth = {'Authorization': f'Token {token.key}'}
+            self.chats = chats
+            self.stdout.write(f"model latency {options['latency']:.1f}s, {options['workers']} workers, "
+                              f"{options['turns']} turns + {options['cheap']} chat-list requests")
+            self.stdout.write(f"{'mode':<6} {'turn ms':>9} {'list p50':>9} {'list p95':>9} {'all replies s':>14}")
+            for mode in ('sync', 'job'):
+                self.run(mode, options)
+
+    def run(self, mode, options):
+        suffix = '?job=1' if mode == 'job' else ''
+        turn_times, list_times = [], []
+
+        # Timings start at submission, so they include waiting for a free worker.
+        def turn(index, started):
+            response = Client().post(f'/api/chats/{self.chats[index].id}/messages/{suffix}',
+                                     {'text': f'explain binary search {mode} {index}'}, headers=self.auth)
+            turn_times.append((time.perf_counter() - started) * 1000)
+            assert response.status_code in (201, 202), response.status_code
+            connection.close()
+
+        def cheap(index, started):
+            Client().get('/api/chats/', headers=self.auth)
+            list_times.append((time.perf_counter() - started) * 1000)
+            connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for index in range(options['turns']):
+                pool.submit(turn, index, time.perf_counter())
+            for index in range(options['cheap']):
+                pool.submit(cheap, index, time.perf_counter())
+        if mode == 'job':
+            while GenerationJob.objects.exclude(status__in=('done', 'failed')).exists():
+                time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{mode:<6} {percentile(turn_times, 50):>9.0f} {percentile(list_times, 50):>9.1f} "
+            f"{percentile(list_times, 95):>9.1f} {elapsed:>14.1f}"
+        )
@@ -0,0 +1,64 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+
+from api.bench import bench_database, create_bench_user, percentile
+from api.metrics import REQUEST_SECONDS, Registry
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Overhead of the request metrics (MetricsMiddleware + query timer + histograms): latency of "
+        "cheap endpoints with METRICS_ENABLED on and off, in alternating rounds, and the cost of one "
+        "histogram observation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and round.")
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        registry = Registry()
+        name = registry.histogram(REQUEST_SECONDS, 'bench')
+        count = 200000
+        started = time.perf_counter()
+        for index in range(count):
+            registry.observe(name, 0.004, endpoint='api/chats/', method='GET', status=200)
+        self.stdout.write(f"histogram observe: {(time.perf_counter() - started) / count * 1e9:.0f} ns")
+
+        with bench_database():
+            user, token, chats = create_bench_user('bench', sessions=50)
+            with transaction.atomic():
+                Message.objects.bulk_create(
+                    Message(session=chat, is_from_user=bool(n % 2), text=f'message {n} ' * 20)
+                    for chat in chats for n in range(30)
+                )
+            paths = {
+                'chat list': '/api/chats/',
+                'message list': f'/api/chats/{chats[0].id}/messages/',
+            }
+            self.stdout.write(f"{'endpoint':<14} {'off p50 ms':>11} {'on p50 ms':>10} {'overhead':>9}")
+            for label, path in paths.items():
+                samples = {False: [], True: []}
+                for _ in range(options['rounds']):
+                    for enabled in (False, True):
+                        with override_settings(METRICS_ENABLED=enabled):
+                            samples[enabled].append(self.measure(Client(), path, token, options['requests']))
+                off, on = statistics.median(samples[False]), statistics.median(samples[True])
+                self.stdout.write(f"{label:<14} {off:>11.3f} {on:>10.3f} {(on - off) / off:>9.1%}")
+
+    def measure(self, client, path, token, requests):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+        for _ in range(10):
+            client.get(path, **headers)
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.get(path, **headers)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200
+        return percentile(timings, 50)
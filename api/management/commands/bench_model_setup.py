@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.llm import GeminiBackend
+from api.persona import DEFAULT_SYSTEM_INSTRUCTION, get_persona
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-request model setup cost: building a GenerativeModel and system "
+        "instruction on every request vs the per-worker registry. Offline; no API calls."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        backend = GeminiBackend(api_key='bench-offline')
+
+        def per_request():
+            # What every chat turn used to do.
+            return backend.genai.GenerativeModel(backend.model_name, system_instruction=DEFAULT_SYSTEM_INSTRUCTION)
+
+        def registry():
+            return backend.get_model(get_persona())
+
+        registry()  # Warm, as asgi.py/wsgi.py do at worker start
+        self.stdout.write(f"{'setup':<12} {'us/request':>12}")
+        for name, setup in (('per-request', per_request), ('registry', registry)):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                setup()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{name:<12} {elapsed / iterations * 1e6:>12.1f}")
@@ -0,0 +1,66 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.bench import bench_database, create_bench_user, percentile
+from api.models import ChatSession, Message
+from api.search import query_terms, search, search_fallback
+
+TOPICS = (
+    "python django array binary search tree graph cache index query latency stream token model prompt "
+    "reply chat session user image upload sort merge heap stack queue hash table string pointer thread "
+    "async await loop server client request response error retry backoff limit budget memory disk"
+).split()
+# Zipf-like vocabulary: a few very common words, then a long tail, like real chat text.
+WORDS = ['the', 'a', 'to', 'is', 'and', 'of', 'in', 'it', 'you', 'for'] + TOPICS + [f'term{n}' for n in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+
+
+class Command(BaseCommand):
+    help = "p50/p95 latency of /api/search/ as the message table grows, against a LIKE scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', default='10000,100000',
+                            help="Total message counts to measure at, e.g. 10000,100000,1000000.")
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['levels'].split(',')]
+        rng = random.Random(7)
+        with bench_database():
+            users = [create_bench_user(f'bench{index}', sessions=5)[0] for index in range(options['users'])]
+            sessions = list(ChatSession.objects.values_list('id', flat=True))
+            target = users[0]
+            queries = [' '.join(rng.sample(TOPICS, 2)) for _ in range(options['queries'])]
+
+            self.stdout.write(f"{options['users']} users, vendor {connection.vendor}")
+            self.stdout.write(f"{'messages':>10} {'index p50':>10} {'index p95':>10} {'scan p50':>10} {'hits':>6}")
+            total = 0
+            for level in levels:
+                while total < level:
+                    batch = min(20000, level - total)
+                    with transaction.atomic():
+                        Message.objects.bulk_create(
+                            Message(session_id=rng.choice(sessions), is_from_user=bool(index % 2),
+                                    text=' '.join(rng.choices(WORDS, cum_weights=CUM_WEIGHTS, k=rng.randint(8, 60))))
+                            for index in range(batch)
+                        )
+                    total += batch
+
+                indexed, scanned, hits = [], [], 0
+                for q in queries:
+                    started = time.perf_counter()
+                    hits += len(search(target, q)['messages'])
+                    indexed.append((time.perf_counter() - started) * 1000)
+                for q in queries[:10]:
+                    started = time.perf_counter()
+                    search_fallback(target.id, query_terms(q), 20)
+                    scanned.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"{total:>10} {percentile(indexed, 50):>10.2f} {percentile(indexed, 95):>10.2f} "
+                    f"{percentile(scanned, 50):>10.2f} {hits / len(queries):>6.1f}"
+                )
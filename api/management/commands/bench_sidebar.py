@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.bench import bench_database, create_bench_user, percentile
+from api.models import ChatSession
+
+
+class Command(BaseCommand):
+    help = "Query count and latency of GET /api/chats/ with many sessions per user: full list vs keyset pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=10000, help='Sessions per user.')
+        parser.add_argument('--users', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            token = None
+            for index in range(options['users']):
+                user, user_token, _ = create_bench_user(username=f'bench{index}')
+                token = token or user_token
+                ChatSession.objects.bulk_create(
+                    (ChatSession(user=user, title=f'Chat {n}', pinned=n % 100 == 0, is_deleted=n % 10 == 9)
+                     for n in range(options['sessions'])),
+                    batch_size=1000,
+                )
+
+            client = Client(headers={'Authorization': f'Token {token.key}'})
+            limit = options['limit']
+            deep_page, deep_cursor = self.walk_cursor(client, limit, pages=20)
+            cases = [
+                ('full list', '/api/chats/'),
+                ('first page', f'/api/chats/?limit={limit}'),
+            ]
+            if deep_cursor:
+                cases.append((f'page {deep_page}', f'/api/chats/?limit={limit}&cursor={deep_cursor}'))
+
+            self.stdout.write(f"{options['users']} users x {options['sessions']} sessions, {options['repeat']} runs each")
+            self.stdout.write(f"{'request':<12} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>10}")
+            for name, path in cases:
+                timings = []
+                for _ in range(options['repeat']):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = client.get(path)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.content[:200]
+                self.stdout.write(
+                    f"{name:<12} {len(queries):>8} {percentile(timings, 50):>9.2f} "
+                    f"{percentile(timings, 95):>9.2f} {len(response.content):>10}"
+                )
+
+            page_query = ChatSession.objects.filter(user=token.user, is_deleted=False).order_by(
+                '-pinned', '-updated_at', '-id')[:limit]
+            self.stdout.write('\nPage query plan:\n' + page_query.explain())
+
+    def walk_cursor(self, client, limit, pages):
+        """
+        The number and cursor of page `pages + 1`, or of the last page when
+        the list is shorter; (1, None) when it fits on one page.
+        """
+        cursor, page = None, 1
+        for _ in range(pages):
+            path = f'/api/chats/?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            next_cursor = client.get(path).json()['next']
+            if next_cursor is None:
+                break
+            cursor, page = next_cursor, page + 1
+        return page, cursor
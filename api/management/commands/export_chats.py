@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import export_lines
+from api.models import ChatSession, User
+
+
+class Command(BaseCommand):
+    help = "Writes chats and their messages as NDJSON (all users, or --user ones) to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help="Username to export (repeatable).")
+        parser.add_argument('--include-deleted', action='store_true', help="Include soft-deleted chats.")
+        parser.add_argument('--output', '-o', default='-', help="File to write, '-' for stdout.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per cursor round trip.")
+
+    def handle(self, *args, **options):
+        sessions = ChatSession.objects.all()
+        if options['user']:
+            users = list(User.objects.filter(username__in=options['user']))
+            missing = set(options['user']) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+            sessions = sessions.filter(user__in=users)
+        if not options['include_deleted']:
+            sessions = sessions.filter(is_deleted=False)
+
+        started = time.perf_counter()
+        lines = 0
+        out = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        try:
+            for line in export_lines(sessions, chunk_size=options['chunk_size']):
+                out.write(line)
+                lines += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - started
+        rows = lines - 1  # Not counting the header
+        self.stderr.write(f"Exported {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
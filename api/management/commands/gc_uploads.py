@@ -0,0 +1,122 @@
+import posixpath
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.models import Message, UploadBlob
+from api.storage import digest_of, get_upload_storage
+
+UPLOAD_DIR = Message._meta.get_field('file_upload').upload_to.rstrip('/')
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes content-addressed uploads that no message references any more, plus their "
+        "derived artifacts. --recount first rebuilds the reference counts from Message rows; "
+        "--adopt-legacy moves files saved before content addressing into the blob store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute UploadBlob.ref_count from messages (after bulk or raw deletes).")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="Leave blobs created or reused in the last N seconds alone.")
+        parser.add_argument('--adopt-legacy', action='store_true',
+                            help="Re-store old name-suffixed uploads under their digest, deduplicating them.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = get_upload_storage()
+        grace, dry_run = options['grace'], options['dry_run']
+        started = time.perf_counter()
+
+        if options['adopt_legacy'] and not dry_run:
+            self.adopt_legacy(storage)
+        if options['recount']:
+            self.recount(storage)
+
+        deleted = freed = 0
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        for blob in UploadBlob.objects.filter(ref_count=0, created_at__lt=cutoff).iterator():
+            if storage.touched_within(blob.name, grace):
+                continue  # Reused by a save that hasn't committed its reference yet
+            if dry_run:
+                deleted, freed = deleted + 1, freed + blob.size
+                continue
+            # Only drop the file if no message took a reference since the query above.
+            if UploadBlob.objects.filter(pk=blob.pk, ref_count=0).delete()[0]:
+                freed += storage.delete_blob(blob.name)
+                deleted += 1
+
+        # Files and artifacts with no UploadBlob row at all: crashed saves, rejected uploads.
+        known = set(UploadBlob.objects.values_list('digest', flat=True))
+        orphans = 0
+        for name in list(storage.list_blobs(UPLOAD_DIR)):
+            if digest_of(name) not in known and not storage.touched_within(name, grace):
+                orphans += 1
+                if not dry_run:
+                    freed += storage.delete_blob(name)
+        for digest in list(storage.list_derived()):
+            if digest not in known and not storage.touched_within(storage.derived_dir(digest), grace):
+                if not dry_run:
+                    storage.delete_derived(digest)
+
+        elapsed = time.perf_counter() - started
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {deleted} unreferenced and {orphans} orphaned blobs "
+            f"({freed / 1024 / 1024:.1f} MB) in {elapsed:.1f}s"
+        ))
+
+    def recount(self, storage):
+        counts = Counter(
+            digest_of(name)
+            for name in Message.objects.exclude(file_upload='').exclude(file_upload__isnull=True)
+            .values_list('file_upload', flat=True).iterator()
+        )
+        counts.pop(None, None)  # Files saved before content addressing
+
+        blobs = {blob.digest: blob for blob in UploadBlob.objects.all()}
+        changed = []
+        for digest, blob in blobs.items():
+            if blob.ref_count != counts.get(digest, 0):
+                blob.ref_count = counts.get(digest, 0)
+                changed.append(blob)
+
+        missing = []
+        names = {digest_of(name): name for name in storage.list_blobs(UPLOAD_DIR)}
+        for digest, count in counts.items():
+            if digest not in blobs and digest in names:
+                missing.append(UploadBlob(digest=digest, name=names[digest], size=storage.size(names[digest]),
+                                          ref_count=count))
+
+        with transaction.atomic():
+            UploadBlob.objects.bulk_update(changed, ['ref_count'], batch_size=500)
+            UploadBlob.objects.bulk_create(missing, batch_size=500)
+        self.stdout.write(f"Recounted references: {len(changed)} corrected, {len(missing)} blobs registered")
+
+    def adopt_legacy(self, storage):
+        names = set(
+            Message.objects.exclude(file_upload='').exclude(file_upload__isnull=True)
+            .values_list('file_upload', flat=True)
+        )
+        adopted = 0
+        for name in sorted(name for name in names if digest_of(name) is None):
+            if not storage.exists(name):
+                continue
+            with storage.open(name) as fh:
+                new_name = storage.save(posixpath.join(UPLOAD_DIR, posixpath.basename(name)), fh)
+            with transaction.atomic():
+                count = Message.objects.filter(file_upload=name).update(file_upload=new_name)
+                blob, created = UploadBlob.objects.get_or_create(
+                    digest=digest_of(new_name), defaults={'name': new_name, 'size': storage.size(new_name)}
+                )
+                UploadBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + count)
+            storage.delete(name)
+            adopted += 1
+        self.stdout.write(f"Adopted {adopted} legacy uploads")
@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import ExportFormatError, import_lines
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads an NDJSON export (see export_chats) in one transaction, keeping timestamps. Chats go to the "
+        "users named in the file, or all to --user. Messages with an upload count as references to it "
+        "(copy the upload files over first)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, '-' for stdin.")
+        parser.add_argument('--user', help="Import every chat into this user's account.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per bulk INSERT.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        started = time.perf_counter()
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            counts = import_lines(source, user=user, batch_size=options['batch_size'])
+        except ExportFormatError as exc:
+            raise CommandError(str(exc)) from exc
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        elapsed = time.perf_counter() - started
+        rows = counts['sessions'] + counts['messages']
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counts['sessions']} sessions, {counts['messages']} messages and {counts['feedback']} "
+            f"feedback rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
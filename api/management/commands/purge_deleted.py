@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.idempotency import delete_expired
+from api.purge import purge_deleted_sessions, purgeable
+
+
+class Command(BaseCommand):
+    help = (
+        "Hard-deletes chats that were soft-deleted more than --days ago, with their messages, "
+        "feedback and any upload files no other message uses, in batches of --batch-size sessions. "
+        "Also deletes expired idempotency keys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PURGE_RETENTION_DAYS,
+                            help="Retention window after soft deletion.")
+        parser.add_argument('--batch-size', type=int, default=settings.PURGE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches (default: until nothing is left).")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between batches, to leave the database to other writers.")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="Keep upload files reused in the last N seconds.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be purged.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            stats = purgeable(options['days']).aggregate(sessions=Count('id', distinct=True),
+                                                         messages=Count('messages'))
+            self.stdout.write(f"Would purge {stats['sessions']} sessions ({stats['messages']} messages)")
+            return
+
+        result = purge_deleted_sessions(
+            retention_days=options['days'], batch_size=options['batch_size'],
+            max_batches=options['max_batches'], pause=options['pause'], grace=options['grace'],
+        )
+        elapsed = max(result.elapsed, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {result.sessions} sessions, {result.messages} messages, {result.feedback} feedback rows "
+            f"and {result.blobs} files ({result.freed / 1024 / 1024:.1f} MB) in {result.batches} batches, "
+            f"{result.elapsed:.2f}s ({result.sessions / elapsed:.0f} sessions/s, {result.messages / elapsed:.0f} messages/s)"
+        ))
+        self.stdout.write(f"Deleted {delete_expired()} expired idempotency keys")
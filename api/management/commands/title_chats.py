@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.titles import title_sessions, untitled_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Names every chat still called 'New Chat' that has messages, --batch-size chats per "
+        "model call (or with the local heuristic), as the background titler does."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TITLE_BATCH_SIZE)
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many chats.")
+        parser.add_argument('--backend', default=None,
+                            help="Name in LLM_BACKENDS to title with ('' for the heuristic; default: TITLE_BACKEND).")
+
+    def handle(self, *args, **options):
+        backend = settings.TITLE_BACKEND if options['backend'] is None else options['backend']
+        started = time.perf_counter()
+        seen = titled = 0
+        last_id = 0
+        while options['limit'] is None or seen < options['limit']:
+            size = options['batch_size'] if options['limit'] is None else min(options['batch_size'],
+                                                                               options['limit'] - seen)
+            ids = list(untitled_sessions().filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+            if not ids:
+                break
+            titled += title_sessions(ids, backend=backend)
+            seen += len(ids)
+            last_id = ids[-1]
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Titled {titled} of {seen} chats with {backend or 'the heuristic'} in {elapsed:.2f}s "
+            f"({seen / elapsed:.0f} chats/s)"
+        ))
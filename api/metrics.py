@@ -0,0 +1,237 @@
+"""
+Per-process request metrics in fixed-bucket histograms, exposed in the
+Prometheus text format at /api/metrics/ (each worker reports its own numbers;
+scrape every worker or sum them in Prometheus).
+
+MetricsMiddleware (api.middleware) opens a RequestMetrics for each request in
+a context variable, which follows the request into sync_to_async threads and
+tasks it spawns. A database execute wrapper, installed on every connection,
+adds query counts and time to it; `timed()` blocks in the views add named
+phases (image preprocessing, the model call). At the end the middleware
+records the histograms and sends the phases in a Server-Timing header.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from rest_framework.permissions import BasePermission
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+CHARS_PER_TOKEN = 4  # Same estimate as context.estimate_tokens
+
+
+class Histogram:
+    """Cumulative-on-read bucket counts; `observe` is a bisect and an increment under a lock."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Registry:
+    """name -> (help, buckets) and (name, labels) -> Histogram."""
+
+    def __init__(self):
+        self.families = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, buckets=SECONDS_BUCKETS):
+        self.families[name] = (help, buckets)
+        return name
+
+    def observe(self, name, value, **labels):
+        key = (name, *labels.items())  # Call sites pass labels in a fixed order
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(self.families[name][1]))
+        histogram.observe(value)
+
+    def render(self):
+        lines = []
+        for name, (help, buckets) in sorted(self.families.items()):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, *labels), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+                if metric != name:
+                    continue
+                counts, total, count = histogram.snapshot()
+                label_text = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+                prefix = label_text + ',' if label_text else ''
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label_text}}} {total}')
+                lines.append(f'{name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+REQUEST_SECONDS = registry.histogram('rgpt_request_duration_seconds', 'Time to response headers, by endpoint.')
+REQUEST_DB_QUERIES = registry.histogram('rgpt_request_db_queries', 'Database queries per request.', COUNT_BUCKETS)
+REQUEST_DB_SECONDS = registry.histogram('rgpt_request_db_seconds', 'Time spent in database queries per request.')
+RESPONSE_BYTES = registry.histogram('rgpt_response_bytes', 'Response body size.', BYTES_BUCKETS)
+PHASE_SECONDS = registry.histogram('rgpt_phase_seconds', 'Time in named request phases (image, model, ...).')
+LLM_TTFT_SECONDS = registry.histogram('rgpt_llm_time_to_first_token_seconds', 'Model time to first token.')
+LLM_SECONDS = registry.histogram('rgpt_llm_generation_seconds', 'Model call duration, start to last token.')
+LLM_TOKENS_PER_SECOND = registry.histogram('rgpt_llm_tokens_per_second', 'Estimated reply tokens per second.',
+                                           RATE_BUCKETS)
+JOB_WAIT_SECONDS = registry.histogram('rgpt_job_wait_seconds', 'Time a generation job waited for a worker.')
+JOB_SECONDS = registry.histogram('rgpt_job_duration_seconds', 'Generation job run time, by outcome.')
+TITLE_BATCH_SESSIONS = registry.histogram('rgpt_title_batch_sessions', 'Chats titled per batch.', COUNT_BUCKETS)
+TITLE_BATCH_SECONDS = registry.histogram('rgpt_title_batch_seconds', 'Time to title one batch, by source.')
+TITLE_DELAY_SECONDS = registry.histogram('rgpt_title_delay_seconds', 'Time from a chat\'s first turn to its title.')
+
+
+class RequestMetrics:
+    """
+    One request's totals. The request's queries can run on several threads at
+    once (sync_to_async, the image pool, a streamed body), so every update
+    and read takes the lock.
+    """
+    __slots__ = ('started', 'db_queries', 'db_seconds', 'phases', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def snapshot(self):
+        """(queries, query seconds, {phase: seconds}) as of now."""
+        with self._lock:
+            return self.db_queries, self.db_seconds, dict(self.phases)
+
+    def server_timing(self, total):
+        db_queries, db_seconds, phases = self.snapshot()
+        parts = [f'db;dur={db_seconds * 1000:.1f};desc="{db_queries} queries"']
+        parts += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+current_request = ContextVar('rgpt_request_metrics', default=None)
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+def note(phase, seconds):
+    """Adds `seconds` to the current request (Server-Timing) and to rgpt_phase_seconds."""
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.add_phase(phase, seconds)
+        registry.observe(PHASE_SECONDS, seconds, phase=phase)
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        note(phase, time.perf_counter() - started)
+
+
+def observe_generation(model, started, first_token_at, chars):
+    """
+    Model timings for one reply of `chars` characters. `first_token_at` is
+    None for non-streamed calls, where tokens/s then covers the whole call.
+    """
+    if not enabled():
+        return
+    finished = time.perf_counter()
+    registry.observe(LLM_SECONDS, finished - started, model=model)
+    note('model', finished - started)
+    if first_token_at is not None:
+        registry.observe(LLM_TTFT_SECONDS, first_token_at - started, model=model)
+        note('ttft', first_token_at - started)
+    generating = finished - (first_token_at or started)
+    if chars and generating > 0:
+        registry.observe(LLM_TOKENS_PER_SECOND, chars / CHARS_PER_TOKEN / generating, model=model)
+
+
+def time_queries(execute, sql, params, many, context):
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+connection_created.connect(install_query_timer, dispatch_uid='rgpt-query-timer')
+
+
+def observe_request(endpoint, method, status, elapsed):
+    registry.observe(REQUEST_SECONDS, elapsed, endpoint=endpoint, method=method, status=status)
+
+
+def observe_body(metrics, endpoint, size):
+    """Per-request totals, recorded once the body is out (streamed bodies keep querying until they end)."""
+    db_queries, db_seconds, _ = metrics.snapshot()
+    registry.observe(RESPONSE_BYTES, size, endpoint=endpoint)
+    registry.observe(REQUEST_DB_QUERIES, db_queries, endpoint=endpoint)
+    registry.observe(REQUEST_DB_SECONDS, db_seconds, endpoint=endpoint)
+
+
+class HasMetricsToken(BasePermission):
+    """`Authorization: Bearer <METRICS_TOKEN>`, for scrapers that have no user account."""
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        return bool(token) and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
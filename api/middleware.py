@@ -0,0 +1,119 @@
+import time
+from contextlib import suppress
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise 6 is sync-only, which makes Django run the whole middleware
+    chain (and every async view behind it) in a worker thread under ASGI.
+    The static-file lookup is an in-memory dict hit, so it is safe to do on
+    the event loop and pass everything else straight through.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Times each request and counts its queries (api.metrics), records them per
+    endpoint (the URL route, so ids don't multiply the series) and adds a
+    Server-Timing header. Streamed bodies are measured as they are sent and
+    recorded when the stream ends.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    def finish(self, request, response, request_metrics):
+        elapsed = time.perf_counter() - request_metrics.started
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.route if match is not None else 'unmatched'
+        metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
+        response['Server-Timing'] = request_metrics.server_timing(elapsed)
+        if response.streaming:
+            response.streaming_content = self.measure_stream(response, endpoint, request_metrics)
+        else:
+            metrics.observe_body(request_metrics, endpoint, len(response.content))
+        return response
+
+    def measure_stream(self, response, endpoint, request_metrics):
+        # The body is produced after this middleware has returned; put the request's
+        # metrics back in context so queries and model calls made while streaming count.
+        content = response.streaming_content
+        if response.is_async:
+            async def measured():
+                token, size = metrics.current_request.set(request_metrics), 0
+                try:
+                    async for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    metrics.observe_body(request_metrics, endpoint, size)
+                    with suppress(ValueError):  # Closed from another context
+                        metrics.current_request.reset(token)
+        else:
+            def measured():
+                token, size = metrics.current_request.set(request_metrics), 0
+                try:
+                    for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    metrics.observe_body(request_metrics, endpoint, size)
+                    with suppress(ValueError):
+                        metrics.current_request.reset(token)
+        return measured()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_create_superuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_transcript',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='transcript_until_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
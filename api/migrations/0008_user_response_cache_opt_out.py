@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_chatsession_context_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='response_cache_opt_out',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_user_response_cache_opt_out'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp', 'id'], name='message_session_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_message_message_session_ts_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', '-pinned', '-updated_at', '-id'], name='chatsession_sidebar_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:49
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_chatsession_last_message_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='file_upload',
+            field=models.FileField(blank=True, null=True, storage=api.storage.get_upload_storage, upload_to='user_uploads/'),
+        ),
+    ]
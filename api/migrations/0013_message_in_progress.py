@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_uploadblob_alter_message_file_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='in_progress',
+            field=models.BooleanField(default=False),
+        ),
+    ]
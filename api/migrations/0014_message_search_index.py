@@ -0,0 +1,93 @@
+from django.db import migrations
+
+# SQLite: an FTS5 index over message text plus an `owner` token ('u<user id>'),
+# so a search only walks the requesting user's postings. It is external-content
+# (reads text back through a view for snippets) and kept current by triggers,
+# so every insert path, bulk_create included, updates it. Replies still being
+# streamed (in_progress) are indexed once they finish.
+SQLITE_OWNER = "(SELECT 'u' || user_id FROM api_chatsession WHERE id = {row}.session_id)"
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIEW api_message_search_source AS
+    SELECT m.id AS id, m.text AS text, 'u' || s.user_id AS owner
+    FROM api_message m JOIN api_chatsession s ON s.id = m.session_id
+    """,
+    """
+    CREATE VIRTUAL TABLE api_message_fts USING fts5(
+        text, owner, content='api_message_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER api_message_fts_ai AFTER INSERT ON api_message WHEN NOT new.in_progress BEGIN
+        INSERT INTO api_message_fts(rowid, text, owner) VALUES (new.id, new.text, {SQLITE_OWNER.format(row='new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER api_message_fts_ad AFTER DELETE ON api_message WHEN NOT old.in_progress BEGIN
+        INSERT INTO api_message_fts(api_message_fts, rowid, text, owner)
+        VALUES ('delete', old.id, old.text, {SQLITE_OWNER.format(row='old')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER api_message_fts_au AFTER UPDATE OF text, in_progress ON api_message
+    WHEN NOT old.in_progress OR NOT new.in_progress BEGIN
+        INSERT INTO api_message_fts(api_message_fts, rowid, text, owner)
+        SELECT 'delete', old.id, old.text, {SQLITE_OWNER.format(row='old')} WHERE NOT old.in_progress;
+        INSERT INTO api_message_fts(rowid, text, owner)
+        SELECT new.id, new.text, {SQLITE_OWNER.format(row='new')} WHERE NOT new.in_progress;
+    END
+    """,
+    """
+    INSERT INTO api_message_fts(rowid, text, owner)
+    SELECT m.id, m.text, 'u' || s.user_id
+    FROM api_message m JOIN api_chatsession s ON s.id = m.session_id
+    WHERE NOT m.in_progress
+    """,
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS api_message_fts_au",
+    "DROP TRIGGER IF EXISTS api_message_fts_ad",
+    "DROP TRIGGER IF EXISTS api_message_fts_ai",
+    "DROP TABLE IF EXISTS api_message_fts",
+    "DROP VIEW IF EXISTS api_message_search_source",
+]
+
+# PostgreSQL: a GIN index on (session_id, tsvector), led by session_id
+# (btree_gin, a trusted extension), so a search looks the term up within each
+# of the user's chats instead of matching every user's messages first.
+# Postgres maintains it on every write.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    """
+    CREATE INDEX message_session_search_idx ON api_message
+    USING gin (session_id, to_tsvector('simple'::regconfig, text)) WHERE NOT in_progress
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS message_session_search_idx",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_message_in_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at'], name='chatsession_purge_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('title', 'New Chat')), fields=['id'], name='chatsession_untitled_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:10
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite adds these columns by remaking api_chatsession, which fails while the
+# search view and triggers from 0014 refer to the table, so they are dropped
+# for the duration and put back unchanged. The FTS table and its rows stay.
+search = import_module('api.migrations.0014_message_search_index')
+SEARCH_VIEW, SEARCH_TRIGGERS = search.SQLITE_FORWARD[0], search.SQLITE_FORWARD[2:5]
+DROP_SEARCH_SOURCES = [
+    "DROP TRIGGER IF EXISTS api_message_fts_au",
+    "DROP TRIGGER IF EXISTS api_message_fts_ad",
+    "DROP TRIGGER IF EXISTS api_message_fts_ai",
+    "DROP VIEW IF EXISTS api_message_search_source",
+]
+CREATE_SEARCH_SOURCES = [SEARCH_VIEW, *SEARCH_TRIGGERS]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_chatsession_untitled_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(run({'sqlite': DROP_SEARCH_SOURCES}), run({'sqlite': CREATE_SEARCH_SOURCES})),
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summarized_until_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(run({'sqlite': CREATE_SEARCH_SOURCES}), run({'sqlite': DROP_SEARCH_SOURCES})),
+    ]
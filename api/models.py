@@ -1,6 +1,12 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .storage import digest_of, get_upload_storage
 
 class User(AbstractUser):
     """
@@ -9,6 +15,9 @@ class User(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) # Automatically updates on save
     profile_picture_url = models.URLField(max_length=255, blank=True, null=True) 
+    response_cache_opt_out = models.BooleanField(default=False) # Never serve or store cached model replies
+
+DEFAULT_TITLE = 'New Chat' # Until the user or api.titles names the chat
 
 class ChatSession(models.Model):
     """
@@ -21,7 +30,7 @@ class ChatSession(models.Model):
         null=True,
         blank=True
     )
-    title = models.CharField(max_length=200, default='New Chat')
+    title = models.CharField(max_length=200, default=DEFAULT_TITLE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) # Automatically updates on save
 
@@ -31,14 +40,52 @@ class ChatSession(models.Model):
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    # --- Denormalized for the sidebar; kept current by Message.save() ---
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=140, blank=True, default='')
+
+    # --- Turns that fell out of the model's context window (see api.context and api.summaries) ---
+    context_summary = models.TextField(blank=True, default='')
+    summarized_until_id = models.BigIntegerField(null=True, blank=True) # Last Message id folded into the summary
+    # Truncated transcript of the same turns, sent until the chat has a summary
+    context_transcript = models.TextField(blank=True, default='')
+    transcript_until_id = models.BigIntegerField(null=True, blank=True) # Last Message id in the transcript
+
     class Meta:
         # Default ordering for queries: newest updated chats first
         ordering = ['-pinned', '-updated_at']
+        indexes = [
+            # Sidebar listing: one user's live chats in display order
+            models.Index(
+                fields=['user', '-pinned', '-updated_at', '-id'],
+                condition=models.Q(is_deleted=False),
+                name='chatsession_sidebar_idx',
+            ),
+            # Purge of soft-deleted chats, oldest first (see api.purge)
+            models.Index(
+                fields=['deleted_at'],
+                condition=models.Q(is_deleted=True),
+                name='chatsession_purge_idx',
+            ),
+            # Chats still waiting for an automatic title (see api.titles)
+            models.Index(
+                fields=['id'],
+                condition=models.Q(title=DEFAULT_TITLE, is_deleted=False),
+                name='chatsession_untitled_idx',
+            ),
+        ]
 
     def __str__(self):
         username = self.user.username if self.user else "Guest"
         return f'{username} - {self.title}'
 
+def message_preview(text):
+    """One-line preview shown under a chat's title in the sidebar."""
+    text = ' '.join(text.split())
+    return text if len(text) <= 140 else text[:139] + '…'
+
+
 class Message(models.Model):
     """
     A single message within a ChatSession. Can contain text and/or a file.
@@ -49,16 +96,167 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True) # Serves as created_at
 
     # --- NEW: File Upload and Metadata Fields ---
-    file_upload = models.FileField(upload_to='user_uploads/', null=True, blank=True)
+    file_upload = models.FileField(upload_to='user_uploads/', storage=get_upload_storage, null=True, blank=True)
     metadata = models.JSONField(null=True, blank=True) # e.g., {'tool_used': 'weather_api'}
+    in_progress = models.BooleanField(default=False) # Bot reply still being streamed into `text`
 
     class Meta:
         # Default ordering for messages: oldest first (chronological order)
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination over (timestamp, id) within a session
+            models.Index(fields=['session', 'timestamp', 'id'], name='message_session_ts_id_idx'),
+        ]
 
     def __str__(self):
         return f'Message in session {self.session.id} at {self.timestamp}'
 
+    def save(self, *args, **kwargs):
+        # A new message bumps its session's counters and recency in the same transaction.
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ChatSession.objects.filter(pk=self.session_id).update(
+                message_count=models.F('message_count') + 1,
+                last_message_at=self.timestamp,
+                last_message_preview=message_preview(self.text),
+                updated_at=self.timestamp,
+            )
+            if self.file_upload:
+                UploadBlob.add_reference(self.file_upload)
+
+
+class UploadBlob(models.Model):
+    """
+    One content-addressed attachment file (see api.storage) and how many
+    messages point at it. Blobs whose count drops to zero are deleted by
+    `manage.py gc_uploads`, which can also recount from the messages.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=100) # Storage name, as on Message.file_upload
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} refs)'
+
+    @classmethod
+    def add_reference(cls, file):
+        digest = digest_of(file.name)
+        if digest is None:
+            return  # Saved before content addressing
+        blob, created = cls.objects.get_or_create(
+            digest=digest, defaults={'name': file.name, 'size': file.size, 'ref_count': 1}
+        )
+        if not created:
+            cls.objects.filter(pk=digest).update(ref_count=models.F('ref_count') + 1)
+
+    @classmethod
+    def add_references(cls, names):
+        """
+        add_reference for a batch of messages created without save() (bulk_create),
+        given their stored file names: one UPDATE per distinct count. Blobs whose
+        file isn't in storage get no row, as with `gc_uploads --recount`.
+        """
+        counts = Counter(digest_of(name) for name in names if name)
+        counts.pop(None, None)  # Saved before content addressing
+        if not counts:
+            return
+        names = {digest_of(name): name for name in names if name}
+        known = set(cls.objects.filter(pk__in=list(counts)).values_list('pk', flat=True))
+        storage = get_upload_storage()
+        cls.objects.bulk_create([
+            cls(digest=digest, name=names[digest], size=storage.size(names[digest]), ref_count=0)
+            for digest in counts if digest not in known and storage.exists(names[digest])
+        ], ignore_conflicts=True)
+        by_count = {}
+        for digest, count in counts.items():
+            by_count.setdefault(count, []).append(digest)
+        for count, digests in by_count.items():
+            cls.objects.filter(pk__in=digests).update(ref_count=models.F('ref_count') + count)
+
+
+@receiver(post_delete, sender=Message)
+def release_upload(sender, instance, **kwargs):
+    digest = digest_of(instance.file_upload.name)
+    if digest is not None:
+        UploadBlob.objects.filter(pk=digest, ref_count__gt=0).update(ref_count=models.F('ref_count') - 1)
+
+
+class RateLimitBucket(models.Model):
+    """
+    Token bucket state shared by all workers when RATE_LIMIT_STORE is
+    'database' (see api.ratelimit). `updated` is a Unix timestamp.
+    """
+    key = models.CharField(max_length=64, primary_key=True) # 'user:<id>' or 'global'
+    tokens = models.FloatField()
+    updated = models.FloatField()
+
+    def __str__(self):
+        return f'{self.key}: {self.tokens:.0f} tokens'
+
+
+class IdempotencyKey(models.Model):
+    """
+    An `Idempotency-Key` sent with a message POST (see api.idempotency): the
+    messages that request created and, once it finished, its response body.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64) # Hash of the chat id, text and upload
+    user_message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    bot_message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    response = models.JSONField(null=True, blank=True) # None while the request is in flight
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} ({"done" if self.response is not None else "in flight"})'
+
+
+class GenerationJob(models.Model):
+    """
+    A bot reply generated in the background (api.jobs) for a user message
+    posted in job mode. Workers claim a pending job by moving it to running
+    under a lease they keep renewing; a running job whose lease ran out was
+    left by a crashed worker and goes back to pending.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='+')
+    user_message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='+')
+    bot_message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    lease_until = models.DateTimeField(null=True, blank=True)
+    reserved_tokens = models.PositiveIntegerField(default=0) # Rate limit reservation, settled when it ends
+    cache_key = models.CharField(max_length=128, blank=True) # Reply cache entry to fill, if any
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Recovery scans only unfinished jobs
+            models.Index(fields=['status', 'lease_until'], name='job_status_lease_idx',
+                         condition=models.Q(status__in=['pending', 'running'])),
+        ]
+
+    def __str__(self):
+        return f'Job {self.pk} ({self.status})'
+
+
 class MessageFeedback(models.Model):
     """
     Stores user feedback (e.g., thumbs up/down) for a specific AI-generated message.
@@ -0,0 +1,154 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from .serializers import UserSerializer
+
+
+def encode_cursor(*values):
+    raw = '|'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parts):
+    """Splits a cursor back into `parts` strings; raises a 400 for anything malformed."""
+    try:
+        values = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+    except (ValueError, UnicodeDecodeError):
+        values = []
+    if len(values) != parts:
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return values
+
+
+def parse_limit(request, default, maximum):
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    return max(1, min(limit, maximum))
+
+
+def message_cursor(message):
+    return encode_cursor(message.timestamp.isoformat(), message.id)
+
+
+def decode_message_cursor(cursor):
+    timestamp, pk = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (timestamp, id), so every page is one index range
+    scan however long the chat is. Results are always oldest first.
+
+    - no parameters: the latest page
+    - ?before=<cursor>: the page just older than the cursor ("load older")
+    - ?after=<cursor> or ?since_id=<message id>: messages newer than that point
+    - ?limit=N: page size (default 50, max 200)
+    """
+    default_limit = 50
+    max_limit = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = parse_limit(request, self.default_limit, self.max_limit)
+        params = request.query_params
+
+        if 'after' in params or 'since_id' in params:
+            if 'after' in params:
+                timestamp, pk = decode_message_cursor(params['after'])
+            else:
+                try:
+                    since_id = int(params['since_id'])
+                except ValueError:
+                    raise ValidationError({'since_id': 'Must be a message id.'})
+                anchor = queryset.filter(id=since_id).values_list('timestamp', 'id').first()
+                if anchor is None:
+                    raise ValidationError({'since_id': 'Unknown message.'})
+                timestamp, pk = anchor
+            page = list(
+                queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+                .order_by('timestamp', 'id')[:limit + 1]
+            )
+            has_more = len(page) > limit
+            self.page = page[:limit]
+            self.older, self.newer = None, message_cursor(self.page[-1]) if has_more else None
+            return self.page
+
+        if 'before' in params:
+            timestamp, pk = decode_message_cursor(params['before'])
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+        page = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        self.page = page[:limit][::-1]
+        self.older, self.newer = message_cursor(self.page[0]) if has_more else None, None
+        return self.page
+
+    def get_paginated_data(self, data):
+        return {'older': self.older, 'newer': self.newer, 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'older': {'type': 'string', 'nullable': True},
+                'newer': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class ChatSessionKeysetPagination(BasePagination):
+    """
+    Keyset pagination for the sidebar in its display order (pinned first,
+    then most recently updated, id as tie-breaker), matching the partial
+    index on ChatSession. Only used when the client sends ?limit= or
+    ?cursor=; otherwise the list stays unpaginated. The requesting user is
+    sent once in the envelope instead of on every row.
+    """
+    default_limit = 50
+    max_limit = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if 'limit' not in params and 'cursor' not in params:
+            return None
+        self.request = request
+        limit = parse_limit(request, self.default_limit, self.max_limit)
+
+        if 'cursor' in params:
+            pinned, updated_at, pk = decode_cursor(params['cursor'], 3)
+            try:
+                pinned, updated_at, pk = pinned == '1', datetime.fromisoformat(updated_at), int(pk)
+            except ValueError:
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+            queryset = queryset.filter(
+                Q(pinned__lt=pinned)
+                | Q(pinned=pinned, updated_at__lt=updated_at)
+                | Q(pinned=pinned, updated_at=updated_at, id__lt=pk)
+            )
+        page = list(queryset.order_by('-pinned', '-updated_at', '-id')[:limit + 1])
+        self.page = page[:limit]
+        last = self.page[-1] if len(page) > limit else None
+        self.next_cursor = (
+            encode_cursor(int(last.pinned), last.updated_at.isoformat(), last.id) if last else None
+        )
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'user': UserSerializer(self.request.user).data,
+            'next': self.next_cursor,
+            'results': data,
+        })
@@ -0,0 +1,163 @@
+"""
+Hard deletion of soft-deleted chats once they are older than the retention
+window. Sessions go in batches of `batch_size`, each in its own short
+transaction, with raw bulk DELETEs of their feedback, messages and the
+sessions themselves: Django's delete collector would load every related row
+(and fire a signal per message) first. Upload references are released with
+one UPDATE per distinct file, and files nothing points at any more are then
+removed from storage.
+
+With PURGE_INTERVAL set, a daemon thread in each serving process runs the
+purge periodically (and drops expired idempotency keys); it starts with the first request, not with management
+commands.
+"""
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_started, setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import idempotency
+from .models import ChatSession, GenerationJob, IdempotencyKey, Message, MessageFeedback, UploadBlob
+from .storage import digest_of, get_upload_storage
+
+logger = logging.getLogger(__name__)
+
+PurgeResult = namedtuple('PurgeResult', ['sessions', 'messages', 'feedback', 'blobs', 'freed', 'batches', 'elapsed'])
+
+
+def purgeable(retention_days):
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return ChatSession.objects.filter(is_deleted=True, deleted_at__lt=cutoff)
+
+
+def purge_batch(ids):
+    """Deletes these sessions and everything under them. Returns (sessions, messages, feedback, {digest: refs})."""
+    with transaction.atomic():
+        # Lock the batch so concurrent purges (several workers) skip it instead of
+        # releasing the same upload references twice. SQLite has no row locks, but
+        # its first write below takes the database write lock, which does the same.
+        ids = list(ChatSession.objects.select_for_update(skip_locked=True)
+                   .filter(id__in=ids, is_deleted=True).values_list('id', flat=True))
+        if not ids:
+            return 0, 0, 0, {}
+        feedback = MessageFeedback.objects.filter(message__session_id__in=ids)
+        feedback_count = feedback._raw_delete(feedback.db)
+        keys = IdempotencyKey.objects.filter(user_message__session_id__in=ids)
+        keys._raw_delete(keys.db)
+        generation_jobs = GenerationJob.objects.filter(session_id__in=ids)
+        generation_jobs._raw_delete(generation_jobs.db)
+
+        released = Counter()
+        files = (Message.objects.filter(session_id__in=ids).exclude(file_upload='').exclude(file_upload__isnull=True)
+                 .values('file_upload').annotate(refs=Count('id')).order_by())
+        for row in files:
+            digest = digest_of(row['file_upload'])
+            if digest is not None:
+                released[digest] += row['refs']
+
+        # Messages before sessions: the search index trigger looks up each message's session.
+        messages = Message.objects.filter(session_id__in=ids)
+        message_count = messages._raw_delete(messages.db)
+        for digest, refs in released.items():
+            UploadBlob.objects.filter(pk=digest).update(ref_count=Greatest(F('ref_count') - refs, 0))
+        sessions = ChatSession.objects.filter(id__in=ids)
+        session_count = sessions._raw_delete(sessions.db)
+    return session_count, message_count, feedback_count, released
+
+
+def delete_released_blobs(digests, grace=0):
+    """Removes the files of these blobs that no message references any more. Returns (blobs, bytes freed)."""
+    storage = get_upload_storage()
+    deleted = freed = 0
+    for blob in UploadBlob.objects.filter(pk__in=list(digests), ref_count=0):
+        if grace and storage.touched_within(blob.name, grace):
+            continue  # Reused by an upload that hasn't committed its reference yet
+        if UploadBlob.objects.filter(pk=blob.pk, ref_count=0).delete()[0]:
+            freed += storage.delete_blob(blob.name)
+            deleted += 1
+    return deleted, freed
+
+
+def purge_deleted_sessions(retention_days=None, batch_size=None, max_batches=None, pause=0.0, grace=3600):
+    """
+    Purges soft-deleted sessions older than `retention_days`, oldest first, at
+    most `max_batches` batches. `pause` seconds between batches leaves room
+    for other writers.
+    """
+    retention_days = settings.PURGE_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    started = time.perf_counter()
+    sessions = messages = feedback = batches = 0
+    released = set()
+    while max_batches is None or batches < max_batches:
+        # Oldest first, straight off the partial deleted_at index.
+        ids = list(purgeable(retention_days).order_by('deleted_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        counts = purge_batch(ids)
+        if not counts[0]:
+            break  # Another worker holds this batch
+        sessions, messages, feedback = sessions + counts[0], messages + counts[1], feedback + counts[2]
+        released.update(counts[3])
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    blobs, freed = delete_released_blobs(released, grace=grace)
+    return PurgeResult(sessions, messages, feedback, blobs, freed, batches, time.perf_counter() - started)
+
+
+class PurgeScheduler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='rgpt-purge', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                result = purge_deleted_sessions(max_batches=settings.PURGE_MAX_BATCHES)
+                if result.sessions:
+                    logger.info("Purged %d deleted sessions (%d messages, %d files) in %.1fs",
+                                result.sessions, result.messages, result.blobs, result.elapsed)
+                idempotency.delete_expired()
+            except Exception:
+                logger.exception("Purge of deleted sessions failed")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(**kwargs):
+    global _scheduler
+    if _scheduler is not None or not settings.PURGE_INTERVAL:
+        return
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PurgeScheduler(settings.PURGE_INTERVAL)
+            _scheduler.start()
+
+
+request_started.connect(start_scheduler, dispatch_uid='rgpt-purge-scheduler')
+
+
+@receiver(setting_changed)
+def reset_scheduler(setting, **kwargs):
+    global _scheduler
+    if setting == 'PURGE_INTERVAL' and _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
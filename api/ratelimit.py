@@ -0,0 +1,218 @@
+"""
+Admission control for chat turns, measured in estimated model tokens.
+
+Each user and the service as a whole get a token bucket that refills at
+RATE_LIMIT_*_TOKENS_PER_MINUTE and holds at most one minute's worth. A turn
+reserves its estimate (prompt, image and a full reply) before any work is
+done; when the bucket can't cover it the request gets a 429 with Retry-After
+straight away instead of queueing for the model. Once the reply is in, the
+reservation is settled against what the turn actually sent and received
+(persona and history included), so a bucket can go negative and the next
+turn waits longer. Turns that never reached the model are refunded.
+
+Buckets live in this process ('local') or in the RateLimitBucket table
+('database'), where a take is one conditional UPDATE so workers can't both
+spend the same tokens.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+from .context import estimate_tokens
+from .models import RateLimitBucket
+
+GLOBAL_KEY = 'global'
+IMAGE_TOKENS = 258  # What Gemini bills for an image of up to 384px a side; bigger ones are tiled
+LOCAL_PRUNE_SIZE = 10000
+
+Decision = namedtuple('Decision', ['allowed', 'retry_after', 'scope', 'reserved'])
+
+
+class LocalBucketStore:
+    """Buckets in a dict for this process only; `take` and `give` are a few float ops under a lock."""
+
+    blocking = False
+
+    def __init__(self):
+        self.buckets = {}  # key -> [tokens, updated (monotonic)]
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, capacity, rate):
+        """Spends `cost` tokens and returns 0, or returns the seconds until they will be there."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= LOCAL_PRUNE_SIZE:
+                    self.prune(now, capacity, rate)
+                bucket = self.buckets[key] = [capacity, now]
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                return (cost - tokens) / rate
+            bucket[0] = tokens - cost
+            return 0
+
+    def give(self, key, amount, capacity):
+        """Returns `amount` tokens (takes them when negative, which can leave the bucket in debt)."""
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(capacity, bucket[0] + amount)
+
+    def prune(self, now, capacity, rate):
+        # A bucket that has refilled completely is the same as no bucket.
+        full = [key for key, (tokens, updated) in self.buckets.items() if tokens + (now - updated) * rate >= capacity]
+        for key in full:
+            del self.buckets[key]
+
+
+class DatabaseBucketStore:
+    """Buckets in RateLimitBucket rows, shared by every worker using the database."""
+
+    blocking = True
+
+    def take(self, key, cost, capacity, rate):
+        now = time.time()
+        capacity, cost = float(capacity), float(cost)
+        refilled = Least(Value(capacity), F('tokens') + (Value(now) - F('updated')) * Value(rate))
+        taken = (RateLimitBucket.objects.filter(key=key).alias(refilled=refilled).filter(refilled__gte=cost)
+                 .update(tokens=refilled - Value(cost), updated=Greatest(F('updated'), Value(now))))
+        if taken:
+            return 0
+        row = RateLimitBucket.objects.filter(key=key).values_list('tokens', 'updated').first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    RateLimitBucket.objects.create(key=key, tokens=capacity - cost, updated=now)
+                return 0
+            except IntegrityError:
+                return self.take(key, cost, capacity, rate)  # Another worker created it first
+        tokens, updated = row
+        tokens = min(capacity, tokens + max(0, now - updated) * rate)
+        return max((cost - tokens) / rate, 0.001)
+
+    def give(self, key, amount, capacity):
+        RateLimitBucket.objects.filter(key=key).update(
+            tokens=Least(Value(float(capacity)), F('tokens') + Value(float(amount)))
+        )
+
+
+class RateLimiter:
+    def __init__(self, store, user_per_minute, global_per_minute):
+        self.store = store
+        self.user_capacity = user_per_minute
+        self.global_capacity = global_per_minute
+
+    def admit(self, user_id, cost):
+        """
+        Reserves `cost` tokens from the user's bucket and the global one, or
+        neither. The decision carries what was reserved, for settle().
+        """
+        user_key = f'user:{user_id}'
+        # A turn bigger than a whole bucket could never get in; it costs a full one instead, the same in both.
+        reserved = min(cost, self.user_capacity, self.global_capacity)
+        wait = self.store.take(user_key, reserved, self.user_capacity, self.user_capacity / 60)
+        if wait:
+            return Decision(False, wait, 'user', 0)
+        wait = self.store.take(GLOBAL_KEY, reserved, self.global_capacity, self.global_capacity / 60)
+        if wait:
+            self.store.give(user_key, reserved, self.user_capacity)
+            return Decision(False, wait, 'global', 0)
+        return Decision(True, 0, None, reserved)
+
+    def settle(self, user_id, reserved, used):
+        """Refunds the unused part of a reservation, or charges the overrun."""
+        difference = reserved - used
+        if difference:
+            self.store.give(f'user:{user_id}', difference, self.user_capacity)
+            self.store.give(GLOBAL_KEY, difference, self.global_capacity)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide RateLimiter, or None when RATE_LIMIT_ENABLED is off."""
+    global _rate_limiter
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                store = DatabaseBucketStore() if settings.RATE_LIMIT_STORE == 'database' else LocalBucketStore()
+                _rate_limiter = RateLimiter(store, settings.RATE_LIMIT_USER_TOKENS_PER_MINUTE,
+                                            settings.RATE_LIMIT_GLOBAL_TOKENS_PER_MINUTE)
+    return _rate_limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(setting, **kwargs):
+    global _rate_limiter
+    if setting.startswith('RATE_LIMIT_'):
+        _rate_limiter = None
+
+
+def estimate_cost(text, has_image=False):
+    """What a turn reserves up front: its prompt, its image and a reply of RATE_LIMIT_REPLY_TOKENS."""
+    return estimate_tokens(text or '') + (IMAGE_TOKENS if has_image else 0) + settings.RATE_LIMIT_REPLY_TOKENS
+
+
+def turn_tokens(persona, content, history, reply):
+    """Estimated tokens a model call actually used: instruction, history, prompt parts and reply."""
+    used = estimate_tokens(persona.text) + estimate_tokens(reply)
+    for entry in history or ():
+        used += sum(estimate_tokens(part.get('text', '')) for part in entry['parts'])
+    for part in content or ():
+        used += estimate_tokens(part) if isinstance(part, str) else IMAGE_TOKENS
+    return used
+
+
+class ModelTokenThrottle(BaseThrottle):
+    """
+    Admits POSTs (chat turns) against the token buckets; other methods pass.
+    The reservation is left on `request.reserved_tokens` for `settle()`.
+    """
+
+    def allow_request(self, request, view):
+        self.decision = None
+        limiter = get_rate_limiter()
+        if request.method != 'POST' or limiter is None:
+            return True
+        cost = estimate_cost(request.data.get('text'), 'file_upload' in request.FILES)
+        self.decision = limiter.admit(request.user.pk, cost)
+        if self.decision.allowed:
+            request.reserved_tokens = self.decision.reserved
+        return self.decision.allowed
+
+    def wait(self):
+        return self.decision.retry_after if self.decision else None
+
+
+def settle(request, used=0):
+    """Settles the request's reservation against `used` tokens (0 refunds it). Safe to call more than once."""
+    reserved = getattr(request, 'reserved_tokens', None)
+    limiter = get_rate_limiter()
+    if reserved is None or limiter is None:
+        return
+    request.reserved_tokens = None
+    limiter.settle(request.user.pk, reserved, used)
+
+
+async def asettle(request, used=0):
+    limiter = get_rate_limiter()
+    if limiter is not None and limiter.store.blocking:
+        await sync_to_async(settle)(request, used)
+    else:
+        settle(request, used)
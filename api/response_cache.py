@@ -0,0 +1,130 @@
+"""
+Optional cache of model replies for repeated prompts. Keys cover the model,
+the persona version, the normalized prompt and a hash of the context window,
+so a reply is only reused for an identical conversation state.
+"""
+import hashlib
+import json
+import threading
+from collections import Counter
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+KEY_PREFIX = 'rgpt:reply:'
+
+
+def normalize_prompt(text):
+    """Casefold and collapse whitespace; punctuation is kept since it matters for code."""
+    return ' '.join(text.casefold().split())
+
+
+def cache_key(model_name, persona_version, prompt, history):
+    history_hash = hashlib.sha256(
+        json.dumps(history or [], sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    raw = '\x1f'.join([model_name or '', persona_version, normalize_prompt(prompt), history_hash])
+    return KEY_PREFIX + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LocalResponseStore:
+    """In-process LRU with per-entry TTL (cachetools)."""
+
+    def __init__(self, max_entries, ttl):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    def entry_count(self):
+        with self._lock:
+            return len(self._cache)
+
+
+class SharedResponseStore:
+    """
+    A Django cache alias (database or file based) shared by every worker.
+    The size cap is that cache's own MAX_ENTRIES option.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def entry_count(self):
+        return None  # Unknown without scanning the shared store
+
+
+class ResponseCache:
+    def __init__(self, store):
+        self.store = store
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        value = self.store.get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, text):
+        if text:
+            self.store.set(key, text)
+            self._count('stores')
+
+    def skip(self):
+        self._count('skipped')
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = stats.get('hits', 0) / lookups if lookups else 0.0
+        stats['entries'] = self.store.entry_count()
+        stats['store'] = settings.RESPONSE_CACHE_STORE
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide ResponseCache, or None when RESPONSE_CACHE_ENABLED is off."""
+    global _response_cache
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                if settings.RESPONSE_CACHE_STORE == 'shared':
+                    store = SharedResponseStore(settings.RESPONSE_CACHE_ALIAS, settings.RESPONSE_CACHE_TTL)
+                else:
+                    store = LocalResponseStore(settings.RESPONSE_CACHE_MAX_ENTRIES, settings.RESPONSE_CACHE_TTL)
+                _response_cache = ResponseCache(store)
+    return _response_cache
+
+
+@receiver(setting_changed)
+def reset_response_cache(setting, **kwargs):
+    global _response_cache
+    if setting.startswith('RESPONSE_CACHE_'):
+        _response_cache = None
@@ -0,0 +1,133 @@
+"""
+Full-text search over one user's messages, on the index created by migration
+0014: FTS5 (bm25 ranking, snippet()) on SQLite and a GIN (session_id,
+tsvector) index (ts_rank, ts_headline) on PostgreSQL, looked up chat by
+chat. Other databases fall back to a plain substring scan. Each backend
+returns the same rows, best match first.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection
+
+from .models import ChatSession, Message
+
+# Must match the configuration in the index expression of migration 0014.
+POSTGRES_SEARCH_CONFIG = 'simple'
+MAX_TERMS = 10
+MIN_PREFIX = 3
+SNIPPET_WORDS = 16
+HIGHLIGHT = ('[', ']')
+
+SearchHit = namedtuple('SearchHit', ['message_id', 'session_id', 'is_from_user', 'timestamp', 'snippet', 'rank'])
+
+
+def query_terms(q):
+    """Words of the user's query, stripped of anything FTS syntax would interpret."""
+    return re.findall(r'\w+', q.casefold())[:MAX_TERMS]
+
+
+def prefix_last(terms):
+    # Search-as-you-type: the last word also matches as a prefix, unless it is too short to be selective.
+    return len(terms[-1]) >= MIN_PREFIX
+
+
+def fts5_query(user_id, terms):
+    # Every word must match. The owner token keeps the lookup to this user's postings.
+    words = [f'"{term}"' for term in terms]
+    if prefix_last(terms):
+        words[-1] += '*'
+    return f'owner : u{user_id} AND text : ({" ".join(words)})'
+
+
+def search_sqlite(user_id, terms, limit):
+    sql = f"""
+        SELECT m.id, m.session_id, m.is_from_user, m.timestamp,
+               snippet(api_message_fts, 0, %s, %s, '…', {SNIPPET_WORDS}), bm25(api_message_fts) AS rank
+        FROM api_message_fts
+        JOIN api_message m ON m.id = api_message_fts.rowid
+        JOIN api_chatsession s ON s.id = m.session_id
+        WHERE api_message_fts MATCH %s AND NOT s.is_deleted
+        ORDER BY rank
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*HIGHLIGHT, fts5_query(user_id, terms), limit])
+        rows = cursor.fetchall()
+    # bm25 is lower-is-better; flip it so every backend ranks higher-is-better.
+    return [
+        SearchHit(pk, session_id, bool(is_from_user),
+                  connection.ops.convert_datetimefield_value(timestamp, None, connection), snippet, -rank)
+        for pk, session_id, is_from_user, timestamp, snippet, rank in rows
+    ]
+
+
+def search_postgres(user_id, terms, limit):
+    document = f"to_tsvector('{POSTGRES_SEARCH_CONFIG}'::regconfig, m.text)"
+    words = list(terms)
+    if prefix_last(terms):
+        words[-1] += ':*'
+    tsquery = ' & '.join(words)
+    options = f'StartSel={HIGHLIGHT[0]}, StopSel={HIGHLIGHT[1]}, MaxWords={SNIPPET_WORDS}, MinWords=5'
+    # Walk the user's live chats first and look the term up within each one (the GIN index of
+    # migration 0014 leads with session_id), so a common word costs this user's matches, not everyone's.
+    # The LIMIT keeps the lateral subquery from being flattened into a join on the whole index.
+    sql = f"""
+        SELECT m.id, m.session_id, m.is_from_user, m.timestamp,
+               ts_headline('{POSTGRES_SEARCH_CONFIG}'::regconfig, m.text, q, %s), m.rank
+        FROM api_chatsession s
+        CROSS JOIN to_tsquery('{POSTGRES_SEARCH_CONFIG}'::regconfig, %s) q
+        CROSS JOIN LATERAL (
+            SELECT m.id, m.session_id, m.is_from_user, m.timestamp, m.text, ts_rank({document}, q) AS rank
+            FROM api_message m
+            WHERE m.session_id = s.id AND {document} @@ q AND NOT m.in_progress
+            ORDER BY rank DESC
+            LIMIT %s
+        ) m
+        WHERE s.user_id = %s AND NOT s.is_deleted
+        ORDER BY m.rank DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [options, tsquery, limit, user_id, limit])
+        return [SearchHit(*row) for row in cursor.fetchall()]
+
+
+def search_fallback(user_id, terms, limit):
+    messages = Message.objects.filter(session__user_id=user_id, session__is_deleted=False, in_progress=False)
+    for term in terms:
+        messages = messages.filter(text__icontains=term)
+    hits = []
+    for message in messages.order_by('-timestamp', '-id')[:limit]:
+        start = max(0, message.text.casefold().find(terms[0]) - 40)
+        hits.append(SearchHit(message.id, message.session_id, message.is_from_user, message.timestamp,
+                              message.text[start:start + 120], 0.0))
+    return hits
+
+
+BACKENDS = {'sqlite': search_sqlite, 'postgresql': search_postgres}
+
+
+def search(user, q, limit=20):
+    """
+    Ranked message hits for `q` in `user`'s live chats, and the sessions they
+    belong to (best hit first), as plain dicts ready for the response.
+    """
+    terms = query_terms(q)
+    if not terms:
+        return {'messages': [], 'sessions': []}
+    hits = BACKENDS.get(connection.vendor, search_fallback)(user.id, terms, limit)
+
+    titles = dict(ChatSession.objects.filter(id__in={hit.session_id for hit in hits}).values_list('id', 'title'))
+    sessions = {}
+    for hit in hits:
+        session = sessions.setdefault(hit.session_id, {
+            'id': hit.session_id, 'title': titles.get(hit.session_id, ''), 'hits': 0,
+            'rank': hit.rank, 'snippet': hit.snippet, 'message_id': hit.message_id,
+        })
+        session['hits'] += 1
+    messages = [
+        {**hit._asdict(), 'session_title': titles.get(hit.session_id, '')}
+        for hit in hits
+    ]
+    return {'messages': messages, 'sessions': list(sessions.values())}
@@ -1,20 +1,21 @@
 from rest_framework import serializers
-from .models import User, ChatSession, Message
+from .models import User, ChatSession, Message, GenerationJob
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
             'id', 'username', 'first_name', 'last_name', 'email', 
-            'profile_picture_url' # <-- ADD THIS LINE
+            'profile_picture_url', # <-- ADD THIS LINE
+            'response_cache_opt_out',
         ]
 
 class MessageSerializer(serializers.ModelSerializer):
     """Serializer for individual messages."""
     class Meta:
         model = Message
-        fields = ['id', 'text', 'is_from_user', 'timestamp', 'file_upload']
-        read_only_fields = ['is_from_user', 'timestamp', 'id']
+        fields = ['id', 'text', 'is_from_user', 'timestamp', 'file_upload', 'in_progress']
+        read_only_fields = ['is_from_user', 'timestamp', 'id', 'in_progress']
 
 class ChatSessionListSerializer(serializers.ModelSerializer):
     """Serializer for listing chat sessions."""
@@ -22,7 +23,17 @@ class ChatSessionListSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ChatSession
-        fields = ['id', 'user', 'title', 'created_at', 'updated_at','pinned']
+        fields = ['id', 'user', 'title', 'created_at', 'updated_at','pinned',
+                  'message_count', 'last_message_at', 'last_message_preview']
+        read_only_fields = ['message_count', 'last_message_at', 'last_message_preview']
+
+class ChatSessionSidebarSerializer(serializers.ModelSerializer):
+    """Sidebar rows for the paginated chat list; the user is sent once per page instead."""
+    class Meta:
+        model = ChatSession
+        fields = ['id', 'title', 'created_at', 'updated_at', 'pinned',
+                  'message_count', 'last_message_at', 'last_message_preview']
+        read_only_fields = ['message_count', 'last_message_at', 'last_message_preview']
 
 class ChatSessionDetailSerializer(serializers.ModelSerializer):
     """Serializer for a single chat session with all its messages."""
@@ -31,4 +42,13 @@ class ChatSessionDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ChatSession
-        fields = ['id', 'user', 'title', 'messages', 'created_at', 'updated_at','pinned']
\ No newline at end of file
+        fields = ['id', 'user', 'title', 'messages', 'created_at', 'updated_at','pinned']
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    """A job-mode chat turn; `bot_message` is set once it is done."""
+    bot_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'status', 'error', 'session', 'user_message', 'bot_message', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -0,0 +1,162 @@
+"""
+Content-addressed storage for message attachments. Each distinct file is
+written once as `<upload_to>/<aa>/<sha256><ext>` no matter how often it is
+sent, and artifacts derived from it (model inputs, thumbnails) are cached
+per digest under `user_uploads/derived/<aa>/<sha256>/`. Which blobs are still
+in use is tracked by api.models.UploadBlob; `manage.py gc_uploads` removes
+the rest.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+
+DIGEST_RE = re.compile(r'^([0-9a-f]{64})(?:\.[\w]{1,10})?$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(content):
+    """sha256 hex digest of a Django File / UploadedFile, leaving it rewound."""
+    if getattr(content, 'sha256', None):
+        return content.sha256
+    digest = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    content.sha256 = digest.hexdigest()
+    return content.sha256
+
+
+def digest_of(name):
+    """The digest a stored name was saved under, or None for files saved before dedup."""
+    match = DIGEST_RE.match(posixpath.basename(name or ''))
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files after their sha256. Content is hashed
+    while it streams to a temp file, which is then renamed into place, or
+    dropped if that digest is already stored. Names saved by the plain
+    storage (e.g. `user_uploads/Picture1.jpg`) are still served as before.
+    """
+
+    def __init__(self, *args, derived_root='user_uploads/derived', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.derived_root = derived_root
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save; identical content should collide.
+        return name
+
+    def blob_name(self, name, digest):
+        directory = posixpath.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        if not re.fullmatch(r'\.\w{1,10}', ext):
+            ext = ''
+        return posixpath.join(directory, digest[:2], digest + ext)
+
+    def _save(self, name, content):
+        digest = getattr(content, 'sha256', None)
+        if digest and self.exists(self.blob_name(name, digest)):
+            return self.touch(self.blob_name(name, digest))
+
+        directory = self.path(posixpath.dirname(name))
+        os.makedirs(directory, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    fh.write(chunk)
+            final = self.blob_name(name, hasher.hexdigest())
+            if self.exists(final):
+                os.remove(tmp_path)
+                return self.touch(final)
+            os.makedirs(os.path.dirname(self.path(final)), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, self.path(final))
+            return final
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def touch(self, name):
+        """Marks a blob as just used, so gc_uploads' grace period covers saves in flight."""
+        os.utime(self.path(name))
+        return name
+
+    # --- Derived artifacts ---
+
+    def derived_dir(self, digest):
+        return posixpath.join(self.derived_root, digest[:2], digest)
+
+    def get_derived(self, digest, key):
+        """Bytes of artifact `key` for the content with this digest, or None."""
+        try:
+            with open(self.path(posixpath.join(self.derived_dir(digest), key)), 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def save_derived(self, digest, key, data):
+        path = self.path(posixpath.join(self.derived_dir(digest), key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.derived-')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def touched_within(self, name, seconds):
+        try:
+            return time.time() - os.stat(self.path(name)).st_mtime < seconds
+        except FileNotFoundError:
+            return False
+
+    def delete_derived(self, digest):
+        shutil.rmtree(self.path(self.derived_dir(digest)), ignore_errors=True)
+
+    def delete_blob(self, name):
+        """Deletes a blob and its derived artifacts; returns the bytes freed."""
+        try:
+            size = self.size(name)
+        except FileNotFoundError:
+            size = 0
+        self.delete(name)
+        self.delete_derived(digest_of(name))
+        return size
+
+    def list_blobs(self, directory):
+        """Names of every content-addressed blob under `directory`."""
+        if not self.exists(directory):
+            return
+        for shard in self.listdir(directory)[0]:
+            if len(shard) != 2:
+                continue
+            for filename in self.listdir(posixpath.join(directory, shard))[1]:
+                if digest_of(filename):
+                    yield posixpath.join(directory, shard, filename)
+
+    def list_derived(self):
+        """Digests that have a derived-artifact directory."""
+        if not self.exists(self.derived_root):
+            return
+        for shard in self.listdir(self.derived_root)[0]:
+            for digest in self.listdir(posixpath.join(self.derived_root, shard))[0]:
+                yield digest
+
+
+upload_storage = ContentAddressedStorage()
+
+
+def get_upload_storage():
+    """Storage for Message.file_upload (a callable so migrations don't freeze the instance)."""
+    return upload_storage
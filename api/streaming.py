@@ -0,0 +1,66 @@
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+SSE_CONTENT_TYPE = 'text/event-stream'
+
+
+def wants_stream(request):
+    """True when the client asked for SSE via `?stream=1` or `Accept: text/event-stream`."""
+    if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return SSE_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+
+def sse_event(data, event=None):
+    """Encode one Server-Sent Event frame."""
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+    lines.append(f'data: {payload}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def replay_chunks(text):
+    """Splits a finished reply into word-sized chunks so it can be replayed as a stream."""
+    return re.findall(r'\S+\s*', text) or [text]
+
+
+async def iterate_in_thread(iterator, batch_size=500):
+    """
+    Serves a blocking iterator of str (e.g. one reading a DB cursor) as an
+    async one for StreamingHttpResponse under ASGI, which would otherwise
+    read a sync iterator to the end into memory first. Pulls `batch_size`
+    items per hop to the worker thread and yields them as one bytes chunk.
+    """
+    def take():
+        return ''.join(part for _, part in zip(range(batch_size), iterator))
+
+    try:
+        while chunk := await sync_to_async(take)():
+            yield chunk.encode('utf-8')
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept `text/event-stream`. Regular Response
+    objects (validation errors, 404s) are sent as a single SSE frame.
+    """
+    media_type = SSE_CONTENT_TYPE
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        response = (renderer_context or {}).get('response')
+        event = 'error' if response is not None and response.status_code >= 400 else 'message'
+        return sse_event(data, event)
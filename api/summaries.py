@@ -0,0 +1,212 @@
+"""
+Rolling summaries of the older part of each chat, written off the request
+path.
+
+When a turn leaves messages behind the recent window (api.context), the chat
+is offered to the summarizer: a non-blocking put on a bounded queue
+(SUMMARY_QUEUE_SIZE), so the chat path never waits on it; a dropped offer is
+made again by the chat's next turn. A background thread, started by the
+first offer, takes up to SUMMARY_BATCH_SIZE chats at a time (waiting up to
+SUMMARY_BATCH_WAIT seconds to fill a batch) and folds each chat's messages
+that left the window, at most SUMMARY_MAX_MESSAGES per call, into its stored
+summary on SUMMARY_BACKEND. The calls of a batch run together, one per chat,
+so the model never sees two conversations at once. A summary is only written
+if nobody moved it forward in the meantime, and a chat with messages left
+over is queued again.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from . import llm
+from .models import ChatSession
+from .persona import make_persona
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MESSAGE_CHARS = 2000
+SUMMARY_INSTRUCTION = (
+    "You keep a running summary of a conversation between a user and RGPT, an AI assistant. You are given "
+    "the summary so far and the messages that followed it. Reply with the updated summary only, in the "
+    "language of the conversation. Keep every fact, name, number, preference and decision the user gave, "
+    "and what RGPT answered, concluded or promised; drop greetings and repetition. At most {words} words."
+)
+
+
+def summary_persona():
+    # About three words to four tokens.
+    return make_persona(SUMMARY_INSTRUCTION.format(words=settings.CONTEXT_SUMMARY_TOKENS * 3 // 4))
+
+
+def message_line(message):
+    text = ' '.join(message.text.split())[:SUMMARY_MESSAGE_CHARS] or '(an image)'
+    return f"{'User' if message.is_from_user else 'RGPT'}: {text}"
+
+
+def clip(summary):
+    """The summary cut to about CONTEXT_SUMMARY_TOKENS tokens, at a word boundary."""
+    summary = summary.strip()
+    max_chars = settings.CONTEXT_SUMMARY_TOKENS * 4
+    if len(summary) > max_chars:
+        summary = summary[:max_chars - 1].rsplit(' ', 1)[0] + '…'
+    return summary
+
+
+def pending_messages(session, until_id):
+    """
+    Up to SUMMARY_MAX_MESSAGES messages older than `until_id` that are not in
+    the summary yet, oldest first, and whether more are left after them.
+    """
+    messages = session.messages.filter(id__lt=until_id).only('id', 'text', 'is_from_user').order_by('id')
+    if session.summarized_until_id is not None:
+        messages = messages.filter(id__gt=session.summarized_until_id)
+    messages = list(messages[:settings.SUMMARY_MAX_MESSAGES + 1])
+    return messages[:settings.SUMMARY_MAX_MESSAGES], len(messages) > settings.SUMMARY_MAX_MESSAGES
+
+
+def summary_prompt(summary, messages):
+    lines = '\n'.join(message_line(message) for message in messages)
+    return f"Summary so far:\n{summary or '(nothing yet)'}\n\nMessages that followed:\n{lines}"
+
+
+async def generate_summaries(backend, persona, prompts):
+    async def generate(prompt):
+        # Same concurrency cap as chat turns; the 'summaries' lane takes turns with users in the fair queue.
+        async with llm.model_limiter.slot('summaries'):
+            return await backend.generate(persona, [prompt])
+
+    return await asyncio.gather(*(generate(prompt) for prompt in prompts), return_exceptions=True)
+
+
+def summarize_sessions(offers, backend=None):
+    """
+    Folds the older messages of these chats ({session id: id of the first
+    message still in the recent window}) into their summaries, one model call
+    per chat on `backend` (default: SUMMARY_BACKEND). Returns {session id:
+    window start} for the chats that still have messages to fold.
+    """
+    backend = backend or llm.get_backend(settings.SUMMARY_BACKEND)
+    work = []
+    for session in ChatSession.objects.filter(pk__in=list(offers)).only('id', 'context_summary',
+                                                                         'summarized_until_id'):
+        messages, more = pending_messages(session, offers[session.pk])
+        if messages:
+            work.append((session, messages, more))
+    if not work:
+        return {}
+
+    prompts = [summary_prompt(session.context_summary, messages) for session, messages, _ in work]
+    replies = async_to_sync(generate_summaries)(backend, summary_persona(), prompts)
+    unfinished = {}
+    for (session, messages, more), reply in zip(work, replies):
+        if isinstance(reply, Exception):
+            logger.error("Summarizing chat %s failed", session.pk, exc_info=reply)
+            continue
+        summary = clip(reply)
+        if not summary:
+            continue
+        # Only if no other process moved the summary forward in the meantime.
+        written = ChatSession.objects.filter(pk=session.pk, summarized_until_id=session.summarized_until_id).update(
+            context_summary=summary, summarized_until_id=messages[-1].id
+        )
+        if written and more:
+            unfinished[session.pk] = offers[session.pk]
+    return unfinished
+
+
+class SessionSummarizer(threading.Thread):
+    def __init__(self, batch_size, batch_wait, queue_size):
+        super().__init__(name='rgpt-summarizer', daemon=True)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}  # Queued session id -> the newest window start offered for it, so a chat is queued once
+        self._lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def offer(self, session_id, until_id):
+        """Queues a chat for summarizing without blocking. Returns False if it was dropped."""
+        with self._lock:
+            if session_id in self.pending:
+                self.pending[session_id] = max(self.pending[session_id], until_id)
+                return True
+            try:
+                self.queue.put_nowait(session_id)
+            except queue.Full:
+                return False
+            self.pending[session_id] = until_id
+        return True
+
+    def take_batch(self, timeout):
+        """{id: window start} for up to batch_size chats: waits `timeout` for the first, then batch_wait to fill up."""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return {}
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            return {session_id: self.pending.pop(session_id) for session_id in batch}
+
+    def run(self):
+        while not self.stopped.is_set():
+            batch = self.take_batch(timeout=1.0)
+            if not batch:
+                continue
+            try:
+                unfinished = summarize_sessions(batch)
+            except Exception:
+                logger.exception("Summarizing %d chats failed", len(batch))
+            else:
+                for session_id, until_id in unfinished.items():
+                    self.offer(session_id, until_id)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer():
+    """The process-wide SessionSummarizer (started on first use), or None when SUMMARY_ENABLED is off."""
+    global _summarizer
+    if not settings.SUMMARY_ENABLED:
+        return None
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                _summarizer = SessionSummarizer(settings.SUMMARY_BATCH_SIZE, settings.SUMMARY_BATCH_WAIT,
+                                                settings.SUMMARY_QUEUE_SIZE)
+                _summarizer.start()
+    return _summarizer
+
+
+def offer(session_id, until_id):
+    summarizer = get_summarizer()
+    if summarizer is not None:
+        summarizer.offer(session_id, until_id)
+
+
+@receiver(setting_changed)
+def reset_summarizer(setting, **kwargs):
+    global _summarizer
+    if setting.startswith('SUMMARY_') and _summarizer is not None:
+        _summarizer.stop()
+        _summarizer = None
@@ -1,3 +1,1652 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import rsa
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import ExifTags, Image
+from rest_framework.authtoken.models import Token
+
+from . import idempotency, jobs, llm, metrics, titles
+from .authentication import CachedTokenAuthentication
+from .bench import make_google_id_token, percentile, serve_google_certs
+from .context import SUMMARY_HEADER, TRANSCRIPT_HEADER, UNSUMMARIZED_HEADER, build_history
+from .export import NDJSON_CONTENT_TYPE, ExportFormatError, import_lines
+from .google_auth import GoogleCertCache, verify_google_id_token
+from .images import preprocess_image, preprocess_upload, strip_metadata
+from .llm import ConcurrencyLimiter, FakeBackend, GeminiBackend
+from .intents import CREATOR_REPLY, GREETING_REPLY, match_intent
+from .persona import DEFAULT_PERSONA, get_persona, make_persona
+from .models import (
+    DEFAULT_TITLE, ChatSession, GenerationJob, Message, MessageFeedback, UploadBlob, User, message_preview,
+)
+from .checkpoints import ReplyCheckpointer
+from .management.commands import bench_api
+from .purge import purge_deleted_sessions
+from .ratelimit import (
+    DatabaseBucketStore, LocalBucketStore, ModelTokenThrottle, RateLimiter, get_rate_limiter, settle,
+)
+from .search import search
+from .summaries import SessionSummarizer, summarize_sessions
+from .storage import get_upload_storage
+from .titles import SessionTitler, heuristic_title, title_sessions
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='rgpt-test-media-')
+
+# Offline model, and no background threads that would outlive a test's database.
+TEST_SETTINGS = dict(
+    LLM_BACKEND='fake', MEDIA_ROOT=MEDIA_ROOT, TITLE_ENABLED=False, SUMMARY_ENABLED=False, JOB_RECOVERY_INTERVAL=0,
+    PURGE_INTERVAL=0,
+)
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def signed_in(username='alice'):
+    """A user and a test client authenticated as them with a DRF token."""
+    user = User.objects.create(username=username, email=f'{username}@example.com')
+    token = Token.objects.create(user=user)
+    return user, Client(headers={'Authorization': f'Token {token.key}'})
+
+
+def read_body(response):
+    """The whole body of an async streaming response."""
+    async def collect():
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(collect)()
+
+
+def read_events(response):
+    """[(event, data)] of an SSE response, read to the end."""
+    events = []
+    for frame in read_body(response).decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.split('\n'))
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+class BrokenBackend(FakeBackend):
+    """Fails after its first chunk, like a model connection that drops."""
+
+    async def stream(self, persona, content, history=None):
+        yield 'Half '
+        raise RuntimeError('model went away')
+
+    async def generate(self, persona, content, history=None):
+        raise RuntimeError('model went away')
+
+
+BROKEN_MODEL = dict(LLM_BACKEND='broken', LLM_BACKENDS={'broken': {'CLASS': 'api.tests.BrokenBackend'}})
+
+
+# --- Chat turns over SSE ---
+
+@override_settings(**TEST_SETTINGS)
+class StreamingTurnTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        self.url = f'/api/chats/{self.chat.id}/messages/'
+
+    def test_stream_sends_user_message_tokens_and_bot_message(self):
+        response = self.client.post(self.url + '?stream=1', {'text': 'explain heaps'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = read_events(response)
+        names = [name for name, _ in events]
+        self.assertEqual(names[:2], ['user_message', 'bot_message_started'])
+        self.assertEqual(names[-1], 'bot_message')
+        self.assertEqual(set(names[2:-1]), {'token'})
+        reply = events[-1][1]
+        self.assertEqual(reply['text'], ''.join(data['text'] for name, data in events if name == 'token'))
+        self.assertEqual(reply['text'], 'RGPT fake reply to: explain heaps')
+        self.assertFalse(Message.objects.get(pk=reply['id']).in_progress)
+
+    def test_accept_header_asks_for_a_stream(self):
+        response = self.client.post(self.url, {'text': 'explain heaps'}, headers={'Accept': 'text/event-stream'})
+        self.assertEqual(read_events(response)[-1][0], 'bot_message')
+
+    def test_without_stream_both_messages_come_back_as_json(self):
+        response = self.client.post(self.url, {'text': 'explain heaps'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user_message']['text'], 'explain heaps')
+        self.assertEqual(response.json()['bot_message']['text'], 'RGPT fake reply to: explain heaps')
+
+    def test_errors_before_the_stream_are_one_error_frame(self):
+        response = self.client.post(self.url, {'text': ''}, headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+
+    @override_settings(**BROKEN_MODEL)
+    def test_model_failure_mid_stream_ends_with_an_error_and_keeps_the_partial_reply(self):
+        events = read_events(self.client.post(self.url + '?stream=1', {'text': 'explain heaps'}))
+        self.assertEqual(events[-1][0], 'error')
+        reply = Message.objects.get(is_from_user=False)
+        self.assertEqual((reply.text, reply.in_progress, reply.metadata), ('Half ', False, {'interrupted': True}))
+
+
+# --- Model-call limiter ---
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def run_calls(self, limiter, keys, hold=0.01):
+        """Runs one call per key through `limiter`; returns the peak in flight and the order calls got a slot."""
+        peak, order = 0, []
+
+        async def call(key):
+            nonlocal peak
+            async with limiter.slot(key):
+                order.append(key)
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(hold)
+
+        async def main():
+            await asyncio.gather(*(call(key) for key in keys))
+
+        asyncio.run(main())
+        return peak, order
+
+    def test_never_more_calls_in_flight_than_the_limit(self):
+        limiter = ConcurrencyLimiter(2)
+        peak, order = self.run_calls(limiter, [None] * 10)
+        self.assertEqual((peak, len(order)), (2, 10))
+        self.assertEqual((limiter.in_flight, limiter.waiting), (0, 0))
+
+    def test_the_limit_holds_across_event_loops(self):
+        # Under WSGI every request runs the async view on its own loop (async_to_sync).
+        limiter = ConcurrencyLimiter(3)
+        peaks = []
+        threads = [threading.Thread(target=lambda: peaks.append(self.run_calls(limiter, [None] * 4)[0]))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peaks), 4)
+        self.assertLessEqual(max(peaks), 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_a_cancelled_waiter_gives_up_its_place(self):
+        limiter = ConcurrencyLimiter(1)
+
+        async def main():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.waiting, 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            limiter.release()
+
+        asyncio.run(main())
+        self.assertEqual((limiter.in_flight, limiter.waiting), (0, 0))
+
+    def test_waiting_users_take_turns(self):
+        # One slot: the first call gets it, then the queued ones go one per user in arrival order.
+        _, order = self.run_calls(ConcurrencyLimiter(1), ['a', 'a', 'a', 'a', 'b', 'b', 'c'])
+        self.assertEqual(order, ['a', 'a', 'b', 'c', 'a', 'b', 'a'])
+
+    def test_a_user_arriving_late_is_served_before_the_busy_users_backlog(self):
+        limiter = ConcurrencyLimiter(1)
+        order = []
+
+        async def call(key):
+            async with limiter.slot(key):
+                order.append(key)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            noisy = [asyncio.ensure_future(call('noisy')) for _ in range(5)]
+            await asyncio.sleep(0.015)  # The first noisy call holds the slot, four wait
+            await asyncio.gather(call('light'), *noisy)
+
+        asyncio.run(main())
+        self.assertLessEqual(order.index('light'), 3)
+
+
+# --- Model backends ---
+
+class BackendTests(SimpleTestCase):
+    @override_settings(LLM_BACKEND='fake')
+    def test_backend_comes_from_settings_and_is_built_once(self):
+        backend = llm.get_backend()
+        self.assertIsInstance(backend, FakeBackend)
+        self.assertIs(llm.get_backend('fake'), backend)
+
+    def test_changing_the_settings_builds_a_new_backend(self):
+        with override_settings(LLM_BACKENDS={'x': {'CLASS': 'api.llm.FakeBackend', 'OPTIONS': {'repeat': 2}}}):
+            self.assertEqual(llm.get_backend('x').repeat, 2)
+        with override_settings(LLM_BACKENDS={'x': {'CLASS': 'api.llm.FakeBackend', 'OPTIONS': {'repeat': 3}}}):
+            self.assertEqual(llm.get_backend('x').repeat, 3)
+
+    def test_fake_backend_streams_a_deterministic_reply_word_by_word(self):
+        backend = FakeBackend(repeat=2)
+
+        async def collect():
+            return [chunk async for chunk in backend.stream(None, ['hello', {'mime_type': 'image/jpeg'}])]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual(chunks[:4], ['RGPT ', 'fake ', 'reply ', 'to: '])
+        self.assertEqual(''.join(chunks), 'RGPT fake reply to: hello [image] RGPT fake reply to: hello [image]')
+        self.assertEqual(asyncio.run(backend.generate(None, ['hello'])),
+                         'RGPT fake reply to: hello RGPT fake reply to: hello')
+
+
+# --- Conversation context ---
+
+@override_settings(**TEST_SETTINGS, CONTEXT_RECENT_TURNS=1, CONTEXT_TOKEN_BUDGET=1000, CONTEXT_TRANSCRIPT_TOKENS=20)
+class ContextTests(TestCase):
+    def setUp(self):
+        self.chat = ChatSession.objects.create(user=User.objects.create(username='alice'))
+
+    def say(self, *texts):
+        for n, text in enumerate(texts):
+            Message.objects.create(session=self.chat, text=text, is_from_user=n % 2 == 0)
+
+    def texts(self, history):
+        return [entry['parts'][0]['text'] for entry in history]
+
+    def test_short_chats_are_sent_verbatim(self):
+        self.say('first question', 'first answer')
+        self.assertEqual(self.texts(build_history(self.chat)), ['first question', 'first answer'])
+
+    def test_older_messages_become_transcript_lines(self):
+        self.say('q1', 'a1', 'q2', 'a2')
+        history = self.texts(build_history(self.chat))
+        self.assertEqual(history[0], f'{TRANSCRIPT_HEADER}\nUser: q1\nRGPT: a1')
+        self.assertEqual(history[2:], ['q2', 'a2'])
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.context_transcript, 'User: q1\nRGPT: a1')
+
+    @override_settings(CONTEXT_TOKEN_BUDGET=2000, CONTEXT_TRANSCRIPT_TOKENS=1000)
+    def test_transcript_lines_are_cut_short(self):
+        self.say('x' * 500, 'short', 'q2', 'a2')
+        build_history(self.chat)
+        self.chat.refresh_from_db()
+        first = self.chat.context_transcript.splitlines()[0]
+        self.assertEqual(first, 'User: ' + 'x' * 239 + '…')
+
+    def test_the_oldest_lines_are_dropped_past_the_budget(self):
+        # Each line is 4 estimated tokens, so the 20-token budget keeps the newest five.
+        self.say(*[f'{speaker}{n} words' for n in range(1, 5) for speaker in 'qa'])
+        build_history(self.chat)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.context_transcript.splitlines(), [
+            'RGPT: a1 words', 'User: q2 words', 'RGPT: a2 words', 'User: q3 words', 'RGPT: a3 words',
+        ])
+        self.assertNotIn('q1 words', self.texts(build_history(self.chat))[0])
+
+    def test_the_transcript_is_only_extended_with_new_messages(self):
+        self.say('q1', 'a1', 'q2', 'a2')
+        build_history(self.chat)
+        ChatSession.objects.filter(pk=self.chat.pk).update(context_transcript='User: (kept as stored)')
+        self.chat.refresh_from_db()
+        self.say('q3', 'a3')
+        build_history(self.chat)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.context_transcript.splitlines(), ['User: (kept as stored)', 'User: q2', 'RGPT: a2'])
+
+
+class SummarizerBackend(FakeBackend):
+    """Summarizes by appending the new messages to the summary so far."""
+
+    async def generate(self, persona, content, history=None):
+        so_far, messages = content[0].removeprefix('Summary so far:\n').split('\n\nMessages that followed:\n')
+        lines = messages.splitlines()
+        return '; '.join(lines if so_far == '(nothing yet)' else [so_far, *lines])
+
+
+SUMMARY_MODEL = dict(SUMMARY_BACKEND='summarizer',
+                     LLM_BACKENDS={'summarizer': {'CLASS': 'api.tests.SummarizerBackend'}})
+
+
+@override_settings(**TEST_SETTINGS, **SUMMARY_MODEL, CONTEXT_RECENT_TURNS=1, CONTEXT_TOKEN_BUDGET=1000,
+                   CONTEXT_TRANSCRIPT_TOKENS=20)
+class SummaryTests(TestCase):
+    def setUp(self):
+        self.chat = ChatSession.objects.create(user=User.objects.create(username='alice'))
+
+    def say(self, *texts):
+        return [Message.objects.create(session=self.chat, text=text, is_from_user=n % 2 == 0)
+                for n, text in enumerate(texts)]
+
+    def older(self):
+        self.chat.refresh_from_db()
+        return build_history(self.chat)[0]['parts'][0]['text']
+
+    def test_messages_that_left_the_window_are_folded_into_the_summary(self):
+        q1, a1, q2, _ = self.say('q1', 'a1', 'q2', 'a2')
+        self.assertEqual(summarize_sessions({self.chat.id: q2.id}), {})
+        self.chat.refresh_from_db()
+        self.assertEqual((self.chat.context_summary, self.chat.summarized_until_id), ('User: q1; RGPT: a1', a1.id))
+        self.assertEqual(self.older(), f'{SUMMARY_HEADER}\nUser: q1; RGPT: a1')
+
+    @override_settings(SUMMARY_MAX_MESSAGES=4)
+    def test_an_early_fact_outlives_the_transcript(self):
+        filler = [f'{speaker}{n} words' for n in range(2, 8) for speaker in 'qa']
+        messages = self.say('my name is Ada', 'hello Ada', *filler)
+        build_history(self.chat)
+        self.assertNotIn('Ada', self.older())  # The transcript has dropped it
+
+        offers = {self.chat.id: messages[-2].id}
+        while offers:
+            offers = summarize_sessions(offers)
+        self.assertIn('User: my name is Ada', self.older())
+
+    def test_messages_not_summarized_yet_follow_the_summary_and_offer_the_chat(self):
+        q1, a1, q2, a2, q3, a3 = self.say('q1', 'a1', 'q2', 'a2', 'q3', 'a3')
+        summarize_sessions({self.chat.id: q2.id})
+        with mock.patch('api.summaries.offer') as offer:
+            older = self.older()
+        self.assertEqual(older, f'{SUMMARY_HEADER}\nUser: q1; RGPT: a1\n\n{UNSUMMARIZED_HEADER}\nUser: q2\nRGPT: a2')
+        offer.assert_called_once_with(self.chat.id, q3.id)
+
+    def test_a_model_error_leaves_the_transcript(self):
+        _, _, q2, _ = self.say('q1', 'a1', 'q2', 'a2')
+        with self.assertLogs('api.summaries', 'ERROR'):
+            summarize_sessions({self.chat.id: q2.id}, backend=BrokenBackend())
+        self.assertEqual(self.older(), f'{TRANSCRIPT_HEADER}\nUser: q1\nRGPT: a1')
+
+    def test_a_summary_moved_forward_meanwhile_is_not_overwritten(self):
+        _, a1, q2, _ = self.say('q1', 'a1', 'q2', 'a2')
+        chat = self.chat
+
+        class RacingBackend(SummarizerBackend):
+            async def generate(self, persona, content, history=None):
+                # Another process folds the same messages first.
+                await ChatSession.objects.filter(pk=chat.pk).aupdate(context_summary='Theirs',
+                                                                      summarized_until_id=a1.id)
+                return await super().generate(persona, content, history)
+
+        summarize_sessions({chat.id: q2.id}, backend=RacingBackend())
+        chat.refresh_from_db()
+        self.assertEqual(chat.context_summary, 'Theirs')
+
+    def test_offers_keep_the_newest_window_start_and_are_dropped_when_full(self):
+        summarizer = SessionSummarizer(batch_size=2, batch_wait=0, queue_size=2)  # Not started
+        self.assertTrue(summarizer.offer(1, 10))
+        self.assertTrue(summarizer.offer(1, 12))
+        self.assertTrue(summarizer.offer(2, 5))
+        self.assertFalse(summarizer.offer(3, 7))
+        self.assertEqual(summarizer.take_batch(timeout=0), {1: 12, 2: 5})
+        self.assertTrue(summarizer.offer(1, 14))  # Taken, so it can be queued again
+
+
+# --- Persona ---
+
+class PersonaTests(SimpleTestCase):
+    def test_built_in_persona_is_built_once(self):
+        with override_settings(PERSONA_FILE=None):
+            self.assertIs(get_persona(), DEFAULT_PERSONA)
+            self.assertIs(get_persona(), get_persona())
+
+    def test_an_edited_persona_file_is_picked_up_and_a_missing_one_keeps_the_last(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'persona.txt')
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write('You are terse.')
+            with override_settings(PERSONA_FILE=path, PERSONA_RELOAD_INTERVAL=0):
+                first = get_persona()
+                self.assertEqual(first.text, 'You are terse.')
+                with open(path, 'w', encoding='utf-8') as fh:
+                    fh.write('You are chatty.')
+                os.utime(path, (os.path.getmtime(path) + 5,) * 2)
+                second = get_persona()
+                self.assertEqual(second.text, 'You are chatty.')
+                self.assertNotEqual(second.version, first.version)
+                os.remove(path)
+                self.assertIs(get_persona(), second)
+
+    def test_gemini_model_objects_are_built_once_per_persona_version(self):
+        backend = GeminiBackend.__new__(GeminiBackend)  # Without configuring the SDK
+        backend.model_name, backend._models = 'gemini-test', {}
+        built = []
+        backend.genai = SimpleNamespace(GenerativeModel=lambda name, system_instruction: built.append(name) or object())
+        model = backend.get_model(DEFAULT_PERSONA)
+        self.assertIs(backend.get_model(DEFAULT_PERSONA), model)
+        backend.get_model(make_persona('Another persona'))
+        self.assertEqual(len(built), 2)
+        self.assertEqual(len(backend._models), 1)  # Older persona versions are dropped
+
+
+# --- Canned replies ---
+
+class IntentMatchTests(SimpleTestCase):
+    def test_variants_of_the_fixed_questions_match(self):
+        for text in ('Who made you?', 'tumko kisne banaya', 'RGPT ka owner kon h', 'WHO CREATED YOU bro 😅'):
+            with self.subTest(text=text):
+                self.assertEqual(match_intent(text).name, 'creator')
+        self.assertEqual(match_intent('Hiiii there!!').name, 'greeting')
+        self.assertEqual(match_intent("what's ravi's birthday").name, 'ravi_contact')
+
+    def test_greeting_only_on_the_first_message(self):
+        self.assertIsNone(match_intent('hello', is_first_message=lambda: False))
+
+    def test_anything_else_goes_to_the_model(self):
+        for text in ('hi, how do I reverse a list in C++?', 'who made the C++ language', ''):
+            with self.subTest(text=text):
+                self.assertIsNone(match_intent(text))
+
+
+@override_settings(**{**TEST_SETTINGS, **BROKEN_MODEL})
+class CannedReplyTurnTests(TestCase):
+    """The model is broken here, so any reply at all proves it was not called."""
+
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.url = f'/api/chats/{ChatSession.objects.create(user=self.user).id}/messages/'
+
+    def test_greeting_is_answered_locally(self):
+        response = self.client.post(self.url, {'text': 'hello'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['bot_message']['text'], GREETING_REPLY)
+        self.assertEqual(Message.objects.get(is_from_user=False).metadata, {'intent': 'greeting'})
+
+    def test_canned_reply_is_replayed_as_a_stream(self):
+        events = read_events(self.client.post(self.url + '?stream=1', {'text': 'who made you'}))
+        self.assertEqual(events[-1][0], 'bot_message')
+        self.assertEqual(''.join(data['text'] for name, data in events if name == 'token'), CREATOR_REPLY)
+
+    def test_a_later_greeting_goes_to_the_model(self):
+        self.client.post(self.url, {'text': 'hello'})
+        self.assertEqual(self.client.post(self.url, {'text': 'hello'}).status_code, 500)
+
+
+# --- Reply cache ---
+
+@override_settings(**TEST_SETTINGS, RESPONSE_CACHE_ENABLED=True, RESPONSE_CACHE_STORE='local')
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(RESPONSE_CACHE_TTL=60))  # A fresh cache for each test
+        self.user, self.client = signed_in()
+        self.client.post(self.new_chat(), {'text': 'What is a heap?'})  # Fills the cache with the fake model
+
+    def new_chat(self):
+        return f'/api/chats/{ChatSession.objects.create(user=self.user).id}/messages/'
+
+    def test_a_repeated_prompt_is_answered_from_the_cache(self):
+        with override_settings(**BROKEN_MODEL):  # Same model name, so the cached reply still applies
+            response = self.client.post(self.new_chat(), {'text': '  what is a HEAP?'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['bot_message']['text'], 'RGPT fake reply to: What is a heap?')
+        self.assertEqual(Message.objects.filter(metadata={'cached': True}).count(), 1)
+
+    def test_a_different_conversation_state_misses(self):
+        url = self.new_chat()
+        Message.objects.create(session=ChatSession.objects.latest('id'), text='earlier', is_from_user=True)
+        response = self.client.post(url, {'text': 'What is a heap?'})
+        self.assertNotIn('cached', Message.objects.get(pk=response.json()['bot_message']['id']).metadata or {})
+
+    def test_no_cache_requests_and_opted_out_users_skip_it(self):
+        with override_settings(**BROKEN_MODEL):
+            response = self.client.post(self.new_chat(), {'text': 'What is a heap?'},
+                                        headers={'Cache-Control': 'no-cache'})
+            self.assertEqual(response.status_code, 500)
+            self.user.response_cache_opt_out = True
+            self.user.save()
+            self.assertEqual(self.client.post(self.new_chat(), {'text': 'What is a heap?'}).status_code, 500)
+
+
+# --- Message history pagination ---
+
+@override_settings(**TEST_SETTINGS)
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        self.ids = [Message.objects.create(session=self.chat, text=f'm{n}', is_from_user=n % 2 == 0).id
+                    for n in range(7)]
+        self.url = f'/api/chats/{self.chat.id}/messages/'
+
+    def ids_of(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [message['id'] for message in response.json()['results']]
+
+    def test_latest_page_then_older_pages_cover_every_message_once(self):
+        page = self.client.get(self.url, {'limit': 3}).json()
+        seen = [message['id'] for message in page['results']]
+        self.assertEqual(seen, self.ids[-3:])
+        self.assertIsNone(page['newer'])
+        while page['older']:
+            page = self.client.get(self.url, {'limit': 3, 'before': page['older']}).json()
+            seen = [message['id'] for message in page['results']] + seen
+        self.assertEqual(seen, self.ids)
+
+    def test_newer_messages_after_a_cursor_or_message_id(self):
+        self.assertEqual(self.ids_of(self.client.get(self.url, {'since_id': self.ids[4]})), self.ids[5:])
+        page = self.client.get(self.url, {'since_id': self.ids[0], 'limit': 2}).json()
+        self.assertEqual(self.ids_of(self.client.get(self.url, {'after': page['newer'], 'limit': 2})), self.ids[3:5])
+
+    def test_bad_parameters_are_400s(self):
+        for params in ({'before': 'nonsense'}, {'since_id': 'x'}, {'since_id': 999999}, {'limit': 'ten'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_limit_is_capped(self):
+        Message.objects.bulk_create(Message(session=self.chat, text='x', is_from_user=True) for _ in range(250))
+        self.assertEqual(len(self.ids_of(self.client.get(self.url, {'limit': 1000}))), 200)
+
+    def test_other_users_chats_are_empty(self):
+        _, other = signed_in('bob')
+        self.assertEqual(self.ids_of(other.get(self.url)), [])
+
+    def test_session_detail_without_or_with_the_latest_messages(self):
+        detail = f'/api/chats/{self.chat.id}/'
+        self.assertNotIn('messages', self.client.get(detail, {'messages': 'none'}).json())
+        latest = self.client.get(detail, {'messages': 'latest', 'limit': 2}).json()['messages']
+        self.assertEqual([message['id'] for message in latest['results']], self.ids[-2:])
+        self.assertEqual(len(self.client.get(detail).json()['messages']), 7)
+
+
+# --- Sidebar pagination ---
+
+@override_settings(**TEST_SETTINGS)
+class SidebarPaginationTests(TestCase):
+    """10k chats for one user: every keyset page costs the same few queries, however deep."""
+    SESSIONS = 10000
+    LIMIT = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='alice')
+        cls.token = Token.objects.create(user=cls.user)
+        ChatSession.objects.bulk_create(
+            (ChatSession(user=cls.user, title=f'Chat {n}', pinned=n % 100 == 0, is_deleted=n % 10 == 9)
+             for n in range(cls.SESSIONS)),
+            batch_size=1000,
+        )
+
+    def setUp(self):
+        self.client = Client(headers={'Authorization': f'Token {self.token.key}'})
+        self.client.get('/api/chats/', {'limit': 1})  # Warm the token cache
+
+    def get_page(self, cursor=None):
+        params = {'limit': self.LIMIT, **({'cursor': cursor} if cursor else {})}
+        # The conditional-GET validators and the page itself.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/chats/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_walking_every_page_returns_each_live_chat_once_in_display_order(self):
+        expected = list(ChatSession.objects.filter(user=self.user, is_deleted=False)
+                        .order_by('-pinned', '-updated_at', '-id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page = self.get_page(cursor)
+            seen += [chat['id'] for chat in page['results']]
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def timed_page(self, cursor):
+        timings = []
+        for _ in range(7):
+            started = time.perf_counter()
+            self.get_page(cursor)
+            timings.append(time.perf_counter() - started)
+        return percentile(timings, 50)
+
+    def test_a_deep_page_is_as_cheap_as_the_first(self):
+        cursor = None
+        for _ in range(100):  # Page 101 of 180
+            cursor = self.client.get('/api/chats/', {'limit': self.LIMIT, **({'cursor': cursor} if cursor else {})}
+                                     ).json()['next']
+        first, deep = self.timed_page(None), self.timed_page(cursor)
+        self.assertLess(deep, first * 3 + 0.02, f'first page {first * 1000:.1f} ms, page 101 {deep * 1000:.1f} ms')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite query plan')
+    def test_the_page_query_uses_the_sidebar_index(self):
+        plan = (ChatSession.objects.filter(user=self.user, is_deleted=False)
+                .order_by('-pinned', '-updated_at', '-id')[:self.LIMIT].explain())
+        self.assertIn('chatsession_sidebar_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+# --- Session stats ---
+
+@override_settings(**TEST_SETTINGS)
+class SessionStatsTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.older, self.chat = (ChatSession.objects.create(user=self.user, title=title) for title in ('Old', 'New'))
+
+    def test_a_turn_updates_count_time_and_preview(self):
+        self.client.post(f'/api/chats/{self.older.id}/messages/', {'text': 'explain heaps'})
+        chat = self.client.get(f'/api/chats/{self.older.id}/', {'messages': 'none'}).json()
+        reply = Message.objects.get(is_from_user=False)
+        self.assertEqual(chat['message_count'], 2)
+        self.assertEqual(chat['last_message_preview'], 'RGPT fake reply to: explain heaps')
+        self.older.refresh_from_db()
+        self.assertEqual((self.older.last_message_at, self.older.updated_at), (reply.timestamp, reply.timestamp))
+
+    def test_the_sidebar_puts_the_latest_activity_first(self):
+        self.client.post(f'/api/chats/{self.older.id}/messages/', {'text': 'explain heaps'})
+        self.assertEqual([chat['title'] for chat in self.client.get('/api/chats/').json()], ['Old', 'New'])
+
+    def test_preview_is_one_line_and_capped(self):
+        self.assertEqual(message_preview('two\n  lines'), 'two lines')
+        preview = message_preview('word ' * 100)
+        self.assertEqual((len(preview), preview[-1]), (140, '…'))
+
+    def test_editing_a_message_leaves_the_count_alone(self):
+        message = Message.objects.create(session=self.chat, text='first', is_from_user=True)
+        message.text = 'edited'
+        message.save()
+        self.chat.refresh_from_db()
+        self.assertEqual((self.chat.message_count, self.chat.last_message_preview), (1, 'first'))
+
+    def test_backfill_recomputes_stale_stats(self):
+        for text in ('first', 'second', 'third'):
+            Message.objects.create(session=self.chat, text=text, is_from_user=True)
+        ChatSession.objects.update(message_count=0, last_message_at=None, last_message_preview='')
+        call_command('backfill_session_stats', batch_size=1, stdout=io.StringIO())
+        self.chat.refresh_from_db()
+        self.older.refresh_from_db()
+        newest = Message.objects.latest('timestamp', 'id')
+        self.assertEqual((self.chat.message_count, self.chat.last_message_at, self.chat.last_message_preview),
+                         (3, newest.timestamp, 'third'))
+        self.assertEqual((self.older.message_count, self.older.last_message_at), (0, None))
+
+
+# --- Token auth cache ---
+
+@override_settings(**TEST_SETTINGS)
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(AUTH_TOKEN_CACHE_TTL=60))  # A fresh cache per test
+        self.user, self.client = signed_in()
+        self.token = Token.objects.get(user=self.user)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/chats/').status_code, 200)
+        return len(queries)
+
+    def test_a_seen_token_skips_the_token_and_user_query(self):
+        cold = self.count_queries()
+        self.assertEqual(self.count_queries(), cold - 1)
+
+    def test_logout_revokes_the_cached_token(self):
+        self.count_queries()
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/chats/').status_code, 403)
+
+    def test_deactivating_the_user_revokes_the_cached_token(self):
+        self.count_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/chats/').status_code, 403)
+
+    def test_each_request_gets_its_own_copy_of_the_user(self):
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.token.key)
+        first.first_name = 'changed in one request'
+        second, _ = auth.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.first_name, '')
+
+
+# --- Google sign-in ---
+
+GOOGLE_CLIENT = 'test-client.apps.googleusercontent.com'
+
+
+class GoogleIdTokenTests(TestCase):
+    """Verification against a local stand-in for Google's certificate endpoint."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {}
+        for key_id in ('key-1', 'key-2'):
+            public_key, private_key = rsa.newkeys(1024)
+            cls.keys[key_id] = (public_key.save_pkcs1().decode(), private_key.save_pkcs1().decode())
+
+    def setUp(self):
+        self.server = serve_google_certs({'key-1': self.keys['key-1'][0]})
+        self.addCleanup(self.server.shutdown)
+        self.cache_file = os.path.join(MEDIA_ROOT, f'google-certs-{self._testMethodName}.json')
+        self.enterContext(override_settings(
+            GOOGLE_CERTS_URL=self.server.url, GOOGLE_CERTS_CACHE_FILE=self.cache_file, GOOGLE_CLIENT_ID=GOOGLE_CLIENT,
+        ))
+
+    def token(self, key_id='key-1', audience=GOOGLE_CLIENT, **kwargs):
+        return make_google_id_token(self.keys[key_id][1], key_id, audience, email='alice@example.com', **kwargs)
+
+    def test_a_valid_token_is_verified_with_one_fetch(self):
+        idinfo = verify_google_id_token(self.token())
+        self.assertEqual((idinfo['email'], idinfo['aud']), ('alice@example.com', GOOGLE_CLIENT))
+        self.assertEqual(self.server.hits, 1)
+
+    def test_later_logins_use_the_cached_certificates(self):
+        for _ in range(5):
+            verify_google_id_token(self.token())
+        self.assertEqual(self.server.hits, 1)
+        # A new process reads them from the cache file instead of the network.
+        GoogleCertCache(self.server.url, cache_file=self.cache_file).get()
+        self.assertEqual(self.server.hits, 1)
+
+    def test_a_token_for_another_client_is_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'audience'):
+            verify_google_id_token(self.token(audience='someone-else.apps.googleusercontent.com'))
+
+    def test_an_expired_token_is_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'expired'):
+            verify_google_id_token(self.token(expires_in=-3600))
+
+    def test_a_rotated_key_triggers_one_refetch(self):
+        verify_google_id_token(self.token())
+        self.server.certs = {key_id: public for key_id, (public, _) in self.keys.items()}
+        self.assertEqual(verify_google_id_token(self.token('key-2'))['email'], 'alice@example.com')
+        self.assertEqual(self.server.hits, 2)
+
+    def test_unknown_key_ids_refetch_at_most_once_a_minute(self):
+        verify_google_id_token(self.token())
+        for _ in range(3):
+            with self.assertRaisesRegex(ValueError, 'key-2'):
+                verify_google_id_token(self.token('key-2'))
+        self.assertEqual(self.server.hits, 2)
+
+    @override_settings(**TEST_SETTINGS)
+    def test_login_creates_the_user_once_and_returns_a_token(self):
+        first = self.client.post('/api/auth/google/', {'token': self.token()}, content_type='application/json')
+        again = self.client.post('/api/auth/google/', {'token': self.token()}, content_type='application/json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['token'], again.json()['token'])
+        self.assertEqual(User.objects.get().email, 'alice@example.com')
+        rejected = self.client.post('/api/auth/google/', {'token': self.token(expires_in=-3600)},
+                                    content_type='application/json')
+        self.assertEqual(rejected.status_code, 400)
+
+
+# --- Image uploads ---
+
+def photo(width=300, height=200, fmt='JPEG', name='photo.jpg', orientation=None):
+    """An uploaded picture with camera metadata (serial number and GPS position), like a phone photo."""
+    exif = Image.Exif()
+    exif[ExifTags.Base.BodySerialNumber] = 'SN-12345'
+    exif.get_ifd(ExifTags.IFD.GPSInfo)[ExifTags.GPS.GPSLatitudeRef] = 'N'
+    if orientation:
+        exif[ExifTags.Base.Orientation] = orientation
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(out, fmt, exif=exif)
+    return SimpleUploadedFile(name, out.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+@override_settings(**TEST_SETTINGS)
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        self.url = f'/api/chats/{self.chat.id}/messages/'
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_the_model_gets_a_downscaled_upright_jpeg(self):
+        image = preprocess_image(photo(400, 200, orientation=6))
+        self.assertEqual((image.mime_type, image.width, image.height, image.original_size),
+                         ('image/jpeg', 50, 100, (400, 200)))
+        self.assertEqual(dict(Image.open(io.BytesIO(image.data)).getexif()), {})
+
+    def test_the_stored_original_keeps_only_its_orientation(self):
+        upload = photo(orientation=6)
+        original = upload.read()
+        upload.seek(0)
+        response = self.client.post(self.url, {'text': 'what is this?', 'file_upload': upload})
+        self.assertEqual(response.status_code, 201)
+        with Message.objects.get(is_from_user=True).file_upload.open('rb') as fh:
+            stored = fh.read()
+        self.assertNotIn(b'SN-12345', stored)
+        self.assertEqual(dict(Image.open(io.BytesIO(stored)).getexif()), {ExifTags.Base.Orientation: 6})
+        # Only metadata segments were dropped: the compressed image data is byte for byte the same.
+        scan = original.index(b'\xff\xda')
+        self.assertTrue(stored.endswith(original[scan:]))
+
+    def test_other_formats_with_metadata_are_stored_as_png(self):
+        stored = strip_metadata(photo(fmt='WEBP', name='photo.webp', orientation=6))
+        self.assertEqual(stored.name, 'photo.png')
+        data = stored.read()
+        self.assertNotIn(b'SN-12345', data)
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (200, 300))
+
+    def test_a_photo_without_metadata_is_stored_as_is(self):
+        out = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(out, 'JPEG')
+        upload = SimpleUploadedFile('plain.jpg', out.getvalue())
+        self.assertIs(strip_metadata(upload), upload)
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels_is_a_400_and_saves_nothing(self):
+        response = self.client.post(self.url, {'text': 'what is this?', 'file_upload': photo(301, 200)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('megapixels', response.json()['error'])
+        self.assertFalse(Message.objects.exists())
+
+    def test_a_file_that_is_not_an_image_is_a_400(self):
+        upload = SimpleUploadedFile('notes.jpg', b'not a picture', content_type='image/jpeg')
+        response = self.client.post(self.url, {'text': 'what is this?', 'file_upload': upload})
+        self.assertEqual(response.status_code, 400)
+
+    def test_the_chat_and_message_are_checked_before_the_image_is_decoded(self):
+        other = ChatSession.objects.create(user=User.objects.create(username='bob'))
+        with mock.patch('api.views.preprocess_upload') as preprocess:
+            missing = self.client.post(f'/api/chats/{other.id}/messages/', {'text': 'hi', 'file_upload': photo()})
+            invalid = self.client.post(self.url, {'file_upload': photo()})
+        self.assertEqual((missing.status_code, invalid.status_code), (404, 400))
+        preprocess.assert_not_called()
+
+
+# --- Deduplicated uploads ---
+
+@override_settings(**TEST_SETTINGS)
+class UploadDedupTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+
+    def send_photo(self, chat=None):
+        response = self.client.post(f'/api/chats/{(chat or self.chat).id}/messages/',
+                                    {'text': 'what is this?', 'file_upload': photo(name='IMG_0001.JPG')})
+        self.assertEqual(response.status_code, 201)
+        return Message.objects.get(pk=response.json()['user_message']['id'])
+
+    def gc(self, *args):
+        call_command('gc_uploads', '--grace', '0', *args, stdout=io.StringIO())
+
+    def test_the_same_picture_is_stored_once_and_counted_per_message(self):
+        first = self.send_photo()
+        second = self.send_photo(ChatSession.objects.create(user=self.user))
+        self.assertEqual(first.file_upload.name, second.file_upload.name)
+        self.assertRegex(first.file_upload.name, r'^user_uploads/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(UploadBlob.objects.get().ref_count, 2)
+
+    def test_resending_a_picture_reuses_the_model_copy(self):
+        self.assertIsNotNone(preprocess_upload(photo(123, 45)).original_size)
+        self.assertIsNone(preprocess_upload(photo(123, 45)).original_size)  # From the derived-artifact cache
+
+    def test_the_model_copy_is_kept_with_the_stored_blob(self):
+        digest = UploadBlob.objects.get(name=self.send_photo().file_upload.name).digest
+        self.assertEqual(list(get_upload_storage().list_derived()).count(digest), 1)
+
+    def test_gc_deletes_a_file_only_once_no_message_uses_it(self):
+        first, second = self.send_photo(), self.send_photo()
+        name = first.file_upload.name
+        storage = get_upload_storage()
+
+        first.delete()
+        self.gc()
+        self.assertEqual(UploadBlob.objects.get().ref_count, 1)
+        self.assertTrue(storage.exists(name))
+
+        second.delete()
+        self.gc()
+        self.assertFalse(UploadBlob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+    def test_recount_repairs_counts_after_a_raw_delete(self):
+        message, _ = self.send_photo(), self.send_photo()
+        Message.objects.filter(pk=message.pk)._raw_delete(Message.objects.db)  # No post_delete signal
+        self.assertEqual(UploadBlob.objects.get().ref_count, 2)
+        self.gc('--recount')
+        self.assertEqual(UploadBlob.objects.get().ref_count, 1)
+
+    def test_recently_touched_blobs_survive_the_grace_period(self):
+        self.send_photo().delete()
+        call_command('gc_uploads', stdout=io.StringIO())
+        self.assertEqual(UploadBlob.objects.get().ref_count, 0)
+
+
+# --- Resumable replies ---
+
+@override_settings(**TEST_SETTINGS, STREAM_RESUME_POLL_INTERVAL=0.01, STREAM_RESUME_TIMEOUT=0.1)
+class ResumableReplyTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+
+    def resume_url(self, message, offset=0):
+        return f'/api/chats/{self.chat.id}/messages/{message.id}/stream/?offset={offset}'
+
+    def test_checkpoints_create_the_row_first_then_append_in_batches(self):
+        checkpointer = ReplyCheckpointer(self.chat, every_tokens=2, every_seconds=60)
+        saved = []
+
+        async def stream():
+            for chunk in ('Binary ', 'search ', 'halves ', 'the ', 'range.'):
+                await checkpointer.add(chunk)
+                saved.append(await Message.objects.filter(is_from_user=False).values_list('text', flat=True).aget())
+            return await checkpointer.finish()
+
+        message = async_to_sync(stream)()
+        self.assertEqual(saved, ['Binary ', 'Binary ', 'Binary search halves ', 'Binary search halves ',
+                                 'Binary search halves the range.'])
+        message.refresh_from_db()
+        self.assertEqual((message.text, message.in_progress), ('Binary search halves the range.', False))
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.last_message_preview, 'Binary search halves the range.')
+
+    def test_polling_returns_only_the_text_after_the_offset(self):
+        reply = Message.objects.create(session=self.chat, text='Hello wor', is_from_user=False, in_progress=True)
+        self.assertEqual(self.client.get(self.resume_url(reply, 6)).json(),
+                         {'id': reply.id, 'offset': 6, 'text': 'wor', 'length': 9, 'in_progress': True})
+
+    def test_a_finished_reply_resumes_with_the_rest_and_the_message(self):
+        reply = Message.objects.create(session=self.chat, text='Hello world', is_from_user=False)
+        events = read_events(self.client.get(self.resume_url(reply, 6), headers={'Accept': 'text/event-stream'}))
+        self.assertEqual(events[0], ('token', {'text': 'world', 'offset': 6}))
+        self.assertEqual((events[1][0], events[1][1]['text']), ('bot_message', 'Hello world'))
+
+    def test_a_stalled_reply_ends_with_an_error_at_the_last_offset(self):
+        reply = Message.objects.create(session=self.chat, text='Hello', is_from_user=False, in_progress=True)
+        events = read_events(self.client.get(self.resume_url(reply), headers={'Accept': 'text/event-stream'}))
+        self.assertEqual([name for name, _ in events], ['token', 'error'])
+        self.assertEqual(events[1][1]['offset'], 5)
+
+    def test_a_partial_stream_can_be_resumed(self):
+        events = read_events(self.client.post(f'/api/chats/{self.chat.id}/messages/?stream=1',
+                                              {'text': 'explain heaps'}))
+        started = dict(events)['bot_message_started']
+        reply = Message.objects.get(pk=started['id'])
+        seen = ''.join(data['text'] for name, data in events if name == 'token')[:5]
+        rest = self.client.get(self.resume_url(reply, len(seen))).json()
+        self.assertEqual(seen + rest['text'], 'RGPT fake reply to: explain heaps')
+
+    def test_only_the_users_own_bot_replies_resume(self):
+        question = Message.objects.create(session=self.chat, text='hi', is_from_user=True)
+        theirs = ChatSession.objects.create(user=User.objects.create(username='bob'))
+        reply = Message.objects.create(session=theirs, text='Hello', is_from_user=False)
+        self.assertEqual(self.client.get(self.resume_url(question)).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/chats/{theirs.id}/messages/{reply.id}/stream/').status_code, 404)
+        self.assertEqual(self.client.get(self.resume_url(question, 'x')).status_code, 400)
+
+
+# --- Search ---
+
+@override_settings(**TEST_SETTINGS)
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user, title='Algorithms')
+        Message.objects.create(session=self.chat, text='How does binary search work?', is_from_user=True)
+        Message.objects.create(session=self.chat, text='Quicksort picks a pivot.', is_from_user=False)
+
+    def test_finds_the_users_messages_with_a_snippet(self):
+        response = self.client.get('/api/search/', {'q': 'binary'})
+        self.assertEqual(response.status_code, 200)
+        hits = response.json()['messages']
+        self.assertEqual([hit['session_id'] for hit in hits], [self.chat.id])
+        self.assertIn('[binary]', hits[0]['snippet'])
+        self.assertEqual(response.json()['sessions'][0]['title'], 'Algorithms')
+
+    def test_last_word_matches_as_a_prefix(self):
+        self.assertEqual(len(search(self.user, 'quick')['messages']), 1)
+        self.assertEqual(search(self.user, 'qu')['messages'], [])  # Too short to be a prefix
+
+    def test_other_users_and_deleted_chats_are_not_searched(self):
+        other, _ = signed_in('bob')
+        Message.objects.create(session=ChatSession.objects.create(user=other), text='binary trees', is_from_user=True)
+        deleted = ChatSession.objects.create(user=self.user, is_deleted=True)
+        Message.objects.create(session=deleted, text='binary heaps', is_from_user=True)
+        self.assertEqual([hit['session_id'] for hit in search(self.user, 'binary')['messages']], [self.chat.id])
+
+    def test_replies_are_indexed_once_they_finish(self):
+        reply = Message.objects.create(session=self.chat, text='Partial mergesort', is_from_user=False,
+                                       in_progress=True)
+        self.assertEqual(search(self.user, 'mergesort')['messages'], [])
+        Message.objects.filter(pk=reply.pk).update(in_progress=False)
+        self.assertEqual(len(search(self.user, 'mergesort')['messages']), 1)
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class ConcurrentMessageWriteTests(TransactionTestCase):
+    """Message writes from several workers at once, through the search index triggers."""
+
+    def test_concurrent_inserts_and_updates_do_not_hit_database_is_locked(self):
+        user = User.objects.create(username='alice')
+        chats = [ChatSession.objects.create(user=user) for _ in range(8)]
+        errors = []
+        start = threading.Barrier(len(chats))
+
+        def write(chat):
+            try:
+                start.wait()
+                for n in range(15):
+                    message = Message.objects.create(session=chat, text=f'parallel note {n}', is_from_user=True)
+                    Message.objects.filter(pk=message.pk).update(text=f'parallel edited {n}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(chat,)) for chat in chats]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Message.objects.count(), 8 * 15)
+        self.assertEqual(len(search(user, 'edited', limit=200)['messages']), 8 * 15)
+        self.assertEqual(sum(ChatSession.objects.values_list('message_count', flat=True)), 8 * 15)
+
+
+# --- Purging deleted chats ---
+
+@override_settings(**TEST_SETTINGS)
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+
+    def chat(self, deleted_days_ago=None, upload=None):
+        chat = ChatSession.objects.create(user=self.user, is_deleted=deleted_days_ago is not None)
+        if deleted_days_ago is not None:
+            ChatSession.objects.filter(pk=chat.pk).update(deleted_at=timezone.now() - timedelta(days=deleted_days_ago))
+        Message.objects.create(session=chat, text='purgeable question', is_from_user=True, file_upload=upload)
+        reply = Message.objects.create(session=chat, text='purgeable answer', is_from_user=False)
+        MessageFeedback.objects.create(message=reply, user=self.user, rating=MessageFeedback.Rating.THUMBS_UP)
+        return chat
+
+    def test_only_chats_deleted_before_the_retention_window_are_purged(self):
+        live, recent = self.chat(), self.chat(deleted_days_ago=1)
+        for _ in range(5):
+            self.chat(deleted_days_ago=40)
+        result = purge_deleted_sessions(retention_days=30, batch_size=2)
+        self.assertEqual((result.sessions, result.messages, result.feedback, result.batches), (5, 10, 5, 3))
+        self.assertEqual(set(ChatSession.objects.values_list('id', flat=True)), {live.id, recent.id})
+        self.assertEqual(Message.objects.count(), 4)
+        self.assertEqual(MessageFeedback.objects.count(), 2)
+
+    def test_purged_messages_leave_the_search_index(self):
+        self.chat(deleted_days_ago=40)
+        live = self.chat()
+        purge_deleted_sessions(retention_days=30)
+        self.assertEqual({hit['session_id'] for hit in search(self.user, 'purgeable')['messages']}, {live.id})
+
+    def test_uploads_are_released_and_deleted_once_unused(self):
+        storage = get_upload_storage()
+        shared = storage.save('user_uploads/shared.jpg', photo(77, 77))
+        alone = storage.save('user_uploads/alone.jpg', photo(78, 78))
+        self.chat(deleted_days_ago=40, upload=shared)
+        self.chat(upload=shared)
+        self.chat(deleted_days_ago=40, upload=alone)
+
+        result = purge_deleted_sessions(retention_days=30, grace=0)
+        self.assertEqual(result.blobs, 1)
+        self.assertEqual(UploadBlob.objects.get().ref_count, 1)
+        self.assertTrue(storage.exists(shared))
+        self.assertFalse(storage.exists(alone))
+
+    def test_dry_run_only_counts(self):
+        self.chat(deleted_days_ago=40)
+        out = io.StringIO()
+        call_command('purge_deleted', '--days', '30', '--dry-run', stdout=out)
+        self.assertIn('Would purge 1 sessions (2 messages)', out.getvalue())
+        self.assertEqual(ChatSession.objects.count(), 1)
+
+
+# --- Export and import ---
+
+@override_settings(**TEST_SETTINGS)
+class ExportImportTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user, title='Heaps', pinned=True)
+        Message.objects.create(session=self.chat, text='explain heaps', is_from_user=True)
+        reply = Message.objects.create(session=self.chat, text='A heap is a tree…', is_from_user=False,
+                                       metadata={'cached': True})
+        MessageFeedback.objects.create(message=reply, user=self.user, rating=MessageFeedback.Rating.THUMBS_UP)
+        ChatSession.objects.create(user=self.user, title='Gone', is_deleted=True)
+        ChatSession.objects.create(user=User.objects.create(username='bob'), title="Bob's")
+
+    def export(self):
+        response = self.client.get('/api/chats/export/')
+        self.assertEqual(response['Content-Type'], NDJSON_CONTENT_TYPE)
+        return read_body(response).decode('utf-8').splitlines()
+
+    def test_export_streams_the_users_live_chats_with_their_messages(self):
+        records = [json.loads(line) for line in self.export()]
+        self.assertEqual([record['type'] for record in records], ['export', 'session', 'message', 'message'])
+        self.assertEqual(records[1]['title'], 'Heaps')
+        self.assertEqual([(record['text'], record['feedback']) for record in records[2:]],
+                         [('explain heaps', None), ('A heap is a tree…', 1)])
+
+    def test_import_round_trips_chats_messages_timestamps_and_feedback(self):
+        alice = Message.objects.filter(session=self.chat).order_by('timestamp', 'id')
+        carol = User.objects.create(username='carol')
+        counts = import_lines(self.export(), user=carol)
+        self.assertEqual(counts, {'sessions': 1, 'messages': 2, 'feedback': 1})
+        copy = ChatSession.objects.get(user=carol)
+        self.chat.refresh_from_db()
+        self.assertEqual((copy.title, copy.pinned, copy.created_at, copy.updated_at),
+                         (self.chat.title, True, self.chat.created_at, self.chat.updated_at))
+        fields = ('text', 'is_from_user', 'timestamp', 'metadata', 'feedback__rating')
+        self.assertEqual(list(Message.objects.filter(session=copy).order_by('timestamp', 'id').values_list(*fields)),
+                         list(alice.values_list(*fields)))
+        self.assertEqual({hit['session_id'] for hit in search(carol, 'heaps')['messages']}, {copy.id})
+
+    def test_imported_uploads_count_as_references(self):
+        response = self.client.post(f'/api/chats/{self.chat.id}/messages/',
+                                    {'text': 'what is this?', 'file_upload': photo()})
+        self.assertEqual(response.status_code, 201)
+        import_lines(self.export(), user=User.objects.create(username='carol'))
+        self.assertEqual(UploadBlob.objects.get().ref_count, 2)
+
+    def test_a_broken_file_imports_nothing(self):
+        # The chat is already written when the orphan message fails the import.
+        orphan = {'type': 'message', 'id': 1, 'session': 999, 'text': 'orphan', 'is_from_user': True}
+        lines = [*self.export(), json.dumps(orphan)]
+        with self.assertRaisesRegex(ExportFormatError, 'session 999'):
+            import_lines(lines, user=self.user)
+        with self.assertRaisesRegex(ExportFormatError, 'version'):
+            import_lines([json.dumps({'type': 'export', 'version': 99})], user=self.user)
+        self.assertEqual(ChatSession.objects.count(), 3)
+
+
+# --- API benchmark ---
+
+@override_settings(**TEST_SETTINGS)
+class BenchApiTests(TestCase):
+    OPTIONS = {'users': 3, 'sessions': 2, 'messages': 4, 'requests': 3, 'rounds': 1, 'seed': 1}
+
+    def report(self, p50=5.0, **dataset):
+        row = {'p50_ms': p50, 'p95_ms': 8.0, 'p99_ms': 9.0, 'queries': 2.0, 'peak_rss_mb': 0.0}
+        return {'dataset': {'users': 3, **dataset}, 'vendor': 'sqlite', 'results': {'chat_list': row}}
+
+    def test_every_scenario_runs_on_a_small_dataset(self):
+        public_key, private_key = rsa.newkeys(1024)
+        server = serve_google_certs({bench_api.KEY_ID: public_key.save_pkcs1().decode()})
+        self.addCleanup(server.shutdown)
+        command = bench_api.Command(stdout=io.StringIO())
+        with override_settings(GOOGLE_CERTS_URL=server.url, GOOGLE_CERTS_CACHE_FILE=None,
+                               GOOGLE_CLIENT_ID=bench_api.CLIENT_ID):
+            results = command.measure(self.OPTIONS, private_key.save_pkcs1().decode())
+        self.assertEqual(set(results), {'google_login', 'chat_list', 'session_detail', 'message_list',
+                                        'message_create', 'message_create_stream'})
+        self.assertTrue(all(row['queries'] > 0 and row['p50_ms'] > 0 for row in results.values()))
+
+    def test_the_baseline_gate_fails_only_on_regressions(self):
+        path = os.path.join(MEDIA_ROOT, 'bench-baseline.json')
+        command = bench_api.Command(stdout=io.StringIO())
+        command.check_baseline(path, self.report(), threshold=0.25, update=False)  # Writes it
+        command.check_baseline(path, self.report(p50=6.5), threshold=0.25, update=False)  # Within 25% + 0.5 ms
+        with self.assertRaisesRegex(CommandError, 'chat_list p50_ms: 5.0 -> 8.0'):
+            command.check_baseline(path, self.report(p50=8.0), threshold=0.25, update=False)
+        with self.assertRaisesRegex(CommandError, 'different dataset'):
+            command.check_baseline(path, self.report(sessions=5), threshold=0.25, update=False)
+
+
+# --- Request metrics ---
+
+@override_settings(**TEST_SETTINGS, METRICS_ENABLED=True, METRICS_TOKEN='scrape-me')
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+
+    def test_query_counts_from_several_threads_add_up(self):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        self.addCleanup(metrics.current_request.reset, token)
+
+        def run_queries():
+            for _ in range(2000):
+                metrics.time_queries(lambda *args: None, 'SELECT 1', (), False, {})
+
+        # Each thread runs in a copy of this context, like sync_to_async and the image pool.
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(run_queries,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(request_metrics.snapshot()[0], 16000)
+
+    def test_a_turn_reports_its_queries_and_phases_in_server_timing(self):
+        response = self.client.post(f'/api/chats/{self.chat.id}/messages/', {'text': 'explain heaps'})
+        timing = {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+        self.assertRegex(timing['db'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"$')
+        self.assertIn('model', timing)
+        self.assertIn('total', timing)
+
+    def test_the_metrics_endpoint_is_for_admins_and_scrapers(self):
+        self.client.get('/api/chats/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        response = Client().get('/api/metrics/', headers={'Authorization': 'Bearer scrape-me'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.PROMETHEUS_CONTENT_TYPE)
+        self.assertRegex(response.content.decode(),
+                         r'rgpt_request_duration_seconds_bucket\{endpoint="api/chats/",method="GET",status="200",le=')
+        self.assertEqual(Client().get('/api/metrics/', headers={'Authorization': 'Bearer guess'}).status_code, 403)
+
+
+# --- Admission control ---
+
+class TokenBucketTests(TestCase):
+    RATE = 60 / 60  # 60 tokens a minute
+
+    def check_store(self, store):
+        self.assertEqual(store.take('user:1', 40, 60, self.RATE), 0)
+        self.assertAlmostEqual(store.take('user:1', 30, 60, self.RATE), 10, delta=0.5)  # 20 left, 10 short
+        store.give('user:1', 15, 60)  # A refund after settling
+        self.assertEqual(store.take('user:1', 30, 60, self.RATE), 0)
+        store.give('user:1', -100, 60)  # An overrun leaves the bucket in debt
+        self.assertAlmostEqual(store.take('user:1', 1, 60, self.RATE), 96, delta=0.5)
+        self.assertEqual(store.take('user:2', 60, 60, self.RATE), 0)  # Other users have their own bucket
+
+    def test_local_bucket(self):
+        self.check_store(LocalBucketStore())
+
+    def test_database_bucket(self):
+        self.check_store(DatabaseBucketStore())
+
+    def test_a_turn_refused_globally_gets_its_user_tokens_back(self):
+        limiter = RateLimiter(LocalBucketStore(), user_per_minute=100, global_per_minute=100)
+        self.assertTrue(limiter.admit(1, 80).allowed)
+        refused = limiter.admit(2, 80)
+        self.assertEqual((refused.allowed, refused.scope), (False, 'global'))
+        limiter.settle(1, reserved=80, used=0)
+        self.assertTrue(limiter.admit(2, 80).allowed)
+
+    @override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_STORE='local', RATE_LIMIT_USER_TOKENS_PER_MINUTE=100,
+                       RATE_LIMIT_REPLY_TOKENS=1000)
+    def test_an_oversized_turn_settles_the_full_bucket_it_reserved(self):
+        request = SimpleNamespace(method='POST', data={'text': 'explain heaps'}, FILES={}, user=SimpleNamespace(pk=1))
+        self.assertTrue(ModelTokenThrottle().allow_request(request, None))
+        self.assertEqual(request.reserved_tokens, 100)
+        settle(request, used=60)  # 40 come back, not the whole estimate
+        self.assertFalse(get_rate_limiter().admit(1, 50).allowed)
+        self.assertTrue(get_rate_limiter().admit(1, 40).allowed)
+
+
+@override_settings(**TEST_SETTINGS, RATE_LIMIT_ENABLED=True, RATE_LIMIT_USER_TOKENS_PER_MINUTE=1100,
+                   RATE_LIMIT_REPLY_TOKENS=1000)
+class RateLimitedTurnTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(RATE_LIMIT_STORE='local'))  # Fresh buckets per test
+        self.user, self.client = signed_in()
+        self.url = f'/api/chats/{ChatSession.objects.create(user=self.user).id}/messages/'
+
+    def test_a_user_over_budget_gets_a_429_with_retry_after(self):
+        self.assertEqual(self.client.post(self.url, {'text': 'explain heaps'}).status_code, 201)
+        refused = self.client.post(self.url, {'text': 'explain heaps'})
+        self.assertEqual(refused.status_code, 429)
+        self.assertGreaterEqual(int(refused['Retry-After']), 1)
+        self.assertEqual(Message.objects.count(), 2)  # Nothing saved for the refused turn
+
+    def test_other_users_keep_their_own_budget(self):
+        self.client.post(self.url, {'text': 'explain heaps'})
+        bob, other = signed_in('bob')
+        chat = ChatSession.objects.create(user=bob)
+        self.assertEqual(other.post(f'/api/chats/{chat.id}/messages/', {'text': 'explain heaps'}).status_code, 201)
+
+    def test_turns_that_skip_the_model_are_refunded(self):
+        for _ in range(3):
+            # A canned reply reserves a whole turn like any other, and gets it all back.
+            self.assertEqual(self.client.post(self.url, {'text': 'who made you?'}).status_code, 201)
+
+
+# --- Idempotency keys ---
+
+@override_settings(**TEST_SETTINGS, IDEMPOTENCY_WAIT_TIMEOUT=0.1, STREAM_RESUME_POLL_INTERVAL=0.01)
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        self.url = f'/api/chats/{self.chat.id}/messages/'
+
+    def send(self, text='explain heaps', key='send-1', query=''):
+        return self.client.post(self.url + query, {'text': text}, headers={'Idempotency-Key': key})
+
+    def test_a_repeat_gets_the_first_response_without_a_second_turn(self):
+        first, again = self.send(), self.send()
+        self.assertEqual((first.status_code, again.status_code), (201, 201))
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_a_streaming_repeat_follows_the_same_reply(self):
+        first = self.send().json()
+        events = read_events(self.send(query='?stream=1'))
+        self.assertEqual([name for name, _ in events], ['user_message', 'token', 'bot_message'])
+        self.assertEqual((events[0][1]['id'], events[-1][1]['id']),
+                         (first['user_message']['id'], first['bot_message']['id']))
+
+    def test_reusing_a_key_for_another_message_is_a_422(self):
+        self.send()
+        self.assertEqual(self.send(text='explain tries').status_code, 422)
+
+    def test_a_failed_request_releases_its_key(self):
+        with override_settings(**BROKEN_MODEL):
+            self.assertEqual(self.send().status_code, 500)
+        retried = self.send()
+        self.assertEqual(retried.status_code, 201)
+        self.assertNotIn(idempotency.REPLAYED_HEADER, retried)
+
+    def test_a_repeat_of_a_request_still_running_gets_a_409_after_waiting(self):
+        running = SimpleNamespace(FILES={}, data={'text': 'explain heaps'})
+        idempotency.claim(self.user, 'send-1', idempotency.request_fingerprint(running, self.chat.id))
+        response = self.send()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_keys_are_per_user_and_bounded(self):
+        self.send()
+        bob, other = signed_in('bob')
+        chat = ChatSession.objects.create(user=bob)
+        response = other.post(f'/api/chats/{chat.id}/messages/', {'text': 'explain heaps'},
+                              headers={'Idempotency-Key': 'send-1'})
+        self.assertNotIn(idempotency.REPLAYED_HEADER, response)
+        self.assertEqual(self.send(key='k' * 256).status_code, 400)
+
+
+# --- Generation jobs ---
+
+@override_settings(**TEST_SETTINGS, STREAM_RESUME_POLL_INTERVAL=0.01)
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        # Jobs run inline in the test's thread, where the test transaction is visible.
+        self.submitted = []
+        self.enterContext(mock.patch('api.jobs.submit', side_effect=self.submitted.append))
+
+    def post_job(self, text='explain heaps'):
+        return self.client.post(f'/api/chats/{self.chat.id}/messages/?job=1', {'text': text})
+
+    def stale_job(self, attempts, reserved_tokens=0):
+        user_message = Message.objects.create(session=self.chat, text='explain heaps', is_from_user=True)
+        return GenerationJob.objects.create(
+            user=self.user, session=self.chat, user_message=user_message, status=GenerationJob.Status.RUNNING,
+            attempts=attempts, lease_until=timezone.now() - timedelta(seconds=1), reserved_tokens=reserved_tokens,
+        )
+
+    def test_job_mode_answers_202_with_the_job_to_poll(self):
+        response = self.post_job()
+        self.assertEqual(response.status_code, 202)
+        job = response.json()['job']
+        self.assertEqual(job['status'], 'pending')
+        self.assertEqual(response['Location'], f'/api/jobs/{job["id"]}/')
+        self.assertEqual([j.pk for j in self.submitted], [job['id']])
+        self.assertFalse(Message.objects.filter(is_from_user=False).exists())
+
+    def test_prefer_respond_async_also_asks_for_a_job(self):
+        response = self.client.post(f'/api/chats/{self.chat.id}/messages/', {'text': 'explain heaps'},
+                                    headers={'Prefer': 'respond-async'})
+        self.assertEqual(response.status_code, 202)
+
+    def test_a_finished_job_carries_the_reply(self):
+        location = self.post_job()['Location']
+        jobs.run_job(self.submitted[0].pk)
+        job = self.client.get(location).json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['bot_message']['text'], Message.objects.get(is_from_user=False).text)
+        jobs.run_job(self.submitted[0].pk)  # Already claimed: nothing runs twice
+        self.assertEqual(Message.objects.filter(is_from_user=False).count(), 1)
+
+    def test_long_poll_waits_then_answers_with_the_job_unfinished(self):
+        location = self.post_job()['Location']
+        started = time.monotonic()
+        job = self.client.get(location + '?wait=0.1').json()
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual((job['status'], job['bot_message']), ('pending', None))
+
+    def test_long_poll_caps_the_wait_and_rejects_junk(self):
+        location = self.post_job()['Location']
+        with override_settings(JOB_MAX_WAIT=0.05):
+            started = time.monotonic()
+            self.client.get(location + '?wait=30')
+            self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(self.client.get(location + '?wait=soon').status_code, 400)
+
+    def test_jobs_of_other_users_are_not_found(self):
+        location = self.post_job()['Location']
+        _, other = signed_in('bob')
+        self.assertEqual(other.get(location).status_code, 404)
+
+    @override_settings(**BROKEN_MODEL)
+    def test_a_model_error_fails_the_job(self):
+        location = self.post_job()['Location']
+        jobs.run_job(self.submitted[0].pk)
+        job = self.client.get(location).json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('model went away', job['error'])
+
+    def test_a_lost_lease_throws_the_reply_away(self):
+        self.post_job()
+        job = jobs.claim(self.submitted[0].pk)
+        GenerationJob.objects.filter(pk=job.pk).update(attempts=job.attempts + 1)  # Another worker took over
+        self.assertFalse(jobs.finish(job, 'late reply', 10))
+        self.assertFalse(Message.objects.filter(is_from_user=False).exists())
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_recovery_requeues_an_expired_lease(self):
+        job = self.stale_job(attempts=1)
+        runner = mock.Mock(**{'submit.return_value': True})
+        with mock.patch('api.jobs.get_runner', return_value=runner):
+            self.assertEqual(jobs.recover(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_until), ('pending', None))
+        runner.submit.assert_called_once_with(job.pk)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, RATE_LIMIT_ENABLED=True, RATE_LIMIT_STORE='local',
+                       RATE_LIMIT_USER_TOKENS_PER_MINUTE=1000)
+    def test_recovery_fails_a_job_out_of_attempts_and_refunds_it(self):
+        limiter = get_rate_limiter()
+        self.assertTrue(limiter.admit(self.user.pk, 1000).allowed)
+        job = self.stale_job(attempts=2, reserved_tokens=1000)
+        with mock.patch('api.jobs.get_runner', return_value=mock.Mock(**{'submit.return_value': True})):
+            jobs.recover()
+            jobs.recover()  # Refunded once only
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(limiter.admit(self.user.pk, 1000).allowed)
+        self.assertFalse(limiter.admit(self.user.pk, 1000).allowed)
+
+
+# --- Automatic titles ---
+
+class TitlerBackend(FakeBackend):
+    """Titles the first chat of a batch only, between lines a model might add."""
+
+    async def generate(self, persona, content, history=None):
+        return 'Sure! Here are the titles:\n1: "Binary search basics."\n'
+
+
+TITLE_MODEL = dict(TITLE_BACKEND='titler', LLM_BACKENDS={'titler': {'CLASS': 'api.tests.TitlerBackend'}})
+
+
+class HeuristicTitleTests(SimpleTestCase):
+    def test_filler_and_later_sentences_are_dropped(self):
+        self.assertEqual(heuristic_title('hey, can you please explain binary search? I have an exam.'),
+                         'Explain binary search')
+
+    def test_long_messages_keep_their_first_words(self):
+        self.assertEqual(heuristic_title('tell me how the quick brown fox jumps over the lazy dog'),
+                         'How the quick brown fox jumps over')
+        title = heuristic_title('Pneumonoultramicroscopicsilicovolcanoconiosis ' * 2)
+        self.assertLessEqual(len(title), titles.TITLE_MAX_CHARS)
+        self.assertTrue(title.endswith('…'))
+
+    def test_messages_without_text(self):
+        self.assertEqual(heuristic_title('', has_image=True), 'Image chat')
+        self.assertEqual(heuristic_title('   '), DEFAULT_TITLE)
+
+
+@override_settings(**TEST_SETTINGS)
+class TitleSessionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+
+    def chat(self, text):
+        chat = ChatSession.objects.create(user=self.user)
+        Message.objects.create(session=chat, text=text, is_from_user=True)
+        Message.objects.create(session=chat, text='A reply.', is_from_user=False)
+        chat.refresh_from_db()
+        return chat
+
+    def test_untitled_chats_get_a_title_and_a_new_updated_at(self):
+        chat = self.chat('please explain binary search')
+        self.assertEqual(title_sessions([chat.id]), 1)
+        titled = ChatSession.objects.get(pk=chat.pk)
+        self.assertEqual(titled.title, 'Explain binary search')
+        self.assertEqual(titled.updated_at, chat.updated_at + timedelta(microseconds=1))
+
+    def test_a_rename_wins(self):
+        chat = self.chat('please explain binary search')
+        ChatSession.objects.filter(pk=chat.pk).update(title='Exam prep')
+        self.assertEqual(title_sessions([chat.id]), 0)
+        renamed = ChatSession.objects.get(pk=chat.pk)
+        self.assertEqual((renamed.title, renamed.updated_at), ('Exam prep', chat.updated_at))
+
+    def test_chats_without_messages_are_left_alone(self):
+        chat = ChatSession.objects.create(user=self.user)
+        self.assertEqual(title_sessions([chat.id]), 0)
+        self.assertFalse(titles.untitled_sessions().filter(pk=chat.pk).exists())  # Nor swept
+
+    @override_settings(**TITLE_MODEL)
+    def test_one_model_call_titles_a_batch_and_the_heuristic_fills_gaps(self):
+        first, second = self.chat('what is bisection?'), self.chat('can you explain heaps')
+        self.assertEqual(title_sessions([first.id, second.id]), 2)
+        self.assertEqual(ChatSession.objects.get(pk=first.pk).title, 'Binary search basics')
+        self.assertEqual(ChatSession.objects.get(pk=second.pk).title, 'Explain heaps')
+
+    @override_settings(**dict(TITLE_MODEL, LLM_BACKENDS={'titler': {'CLASS': 'api.tests.BrokenBackend'}}))
+    def test_a_model_error_falls_back_to_the_heuristic(self):
+        chat = self.chat('please explain binary search')
+        with self.assertLogs('api.titles', 'ERROR'):
+            title_sessions([chat.id])
+        self.assertEqual(ChatSession.objects.get(pk=chat.pk).title, 'Explain binary search')
+
+    def test_the_backend_can_be_given_per_call(self):
+        first, second = self.chat('what is bisection?'), self.chat('what is bisection?')
+        with override_settings(**TITLE_MODEL):
+            title_sessions([first.id], backend='')
+        with override_settings(LLM_BACKENDS=TITLE_MODEL['LLM_BACKENDS']):
+            title_sessions([second.id], backend='titler')
+        self.assertEqual(ChatSession.objects.get(pk=first.pk).title, 'What is bisection')
+        self.assertEqual(ChatSession.objects.get(pk=second.pk).title, 'Binary search basics')
+
+    def test_the_sweep_moves_past_chats_that_stay_untitled(self):
+        blank = [self.chat('').id for _ in range(2)]  # Nothing to name them after
+        chat = self.chat('please explain binary search')
+        titler = SessionTitler(batch_size=2, batch_wait=0, queue_size=4, sweep_interval=0)  # Not started
+        for expected in (blank, [chat.id], blank):  # Then back to the start
+            titler.sweep()
+            batch = [session_id for session_id, _ in titler.take_batch(timeout=0)]
+            self.assertEqual(batch, expected)
+            title_sessions(batch)
+
+    def test_requests_do_not_start_the_titler(self):
+        _, client = signed_in('bob')
+        with override_settings(TITLE_ENABLED=True):
+            client.get('/api/chats/')
+            self.assertIsNone(titles._titler)
+
+    def test_the_first_turn_offers_the_chat_to_the_titler(self):
+        _, client = signed_in('bob')
+        chat = ChatSession.objects.create(user=User.objects.get(username='bob'))
+        with mock.patch('api.views.titles.offer') as offer:
+            for text in ('explain heaps', 'and tries?'):
+                client.post(f'/api/chats/{chat.id}/messages/', {'text': text})
+        offer.assert_called_once_with(chat.pk)
+
+
+class SessionTitlerQueueTests(SimpleTestCase):
+    def test_offers_are_deduplicated_and_dropped_when_full(self):
+        titler = SessionTitler(batch_size=2, batch_wait=0, queue_size=2, sweep_interval=0)  # Not started
+        self.assertTrue(titler.offer(1))
+        self.assertTrue(titler.offer(1))
+        self.assertTrue(titler.offer(2))
+        self.assertFalse(titler.offer(3))
+        self.assertEqual([session_id for session_id, _ in titler.take_batch(timeout=0)], [1, 2])
+        self.assertTrue(titler.offer(1))  # Taken, so it can be queued again
+
+
+# --- Conditional GET ---
+
+@override_settings(**TEST_SETTINGS)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user, self.client = signed_in()
+        self.chat = ChatSession.objects.create(user=self.user)
+        Message.objects.create(session=self.chat, text='explain heaps', is_from_user=True)
+        self.urls = ['/api/chats/', f'/api/chats/{self.chat.id}/', f'/api/chats/{self.chat.id}/?messages=latest',
+                     f'/api/chats/{self.chat.id}/messages/']
+
+    def etags(self):
+        return {url: self.client.get(url)['ETag'] for url in self.urls}
+
+    def revalidate(self, etags):
+        return {url: self.client.get(url, headers={'If-None-Match': etag}).status_code
+                for url, etag in etags.items()}
+
+    def test_a_matching_etag_gets_a_304(self):
+        etags = self.etags()
+        self.assertEqual(len(set(etags.values())), len(self.urls))  # Every path has its own tag
+        for url, etag in etags.items():
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual((response.status_code, response.content), (304, b''))
+            self.assertEqual((response['ETag'], response['Cache-Control']), (etag, 'private, no-cache'))
+
+    def test_another_user_never_matches(self):
+        etag = self.client.get('/api/chats/')['ETag']
+        _, other = signed_in('bob')
+        self.assertEqual(other.get('/api/chats/', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_a_new_message_changes_every_tag(self):
+        etags = self.etags()
+        self.assertEqual(self.client.post(self.urls[-1], {'text': 'and tries?'}).status_code, 201)
+        self.assertEqual(set(self.revalidate(etags).values()), {200})
+
+    def test_a_title_change_changes_every_tag_that_shows_it(self):
+        etags = self.etags()
+        self.client.patch(self.urls[1], {'title': 'Heaps'}, content_type='application/json')
+        statuses = self.revalidate(etags)
+        self.assertEqual([statuses[url] for url in self.urls[:3]], [200, 200, 200])
+        response = self.client.get('/api/chats/', headers={'If-None-Match': etags['/api/chats/']})
+        self.assertEqual(response.json()[0]['title'], 'Heaps')
+
+    def test_a_deleted_chat_leaves_the_chat_list(self):
+        etags = self.etags()
+        self.assertEqual(self.client.delete(self.urls[1]).status_code, 204)
+        statuses = self.revalidate(etags)
+        self.assertEqual(statuses['/api/chats/'], 200)
+        self.assertEqual(statuses[self.urls[1]], 404)
+
+    def test_no_validators_while_a_reply_streams(self):
+        etags = self.etags()
+        reply = Message.objects.create(session=self.chat, text='Half', is_from_user=False, in_progress=True)
+        for url in self.urls[1:]:
+            response = self.client.get(url, headers={'If-None-Match': etags[url]})
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('ETag'))
+        Message.objects.filter(pk=reply.pk).update(text='Half done.', in_progress=False)
+        self.assertTrue(self.client.get(self.urls[1]).has_header('ETag'))
+
+    def test_if_modified_since_is_ignored_for_the_chat_list(self):
+        future = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        self.assertEqual(self.client.get('/api/chats/', headers={'If-Modified-Since': future}).status_code, 200)
+        # A chat's own Last-Modified can be trusted.
+        self.assertEqual(self.client.get(self.urls[1], headers={'If-Modified-Since': future}).status_code, 304)
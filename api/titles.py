@@ -0,0 +1,308 @@
+"""
+Automatic chat titles, generated off the request path.
+
+A chat's first turn offers its id to the titler: a non-blocking put on a
+bounded queue (TITLE_QUEUE_SIZE), so the chat path never waits on it; when
+the queue is full the id is dropped and the periodic sweep finds the chat
+later. A background thread takes up to TITLE_BATCH_SIZE chats at a time
+(waiting up to TITLE_BATCH_WAIT seconds to fill a batch) and titles them all
+from one model call on TITLE_BACKEND (a name in LLM_BACKENDS), or with a
+local heuristic when TITLE_BACKEND is empty or a title doesn't come back.
+Titles are written with one bulk_update, only to chats still called
+DEFAULT_TITLE, so a rename in the meantime wins.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import F, Min
+from django.dispatch import receiver
+
+from . import llm, metrics
+from .models import DEFAULT_TITLE, ChatSession, Message
+from .persona import make_persona
+
+logger = logging.getLogger(__name__)
+
+TITLE_MAX_CHARS = 60
+EXCERPT_CHARS = 300
+TITLE_PERSONA = make_persona(
+    "You name chat conversations. For each numbered conversation you are given, reply with one line "
+    "'<number>: <title>'. A title is 2 to 6 words in the language of the conversation, says what it is "
+    "about, and has no quotes or final punctuation. Reply with nothing else."
+)
+TITLE_LINE_RE = re.compile(r'^\s*(\d+)\s*[:.)-]\s*(.+?)\s*$')
+FILLER_RE = re.compile(
+    r"^(?:(?:hi|hello|hey)\b[\s,!.]*)?(?:(?:can|could|would|will) you(?: please)?|please|i want you to|"
+    r"i need(?: you)? to|help me(?: to)?|tell me|explain to me)\s+",
+    re.IGNORECASE,
+)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def titler_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    titler = _titler
+    stats['queued'] = titler.queue.qsize() if titler is not None else 0
+    stats['backend'] = settings.TITLE_BACKEND or 'heuristic'
+    return stats
+
+
+def heuristic_title(text, has_image=False):
+    """A title from the first user message: its first sentence, minus filler like "can you", cut to a few words."""
+    text = ' '.join((text or '').split())
+    if not text:
+        return 'Image chat' if has_image else DEFAULT_TITLE
+    text = FILLER_RE.sub('', text)
+    text = re.split(r'(?<=[.!?])\s|\n', text, maxsplit=1)[0].strip(' .!?,;:')
+    words = text.split()
+    title = ' '.join(words[:7]) if words else 'Chat'
+    if len(title) > TITLE_MAX_CHARS:
+        title = title[:TITLE_MAX_CHARS - 1].rsplit(' ', 1)[0] + '…'
+    return title[:1].upper() + title[1:]
+
+
+def clean_title(title):
+    title = title.strip().strip('"\'`*').strip().rstrip('.')
+    if len(title) > TITLE_MAX_CHARS:
+        title = title[:TITLE_MAX_CHARS - 1].rsplit(' ', 1)[0] + '…'
+    return title
+
+
+def first_exchanges(session_ids):
+    """session id -> (first user message text, has image, first reply text), in two queries."""
+    first_ids = (Message.objects.filter(session_id__in=session_ids).values('session_id', 'is_from_user')
+                 .annotate(first_id=Min('id')).order_by().values_list('first_id', flat=True))
+    exchanges = {}
+    for row in Message.objects.filter(id__in=list(first_ids)).values('session_id', 'is_from_user', 'text',
+                                                                       'file_upload'):
+        prompt, has_image, reply = exchanges.get(row['session_id'], ('', False, ''))
+        if row['is_from_user']:
+            prompt, has_image = row['text'], bool(row['file_upload'])
+        else:
+            reply = row['text']
+        exchanges[row['session_id']] = (prompt, has_image, reply)
+    return exchanges
+
+
+def title_prompt(exchanges):
+    lines = []
+    for number, (prompt, has_image, reply) in enumerate(exchanges.values(), 1):
+        prompt = ' '.join(prompt.split())[:EXCERPT_CHARS] or '(no text)'
+        lines.append(f"{number}. User: {prompt}{' [image attached]' if has_image else ''}")
+        if reply:
+            lines.append(f"   Assistant: {' '.join(reply.split())[:EXCERPT_CHARS]}")
+    return '\n'.join(lines)
+
+
+async def generate_titles(backend, prompt):
+    # Same concurrency cap as chat turns; the 'titles' lane takes turns with users in the fair queue.
+    async with llm.model_limiter.slot('titles'):
+        return await backend.generate(TITLE_PERSONA, [prompt])
+
+
+def model_titles(exchanges, backend=None):
+    """
+    session id -> title from one call to `backend` (a name in LLM_BACKENDS;
+    default: TITLE_BACKEND); chats missing from the reply are left out.
+    """
+    backend = llm.get_backend(backend or settings.TITLE_BACKEND)
+    reply = async_to_sync(generate_titles)(backend, title_prompt(exchanges))
+    by_number = dict(enumerate(exchanges, 1))
+    titles = {}
+    for line in reply.splitlines():
+        match = TITLE_LINE_RE.match(line)
+        if match and int(match.group(1)) in by_number:
+            title = clean_title(match.group(2))
+            if title:
+                titles[by_number[int(match.group(1))]] = title
+    return titles
+
+
+def title_sessions(session_ids, backend=None):
+    """
+    Titles these chats (those still untitled) with `backend` (a name in
+    LLM_BACKENDS, '' for the heuristic; default: TITLE_BACKEND). Returns how
+    many were written.
+    """
+    backend = settings.TITLE_BACKEND if backend is None else backend
+    started = time.perf_counter()
+    exchanges = first_exchanges(session_ids)
+    titles, source = {}, 'heuristic'
+    if backend and exchanges:
+        source = 'model'
+        try:
+            titles = model_titles(exchanges, backend)
+        except Exception:
+            logger.exception("Title generation failed; using the heuristic")
+            count('model_errors')
+        count('model_batches')
+    for session_id, (prompt, has_image, _) in exchanges.items():
+        if session_id not in titles:
+            titles[session_id] = heuristic_title(prompt, has_image)
+            count('heuristic_titles')
+    titles = {session_id: title for session_id, title in titles.items() if title != DEFAULT_TITLE}
+
+    with transaction.atomic():
+        # Only chats nobody renamed while the titles were being generated.
+        sessions = list(ChatSession.objects.select_for_update().filter(pk__in=list(titles), title=DEFAULT_TITLE)
+                        .only('id', 'title'))
+        for session in sessions:
+            session.title = titles[session.pk]
+        ChatSession.objects.bulk_update(sessions, ['title'])
+        # A new updated_at for cached chat lists (api.conditional), a microsecond on so the sidebar keeps its order.
+        ChatSession.objects.filter(pk__in=[session.pk for session in sessions]).update(
+            updated_at=F('updated_at') + timedelta(microseconds=1)
+        )
+    count('titled', len(sessions))
+    count('batches')
+    if metrics.enabled():
+        metrics.registry.observe(metrics.TITLE_BATCH_SESSIONS, len(sessions))
+        metrics.registry.observe(metrics.TITLE_BATCH_SECONDS, time.perf_counter() - started, source=source)
+    return len(sessions)
+
+
+def untitled_sessions():
+    """Chats with at least one message that still have the default title."""
+    return ChatSession.objects.filter(title=DEFAULT_TITLE, is_deleted=False, message_count__gt=0)
+
+
+class SessionTitler(threading.Thread):
+    def __init__(self, batch_size, batch_wait, queue_size, sweep_interval):
+        super().__init__(name='rgpt-titler', daemon=True)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.sweep_interval = sweep_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = set()  # Ids in the queue, so a chat is queued once
+        self.sweep_after_id = 0
+        self._lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def offer(self, session_id):
+        """Queues a chat for titling without blocking. Returns False if it was dropped."""
+        with self._lock:
+            if session_id in self.pending:
+                return True
+            try:
+                self.queue.put_nowait((session_id, time.perf_counter()))
+            except queue.Full:
+                count('dropped')
+                return False
+            self.pending.add(session_id)
+        count('offered')
+        return True
+
+    def take_batch(self, timeout):
+        """Up to batch_size (id, offered_at) pairs: waits `timeout` for the first, then batch_wait to fill up."""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self.pending.difference_update(session_id for session_id, _ in batch)
+        return batch
+
+    def sweep(self):
+        # Chats whose offer was dropped, or that were started before this process. Each sweep carries on
+        # after the last chat the previous one queued, so chats that stay untitled (nothing to name them
+        # after) don't take the same first slots every time; at the end it starts over.
+        limit = self.queue.maxsize // 2
+        ids = list(untitled_sessions().filter(id__gt=self.sweep_after_id).order_by('id')
+                   .values_list('id', flat=True)[:limit])
+        self.sweep_after_id = ids[-1] if ids and len(ids) == limit else 0
+        for session_id in ids:
+            if not self.offer(session_id):
+                self.sweep_after_id = session_id - 1  # Queue full: resume from this chat
+                break
+
+    def run(self):
+        next_sweep = time.monotonic()
+        while not self.stopped.is_set():
+            if self.sweep_interval and time.monotonic() >= next_sweep:
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("Sweep for untitled chats failed")
+                finally:
+                    close_old_connections()
+                next_sweep = time.monotonic() + self.sweep_interval
+            batch = self.take_batch(timeout=1.0)
+            if not batch:
+                continue
+            try:
+                title_sessions([session_id for session_id, _ in batch])
+                if metrics.enabled():
+                    finished = time.perf_counter()
+                    for _, offered_at in batch:
+                        metrics.registry.observe(metrics.TITLE_DELAY_SECONDS, finished - offered_at)
+            except Exception:
+                logger.exception("Titling %d chats failed", len(batch))
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_titler = None
+_titler_lock = threading.Lock()
+
+
+def get_titler():
+    """The process-wide SessionTitler (started on first use), or None when TITLE_ENABLED is off."""
+    global _titler
+    if not settings.TITLE_ENABLED:
+        return None
+    if _titler is None:
+        with _titler_lock:
+            if _titler is None:
+                _titler = SessionTitler(settings.TITLE_BATCH_SIZE, settings.TITLE_BATCH_WAIT,
+                                        settings.TITLE_QUEUE_SIZE, settings.TITLE_SWEEP_INTERVAL)
+                _titler.start()
+    return _titler
+
+
+def offer(session_id):
+    titler = get_titler()
+    if titler is not None:
+        titler.offer(session_id)
+
+
+def start_titler():
+    """
+    Starts the titler in a server worker (called by the ASGI/WSGI entry
+    points), so its sweep runs before any chat is offered.
+    """
+    get_titler()
+
+
+@receiver(setting_changed)
+def reset_titler(setting, **kwargs):
+    global _titler
+    if setting.startswith('TITLE_') and _titler is not None:
+        _titler.stop()
+        _titler = None
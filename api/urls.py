@@ -2,26 +2,50 @@ from django.urls import path
 from .views import (
     ChatSessionListCreateView,
     ChatSessionDetailView,
+    ChatExportView,
     MessageListCreateView,
+    MessageStreamResumeView,
+    GenerationJobDetailView,
     GoogleLoginView,
-    debug_instruction_view
+    debug_instruction_view,
+    search_view,
+    intent_stats_view,
+    metrics_view,
+    response_cache_stats_view,
+    title_stats_view,
 )
 
 urlpatterns = [
 
     path('auth/google/', GoogleLoginView.as_view(), name='google-login'),
     path('debug-instruction/', debug_instruction_view, name='debug-instruction'),
+    path('debug-intents/', intent_stats_view, name='debug-intents'),
+    path('debug-response-cache/', response_cache_stats_view, name='debug-response-cache'),
+    path('debug-titles/', title_stats_view, name='debug-titles'),
+    path('metrics/', metrics_view, name='metrics'),
 
     # /api/chats/ -> List user's chats (GET) or create a new chat (POST)
     path('chats/', ChatSessionListCreateView.as_view(), name='chat-session-list-create'),
 
+    # /api/chats/export/ -> Download all of the user's chats as NDJSON
+    path('chats/export/', ChatExportView.as_view(), name='chat-export'),
+
     # /api/chats/<id>/ -> Retrieve (GET), update (PUT/PATCH), or delete (DELETE) a specific chat
     path('chats/<int:pk>/', ChatSessionDetailView.as_view(), name='chat-session-detail'),
 
     # /api/chats/<session_id>/messages/ -> List messages in a chat (GET) or add a new message (POST)
     path('chats/<int:session_pk>/messages/', MessageListCreateView.as_view(), name='message-list-create'),
+
+    # /api/chats/<session_id>/messages/<id>/stream/?offset=N -> Resume a streamed bot reply
+    path('chats/<int:session_pk>/messages/<int:pk>/stream/', MessageStreamResumeView.as_view(), name='message-stream-resume'),
     
 
+    # /api/jobs/<id>/?wait=N -> Status of a reply posted with ?job=1 (long-polls up to N seconds)
+    path('jobs/<int:pk>/', GenerationJobDetailView.as_view(), name='generation-job-detail'),
+
+    # /api/search/?q=... -> Search the user's messages
+    path('search/', search_view, name='search'),
+
     # path('chats/new/', create_chat, name='create-chat'),
 
 ]
\ No newline at end of file
@@ -17,6 +17,8 @@ export default function ChatPage() {
   const [isLoading, setIsLoading] = useState(true);
   const [file, setFile] = useState(null);
   const messagesEndRef = useRef(null);
+  // The send waiting for its reply (or for a retry after failing), with its Idempotency-Key.
+  const pendingSend = useRef(null);
 
   const scrollToBottom = () =>
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -40,8 +42,20 @@ export default function ChatPage() {
   // Send message
   const handleSendMessage = async (e) => {
     if(e) e.preventDefault();
-    if (!input.trim() && !file) return;
+    if (isTyping || (!input.trim() && !file)) return;
+    if (pendingSend.current) {
+      // A new message replaces a failed one the user chose not to retry.
+      const failedId = pendingSend.current.tempId;
+      setMessages((prev) => prev.filter((m) => m.id !== failedId));
+    }
     const tempId = Date.now();
+    // One key per message, kept for every retry of it, so the server saves and answers it once.
+    pendingSend.current = {
+      tempId,
+      text: input,
+      file,
+      idempotencyKey: `${tempId}-${Math.random().toString(36).slice(2)}`,
+    };
 
     const UserMessage = {
       id: tempId,
@@ -51,24 +65,29 @@ export default function ChatPage() {
     };
 
     setMessages((prev) => [...prev, UserMessage]);
-    const currentInput = input;
-    const currentFile = file;
     setInput("");
     setFile(null);
+    await sendPending();
+  };
+
+  const sendPending = async () => {
+    const { tempId, text, file: pendingFile, idempotencyKey } = pendingSend.current;
+    setMessages((prev) => prev.map((m) => (m.id === tempId ? { ...m, failed: false } : m)));
     setIsLoading(true);
     setIsTyping(true);
 
     try {
       const formData = new FormData();
-      if(currentInput) formData.append("text", currentInput);
-      if (currentFile) {
-        formData.append('file_upload', currentFile);
+      if(text) formData.append("text", text);
+      if (pendingFile) {
+        formData.append('file_upload', pendingFile);
       }
 
       const res = await api.post(`/chats/${chatId}/messages/`, formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+        headers: { "Content-Type": "multipart/form-data", "Idempotency-Key": idempotencyKey },
       });
 
+      pendingSend.current = null;
       setMessages((prev) =>
         prev
           .map((m) => (m.id === tempId ? res.data.user_message : m))
@@ -76,7 +95,7 @@ export default function ChatPage() {
       );
     } catch (err) {
       console.error("Message send failed:", err);
-      setMessages((prev) => prev.filter((m) => m.id !== tempId));
+      setMessages((prev) => prev.map((m) => (m.id === tempId ? { ...m, failed: true } : m)));
     } finally {
       setIsLoading(false);
       setIsTyping(false);
@@ -134,6 +153,16 @@ export default function ChatPage() {
                 }`}
               >
                 <MessageBubble message={msg} />
+                {msg.failed && (
+                  <button
+                    type="button"
+                    onClick={sendPending}
+                    disabled={isTyping}
+                    className="self-center text-xs text-red-600 dark:text-red-400 hover:underline disabled:opacity-50"
+                  >
+                    Not sent. Retry
+                  </button>
+                )}
               </div>
             ))}
 
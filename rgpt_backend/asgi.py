@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rgpt_backend.settings')
 
 application = get_asgi_application()
+
+# Build the model client and system instruction once per worker, before the first request.
+from api.llm import warm_up  # noqa: E402
+from api.titles import start_titler  # noqa: E402
+
+warm_up()
+# Background chat titles (TITLE_ENABLED) run in server workers only, not in management commands.
+start_titler()
@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os 
+import tempfile
 import dj_database_url 
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -68,8 +70,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +113,39 @@ DATABASES = {
     )
 }
 
+# SQLite allows one writer at a time. Transactions take the write lock when
+# they begin (IMMEDIATE) and wait up to SQLITE_BUSY_TIMEOUT seconds for it.
+# A deferred transaction that has read (the search index triggers of
+# migration 0014 read api_chatsession on every message write) can't wait for
+# the lock: SQLite fails it at once with "database is locked". WAL lets reads
+# carry on during a write. Tests run on a file too, so threads in a test
+# share one database the way workers do.
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '20'))
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': SQLITE_BUSY_TIMEOUT,
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+    })
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+
+
+# Caches
+# 'shared' lives in the database so every worker sees the same entries
+# (created by `python manage.py createcachetable` in build.sh).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'rgpt_shared_cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -161,24 +197,173 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "https://rgpt-chat-app.vercel.app",
 ]
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 # CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
+# Token -> user lookups are cached per worker for AUTH_TOKEN_CACHE_TTL seconds
+# (dropped right away on logout or user changes in the same worker). Set
+# AUTH_TOKEN_CACHE_ALIAS to a cache alias (e.g. 'shared') to share entries.
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', '60'))
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', '10000'))
+AUTH_TOKEN_CACHE_ALIAS = os.environ.get('AUTH_TOKEN_CACHE_ALIAS') or None
+
 # Required by django-allauth
 SITE_ID = 1
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+# Which model backend chat turns go through. 'fake' needs no network or API key
+# and is meant for load tests and profiling our own overhead.
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+LLM_BACKENDS = {
+    'gemini': {
+        'CLASS': 'api.llm.GeminiBackend',
+        'OPTIONS': {'model_name': 'gemini-2.5-pro'},
+    },
+    'fake': {
+        'CLASS': 'api.llm.FakeBackend',
+        'OPTIONS': {
+            'repeat': int(os.environ.get('LLM_FAKE_REPEAT', '1')),
+            'time_to_first_token': float(os.environ.get('LLM_FAKE_TTFT', '0')),
+            'token_delay': float(os.environ.get('LLM_FAKE_TOKEN_DELAY', '0')),
+        },
+    },
+}
+
+# Optional file holding the RGPT system instruction. Workers pick up edits
+# within PERSONA_RELOAD_INTERVAL seconds; unset uses the built-in persona.
+PERSONA_FILE = os.environ.get('RGPT_PERSONA_FILE')
+PERSONA_RELOAD_INTERVAL = float(os.environ.get('RGPT_PERSONA_RELOAD_INTERVAL', '5'))
+
+# Conversation context sent with each turn: the last CONTEXT_RECENT_TURNS
+# exchanges verbatim plus the chat's stored summary of older messages (at most
+# CONTEXT_SUMMARY_TOKENS), followed by transcript lines of the older messages
+# not folded into it yet (each cut short; the oldest dropped past
+# CONTEXT_TRANSCRIPT_TOKENS), kept under CONTEXT_TOKEN_BUDGET (estimated)
+# tokens in total. A chat without a summary gets the transcript alone.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '8000'))
+CONTEXT_RECENT_TURNS = int(os.environ.get('CONTEXT_RECENT_TURNS', '6'))
+CONTEXT_SUMMARY_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_TOKENS', '800'))
+CONTEXT_TRANSCRIPT_TOKENS = int(os.environ.get('CONTEXT_TRANSCRIPT_TOKENS', '1000'))
+
+# Messages that leave the recent window are folded into the chat's summary in
+# the background (api.summaries): a thread started on the first offer takes up
+# to SUMMARY_BATCH_SIZE chats at a time from a queue of SUMMARY_QUEUE_SIZE and
+# makes one call per chat on SUMMARY_BACKEND (a name in LLM_BACKENDS; empty =
+# LLM_BACKEND), folding in at most SUMMARY_MAX_MESSAGES messages per call.
+# With SUMMARY_ENABLED off, chats keep the transcript.
+SUMMARY_ENABLED = os.environ.get('SUMMARY_ENABLED', 'True').lower() == 'true'
+SUMMARY_BACKEND = os.environ.get('SUMMARY_BACKEND', '')
+SUMMARY_BATCH_SIZE = int(os.environ.get('SUMMARY_BATCH_SIZE', '8'))
+SUMMARY_BATCH_WAIT = float(os.environ.get('SUMMARY_BATCH_WAIT', '1'))
+SUMMARY_QUEUE_SIZE = int(os.environ.get('SUMMARY_QUEUE_SIZE', '1000'))
+SUMMARY_MAX_MESSAGES = int(os.environ.get('SUMMARY_MAX_MESSAGES', '40'))
+
+# Optional cache of model replies for repeated prompts. 'local' is a per-process
+# LRU; 'shared' uses the RESPONSE_CACHE_ALIAS cache below so workers share hits.
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'False').lower() == 'true'
+RESPONSE_CACHE_STORE = os.environ.get('RESPONSE_CACHE_STORE', 'local')
+RESPONSE_CACHE_ALIAS = 'shared'
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+
+# Streamed replies are saved every STREAM_CHECKPOINT_TOKENS chunks or
+# STREAM_CHECKPOINT_INTERVAL seconds, whichever comes first. Clients resuming a
+# stream poll for new text every STREAM_RESUME_POLL_INTERVAL seconds and give up
+# after STREAM_RESUME_TIMEOUT seconds without progress.
+STREAM_CHECKPOINT_TOKENS = int(os.environ.get('STREAM_CHECKPOINT_TOKENS', '32'))
+STREAM_CHECKPOINT_INTERVAL = float(os.environ.get('STREAM_CHECKPOINT_INTERVAL', '0.5'))
+STREAM_RESUME_POLL_INTERVAL = float(os.environ.get('STREAM_RESUME_POLL_INTERVAL', '0.25'))
+STREAM_RESUME_TIMEOUT = float(os.environ.get('STREAM_RESUME_TIMEOUT', '30'))
+
+# Message POSTs may carry an Idempotency-Key: repeats within IDEMPOTENCY_KEY_TTL
+# seconds get the first request's result, waiting up to IDEMPOTENCY_WAIT_TIMEOUT
+# seconds for it while it is still running.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', '86400'))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '120'))
+
+# Job mode (`?job=1` on message POSTs): replies are generated by JOB_WORKERS
+# threads per process. A worker holds a job under a JOB_LEASE-second lease it
+# keeps renewing; every JOB_RECOVERY_INTERVAL seconds each process requeues
+# jobs whose lease expired (a crashed worker), up to JOB_MAX_ATTEMPTS runs.
+# GET /api/jobs/<id>/?wait= long-polls for at most JOB_MAX_WAIT seconds.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_LEASE = int(os.environ.get('JOB_LEASE', '60'))
+JOB_RECOVERY_INTERVAL = int(os.environ.get('JOB_RECOVERY_INTERVAL', '30'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_MAX_WAIT = float(os.environ.get('JOB_MAX_WAIT', '25'))
+
+# Chats still called 'New Chat' after their first turn are named in the
+# background, TITLE_BATCH_SIZE chats per model call on TITLE_BACKEND (a name in
+# LLM_BACKENDS; empty = a local heuristic, no model calls). The queue holds
+# TITLE_QUEUE_SIZE chats; every TITLE_SWEEP_INTERVAL seconds untitled chats it
+# missed are queued again. With TITLE_ENABLED each server worker (asgi.py,
+# wsgi.py) runs one titler thread; turn it off to leave titles to
+# `manage.py title_chats`.
+TITLE_ENABLED = os.environ.get('TITLE_ENABLED', 'True').lower() == 'true'
+TITLE_BACKEND = os.environ.get('TITLE_BACKEND', '')
+TITLE_BATCH_SIZE = int(os.environ.get('TITLE_BATCH_SIZE', '20'))
+TITLE_BATCH_WAIT = float(os.environ.get('TITLE_BATCH_WAIT', '2'))
+TITLE_QUEUE_SIZE = int(os.environ.get('TITLE_QUEUE_SIZE', '1000'))
+TITLE_SWEEP_INTERVAL = int(os.environ.get('TITLE_SWEEP_INTERVAL', '300'))
+
+# Uploaded images are checked against these budgets, downscaled so the longest
+# side is at most IMAGE_MAX_SIDE and re-encoded as JPEG before the model sees them.
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('IMAGE_MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '60000000'))
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', '1536'))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '4'))
+
+# Max number of model calls one process keeps in flight; extra turns wait for a
+# slot, taking turns across users (LLM_FAIR_QUEUE) rather than first come first served.
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+LLM_FAIR_QUEUE = os.environ.get('LLM_FAIR_QUEUE', 'True').lower() == 'true'
+
+# Admission control for chat turns, in estimated model tokens (prompt, history
+# and reply): each user and the service as a whole have a token bucket that
+# refills at *_TOKENS_PER_MINUTE, up to one minute's worth. Turns over budget get
+# 429 with Retry-After. RATE_LIMIT_STORE 'local' keeps buckets per process;
+# 'database' shares them between workers.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'local')
+RATE_LIMIT_USER_TOKENS_PER_MINUTE = int(os.environ.get('RATE_LIMIT_USER_TOKENS_PER_MINUTE', '100000'))
+RATE_LIMIT_GLOBAL_TOKENS_PER_MINUTE = int(os.environ.get('RATE_LIMIT_GLOBAL_TOKENS_PER_MINUTE', '2000000'))
+RATE_LIMIT_REPLY_TOKENS = int(os.environ.get('RATE_LIMIT_REPLY_TOKENS', '1000'))
+
+# Per-request timings, query counts and model latency histograms (Server-Timing
+# headers and /api/metrics/). The endpoint is open to staff users and to
+# scrapers sending `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Soft-deleted chats are hard-deleted PURGE_RETENTION_DAYS after deletion, by
+# `manage.py purge_deleted` or, with PURGE_INTERVAL (seconds) set, by a
+# background thread in each worker doing at most PURGE_MAX_BATCHES batches a run.
+PURGE_RETENTION_DAYS = int(os.environ.get('PURGE_RETENTION_DAYS', '30'))
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '200'))
+PURGE_INTERVAL = int(os.environ.get('PURGE_INTERVAL', '0'))
+PURGE_MAX_BATCHES = int(os.environ.get('PURGE_MAX_BATCHES', '50'))
+
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 
+# Google's ID-token signing certificates, cached for their Cache-Control max-age
+# in memory and in GOOGLE_CERTS_CACHE_FILE so restarts don't refetch them.
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_CERTS_CACHE_FILE = os.environ.get(
+    'GOOGLE_CERTS_CACHE_FILE', os.path.join(tempfile.gettempdir(), 'rgpt_google_certs.json')
+)
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get('GOOGLE_HTTP_POOL_SIZE', '10'))
+
 REST_AUTH = {
     'USER_DETAILS_SERIALIZER': 'api.serializers.UserSerializer',
 }